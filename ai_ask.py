@@ -0,0 +1,76 @@
+"""
+Thin client for the ai_assistant daemon (python ai_assistant.py --serve).
+
+    python ai_ask.py "how do I undo the last git commit?"
+    git diff | python ai_ask.py --history review "review this diff"
+    python ai_ask.py '/analyze ./src "where is the config parsed?"'
+
+Only the standard library is imported, so a one-off question costs a socket round trip
+instead of a full start-up of the assistant. Piped input is appended to the question.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+# Same rule as APP_CACHE_DIR in ai_assistant.py: a daemon run with the fake client listens under fake/
+APP_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai_assistant")
+if os.environ.get("AI_ASSISTANT_FAKE_CLIENT") == "1":
+    APP_CACHE_DIR = os.path.join(APP_CACHE_DIR, "fake")
+DAEMON_SOCKET = os.environ.get("AI_ASSISTANT_SOCKET") or os.path.join(APP_CACHE_DIR, "daemon.sock")
+
+
+def parse_arguments(argv=None):
+    """Parses the command line."""
+    parser = argparse.ArgumentParser(description="Ask the running ai_assistant daemon a question.")
+    parser.add_argument('question', nargs='+', help="the question (or an /analyze command)")
+    parser.add_argument('--history', metavar='FILE', help="history file of the conversation (default: the daemon's own)")
+    parser.add_argument('-l', '--language', choices=['en', 'ru', 'tr'], help="language of a new conversation")
+    parser.add_argument('--socket', metavar='PATH', default=DAEMON_SOCKET, help=f"daemon socket (default: {DAEMON_SOCKET})")
+    return parser.parse_args(argv)
+
+
+def ask(request, socket_path, out=sys.stdout):
+    """Sends one request and writes the streamed reply to out. Returns the exit code."""
+    connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        connection.connect(socket_path)
+    except OSError:
+        # NOTE: These strings are not localized because the thin client never loads the assistant
+        print(f"The assistant daemon is not running ({socket_path}). Start it with: python ai_assistant.py --serve", file=sys.stderr)
+        return 2
+
+    with connection, connection.makefile('rwb') as stream:
+        stream.write((json.dumps(request, ensure_ascii=False) + "\n").encode('utf-8'))
+        stream.flush()
+        for line in stream:
+            message = json.loads(line.decode('utf-8'))
+            if 'text' in message:
+                out.write(message['text'])
+                out.flush()
+            elif 'error' in message:
+                print(message['error'], file=sys.stderr)
+                return 1
+            elif message.get('done'):
+                out.write("\n")
+                return 0
+    print("The assistant daemon closed the connection before the reply was complete.", file=sys.stderr)
+    return 1
+
+
+def main(argv=None):
+    args = parse_arguments(argv)
+    prompt = " ".join(args.question)
+    if not sys.stdin.isatty() and not prompt.lower().startswith(("/analyze ", "/analyse ")):
+        piped = sys.stdin.read()
+        if piped.strip():
+            prompt = f"{prompt}\n\n{piped}"
+
+    request = {'prompt': prompt, 'history': args.history, 'language': args.language, 'cwd': os.getcwd()}
+    return ask(request, args.socket)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
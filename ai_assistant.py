@@ -1,28 +1,217 @@
 import os
+import io
 import sys
 import re
 import subprocess
 import glob
 import time
+import json
+import hashlib
+import random
+import zlib
+import mmap
+import struct
 import platform 
+import threading
+import queue
+import argparse
+from contextlib import redirect_stdout
+from collections import deque
+from collections.abc import Mapping, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
-from google import genai
-from google.genai.errors import APIError
-from google.genai import types
-# Requires: pip install SpeechRecognition pyaudio
-import speech_recognition as sr
+# NOTE: google.genai and speech_recognition are imported lazily (see load_genai / load_speech_recognition),
+# asyncio only by batch mode
 # --- GLOBAL CONSTANTS AND SETUP ---
 MODEL_NAME = "gemini-2.5-flash-lite" 
 HISTORY_LIMIT = 10 
+HISTORY_TAIL_BLOCK_SIZE = 8192  # Shell history files are read backwards in blocks of this size
 TEMP_FILE_LIST = [] 
 
 # Global state variables
 CURRENT_LANGUAGE = 'en'  # Default language is English
 HISTORY_PATTERN = "*.chat_history.txt"
 CURRENT_HISTORY_FILE = None 
+CURRENT_JOURNAL = None  # ChatJournal for CURRENT_HISTORY_FILE
 
-# Initialize Speech Recognizer
-r = sr.Recognizer()
+# History journal: turns are appended as JSON lines, fsync is batched
+HISTORY_FSYNC_EVERY = 8  # fsync after this many appended entries...
+HISTORY_FSYNC_INTERVAL = 5.0  # ...or after this many seconds, whichever comes first
+
+# Compressed history container (zlib frame per message + offset index, memory-mapped when loaded)
+HISTORY_COMPRESSION = False  # True: new histories are containers and loaded JSON-lines histories are migrated
+HISTORY_COMPRESSION_LEVEL = 6
+CONTAINER_MAGIC = b"AICHZ1\n"
+INDEX_MAGIC = b"AICHI1\n"
+CONTAINER_HEADER_SIZE = len(CONTAINER_MAGIC) + 8  # Magic + random container id (repeated in the index header)
+HISTORY_FRAME = struct.Struct("<IIIB")  # Payload length, CRC-32 of the payload, token estimate, role
+HISTORY_INDEX_ENTRY = struct.Struct("<QIIB")  # Frame offset, frame length, token estimate, role
+HISTORY_ROLES = ('user', 'model')
+
+# Context window: only recent turns within the budget are resent, older ones are summarized
+CONTEXT_TOKEN_BUDGET = 32000  # Approximate history tokens sent with every turn
+CONTEXT_TRIM_RATIO = 0.6  # When over budget, trim the window down to this share of it
+CONTEXT_CHARS_PER_TOKEN = 4  # Rough estimate used instead of a count_tokens round trip
+CONTEXT_SUMMARY_RETRY_DELAY = 5 * 60  # After a failed summary, compaction of that history pauses this long
+CONTEXT_SUMMARY_RETRY_AT = {}  # History file -> time before which no new summary is attempted
+# Text parts that carry an /analyze corpus: not journaled, not counted against the budget, kept on compaction
+CORPUS_TEXT_PREFIXES = ("[INLINE FILES]", "[MAP-REDUCE FINDINGS]")
+# Exchanges a rebuilt chat starts with (summary, corpus label); like the corpus, not counted against the budget
+CONTEXT_PREAMBLE_PREFIXES = ("[CONTEXT: SUMMARY OF EARLIER CONVERSATION]", "[CONTEXT: FILES OF THE LATEST /analyze]")
+
+# Use the in-process fake client from fake_genai.py instead of the Gemini API (offline testing)
+USE_FAKE_CLIENT = os.environ.get("AI_ASSISTANT_FAKE_CLIENT") == "1"
+
+# Local cache directory (upload manifest and other persistent state). Runs with the fake client get
+# a separate one, so fake uploads, metrics and catalog entries never leak into real sessions.
+USER_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai_assistant")
+APP_CACHE_DIR = os.path.join(USER_CACHE_DIR, "fake") if USE_FAKE_CLIENT else USER_CACHE_DIR
+
+# Upload cache: reuse remote files across /analyze calls and sessions
+UPLOAD_CACHE_ENABLED = True
+UPLOAD_CACHE_FILE = os.path.join(APP_CACHE_DIR, "upload_cache.json")
+UPLOAD_CACHE_DEFAULT_TTL = 47 * 60 * 60  # Files API keeps uploads for 48 hours
+UPLOAD_CACHE_SAFETY_MARGIN = 30 * 60  # Do not reuse handles that expire sooner than this
+
+# Maximum number of simultaneous files.upload calls during /analyze
+UPLOAD_CONCURRENCY = 8
+
+# Session cleanup: concurrent deletes, plus a local ledger of temporary uploads so that
+# files left behind by crashed sessions are removed by the next start
+CLEANUP_CONCURRENCY = 16
+UPLOAD_LEDGER_DIR = os.path.join(APP_CACHE_DIR, "upload_ledger")
+UPLOAD_LEDGER_MAX_AGE = 48 * 60 * 60  # Remote files expire by themselves after this
+
+# Folder scanner for /analyze: file types, ignore rules and budgets
+ANALYZE_ALLOWED_EXTENSIONS = ('.py', '.txt', '.md', '.html', '.css', '.js', '.json', '.sh', '.log', '.conf', '.png', '.jpg', '.jpeg')
+ANALYZE_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+ANALYZE_MAX_FILE_SIZE = 20 * 1024 * 1024  # Per-file limit
+ANALYZE_MAX_TOTAL_BYTES = 100 * 1024 * 1024  # Budget for one /analyze call
+ANALYZE_MAX_FILES = 500  # Budget for one /analyze call
+# Text files up to this size are sent inline, bundled into a few text parts instead of one upload each
+# (0 disables bundling; override per run with /analyze ... --bundle=<bytes>[k|m])
+BUNDLE_SMALL_FILE_THRESHOLD = 64 * 1024
+BUNDLE_MAX_PART_BYTES = 512 * 1024  # Maximum size of one inline bundle part
+# Always skipped, in addition to .gitignore files found in the analyzed tree (gitignore syntax)
+ANALYZE_DEFAULT_IGNORES = [
+    '.git/', '.hg/', '.svn/', 'node_modules/', 'venv/', '.venv/', 'env/', '__pycache__/',
+    '.tox/', '.nox/', '.mypy_cache/', '.pytest_cache/', '.ruff_cache/', '.idea/', '.vscode/',
+    'build/', 'dist/', 'target/', 'out/', '*.egg-info/', '.next/', '.cache/', 'coverage/',
+    '*.min.js', '*.map', '*.chat_history.txt',
+]
+
+# Map-reduce /analyze (--map-reduce): text that does not fit into one context (large logs, big folders)
+# is split into shards that are analyzed in parallel, then the partial answers are merged
+MAP_REDUCE_SHARD_BYTES = 1024 * 1024  # Text per map call, about 260k tokens (override per run with --shard=<bytes>[k|m])
+MAP_REDUCE_PARALLELISM = 8  # Map/merge calls in flight at once (the API guard limits still apply)
+MAP_REDUCE_REDUCE_BYTES = 512 * 1024  # Partial answers are merged in groups until they fit into this
+MAP_REDUCE_MAX_TOTAL_BYTES = 2 * 1024 * 1024 * 1024  # Budget for one run (no per-file limit)
+MAP_REDUCE_MAX_FILES = 20000
+MAP_REDUCE_EXTENSIONS = tuple(ext for ext in ANALYZE_ALLOWED_EXTENSIONS if ext not in ANALYZE_IMAGE_EXTENSIONS)
+
+# Images sent with /analyze are downsampled, recompressed and stripped of metadata first (needs Pillow)
+IMAGE_PREPROCESS_ENABLED = True
+IMAGE_MAX_DIMENSION = 2048  # Longest side in pixels after downsampling
+IMAGE_JPEG_QUALITY = 85
+IMAGE_PREPROCESS_MIN_BYTES = 256 * 1024  # Smaller images are uploaded as they are
+IMAGE_WORKERS = max(1, min(8, os.cpu_count() or 1))  # Images processed in parallel (alongside uploads)
+IMAGE_CACHE_DIR = os.path.join(APP_CACHE_DIR, "images")  # Processed variants, keyed by source hash and settings
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+PILLOW = None  # (Image, ImageOps) once imported, False if Pillow is not installed
+
+# Print model replies token by token as they arrive (send_message_stream)
+STREAM_RESPONSES = True
+
+# Server-side context caching of an /analyze corpus for follow-up questions (or per run with --cache).
+# The cache is dropped after CONTEXT_CACHE_TTL seconds without a question and extended while in use.
+CONTEXT_CACHE_DEFAULT = False
+CONTEXT_CACHE_TTL = 10 * 60
+CONTEXT_CACHE_REFRESH_RATIO = 0.5  # Extend the TTL once less than this share of it is left
+ACTIVE_CONTEXT_CACHE = None  # {'name', 'folder', 'expires_at', 'corpus'} of the cache attached to follow-ups
+
+# SQLite catalog of all history files (titles, turn counts, full-text index) for the menu and /search
+HISTORY_CATALOG_FILE = os.path.join(APP_CACHE_DIR, "history_catalog.sqlite3")
+HISTORY_PAGE_SIZE = 20  # Histories listed per page of the selection menu
+SEARCH_RESULT_LIMIT = 10
+HISTORY_CATALOG = {'connection': None, 'fts': False, 'failed': False}
+HISTORY_CATALOG_LOCK = threading.Lock()
+
+# Per-turn metrics (timings, upload volume, token usage) appended to a rotating JSONL file; see /stats
+METRICS_ENABLED = True
+METRICS_FILE = os.path.join(APP_CACHE_DIR, "metrics.jsonl")
+METRICS_MAX_BYTES = 5 * 1024 * 1024  # Rotate to metrics.jsonl.1, .2, ... once the file reaches this size
+METRICS_BACKUP_COUNT = 3
+METRICS_SESSION_LIMIT = 10000  # Turns of this process kept in memory for /stats
+STATS_FIELDS = ('total_s', 'ttft_s', 'response_s', 'scan_s', 'upload_s', 'map_s', 'reduce_s', 'history_save_s',
+                'speech_s', 'recognition_s', 'input_tokens', 'cached_tokens', 'output_tokens',
+                'files_uploaded', 'bytes_uploaded')
+SESSION_METRICS = []
+METRICS_LOCK = threading.Lock()
+
+# Shared API guard (see ApiGuard): token bucket, concurrency cap and retries for every remote call
+RATE_LIMIT_RPM = 1000  # Requests per minute for all calls together; match your project's quota (0 disables)
+RATE_LIMIT_BURST = 20
+API_MAX_CONCURRENCY = 16  # Uploads, deletes and model calls in flight at once (also caps --parallel)
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0  # Backoff doubles per attempt (full jitter), capped at RETRY_MAX_DELAY
+RETRY_MAX_DELAY = 30.0
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+API_STATS = {'calls': 0, 'retries': 0, 'throttled': 0, 'failures': 0, 'rate_limit_waits': 0, 'rate_limit_wait_s': 0.0}
+API_STATS_LOCK = threading.Lock()
+
+# Batch mode (--batch): model calls in flight at once (override with --parallel)
+BATCH_PARALLELISM = 8
+
+# Session manager (many concurrent conversations in one process, see SessionManager)
+SESSION_CONCURRENCY = 16  # Model calls in flight across all sessions
+SESSION_IDLE_TIMEOUT = 30 * 60  # Sessions unused for this many seconds are closed by close_idle_sessions
+SESSION_HISTORY_DIR = os.path.join(APP_CACHE_DIR, "sessions")  # History files of sessions that name none
+
+# Local daemon (--serve) answering ai_ask.py over a Unix domain socket
+DAEMON_SOCKET = os.environ.get("AI_ASSISTANT_SOCKET") or os.path.join(APP_CACHE_DIR, "daemon.sock")
+DAEMON_DEFAULT_HISTORY = os.path.join(APP_CACHE_DIR, "daemon.chat_history.txt")  # Used when ai_ask.py names no history
+DAEMON_SESSION_IDLE = 30 * 60  # Close conversations that were not used for this many seconds
+
+# Voice mode: maximum length of one captured phrase, and how often the capture thread checks for shutdown
+VOICE_PHRASE_TIME_LIMIT = 10
+VOICE_LISTEN_POLL_TIMEOUT = 1
+
+# Microphone calibration (energy threshold) is saved per input device and reused on the next start
+MIC_CALIBRATION_FILE = os.path.join(APP_CACHE_DIR, "mic_calibration.json")
+MIC_CALIBRATION_MAX_AGE = 7 * 24 * 60 * 60
+
+# Adaptive end-of-utterance detection: the silence that ends a phrase (pause_threshold) is tuned
+# from observed speech, and the phrase length cap is raised so long questions are not cut
+VOICE_ADAPTIVE_ENDPOINTING = True
+VOICE_ADAPTIVE_PHRASE_TIME_LIMIT = 30
+VOICE_PAUSE_THRESHOLD_START = 0.6
+VOICE_PAUSE_THRESHOLD_RANGE = (0.4, 1.5)
+VOICE_SHORT_UTTERANCE_SECONDS = 2.5
+
+# Speech-to-text backend: 'google' (online), 'vosk' or 'whisper' (offline, CPU); None asks at voice mode start
+SPEECH_BACKEND = None
+# Vosk models per language (download from https://alphacephei.com/vosk/models and unpack here)
+VOSK_MODEL_DIR = os.path.join(USER_CACHE_DIR, "vosk")  # Expects <dir>/<lang code>, e.g. ~/.cache/ai_assistant/vosk/en
+# faster-whisper model size used by the 'whisper' backend (tiny, base, small, ...)
+WHISPER_MODEL_SIZE = "base"
+
+# neofetch output is cached on disk per host/kernel for this many seconds
+SYSINFO_CACHE_FILE = os.path.join(APP_CACHE_DIR, "sysinfo_cache.json")
+SYSINFO_CACHE_TTL = 24 * 60 * 60
+
+# Lazily imported modules (filled in by load_genai / load_speech_recognition)
+genai = None
+types = None
+APIError = None
+sr = None
+r = None  # Speech Recognizer, created when voice mode starts
+
+# Background client construction (see start_client_warmup)
+CLIENT_WARMUP = {'thread': None, 'client': None, 'error': None}
+GENAI_IMPORT_LOCK = threading.Lock()
+
+# Background gathering of the first-prompt context (see start_context_prefetch)
+CONTEXT_PREFETCH = {'system_info': None, 'terminal_history': None}
 
 # Load environment variables from the .env file
 load_dotenv() 
@@ -37,8 +226,24 @@ LOCALIZATION_STRINGS = {
         'exit_command': "exit or quit",
         'error_api': "Gemini API Error: ",
         'error_unexpected': "Unexpected error: ",
+        'error_api_continue': "   The request failed even after retries. Your history is intact; try again in a moment.",
+        'api_stats': "📶 API: {calls} calls, {retries} retries, {throttled} throttled (429), {failures} failed, {waits} rate-limit waits ({wait_s:.1f}s)",
         'error_init': "Gemini initialization error: ",
         'error_api_key': "Error: 'GEMINI_API_KEY' environment variable not found.",
+        'batch_start': "Batch: {jobs} jobs, up to {parallel} in parallel, model {model}",
+        'batch_progress': "  Batch: {done}/{total} done, {failed} failed",
+        'history_converted': "  {name}: {before_mb:.2f} MB -> {after_mb:.2f} MB",
+        'history_convert_summary': "{count} histories converted: {before_mb:.2f} MB -> {after_mb:.2f} MB",
+        'batch_summary': "Batch finished: {ok} succeeded, {failed} failed in {elapsed:.1f}s",
+        'batch_no_jobs': "Batch: no jobs found in {path}",
+        'batch_invalid_job': "Invalid batch line (expected a prompt, an /analyze command or a JSON object with \"prompt\"): {error}",
+        'daemon_listening': "Daemon listening on {path} (model {model}). Ask with ai_ask.py, stop with Ctrl+C.",
+        'daemon_already_running': "Another daemon is already listening on {path}.",
+        'daemon_unsupported': "The daemon needs Unix domain sockets, which this platform does not support.",
+        'session_empty_prompt': "Empty question.",
+        'session_analyze_disabled': "/analyze is not available here.",
+        'session_analyze_outside_root': "/analyze can only read folders inside the shared analysis folder.",
+        'daemon_stopping': "Stopping the daemon and saving histories...",
         
         # History Selection
         'history_title': "History Selection",
@@ -51,22 +256,64 @@ LOCALIZATION_STRINGS = {
         'history_loading_existing': "Loading existing history: ",
         'history_creating_new': "Creating new history: ",
         'history_invalid_number_1': "Invalid number. Enter a number from 1 to ",
+        'history_prompt_3': "3. '>' / '<' for the next/previous page, '?text' to filter by name or content ('?' shows all).",
+        'history_entry': "  [{index}] {name} — {title} ({turns} turns, {modified})",
+        'history_page': "   Page {page} of {pages}",
+        'history_filter_active': "📚 Histories matching \"{filter}\" ({total}):",
+        'context_summarizing': "🗜️ Summarizing {count} older messages to keep the context small...",
+        'context_summary_failed': "  Warning: Could not summarize older messages, sending them in full: {error}",
         
         # Runtime Instructions (Text Mode)
         'chat_mode_title': "Gemini CLI Chat Mode. History: ",
         'command_title': "COMMANDS:",
         'command_1': "1. Dialogue: Just type your question.",
-        'command_2': "2. Analyze:  /analyze <folder_path> \"Your question\" (Supports code, text, PNG, JPG)",
-        'command_3': "3. Exit:     exit or quit",
+        'command_2': "2. Analyze:  /analyze <folder_path> \"Your question\" [--bundle=64k] [--cache] [--map-reduce] (Supports code, text, PNG, JPG)",
+        'command_3': "3. Stats:    /stats [all] (response times and token usage: this session or all sessions)",
+        'command_4': "4. Search:   /search <words> (finds messages in all saved histories)",
+        'command_5': "5. Exit:     exit or quit",
+        'search_usage': "🔎 Usage: /search <words>",
+        'search_none': "🔎 Nothing found for \"{query}\".",
+        'search_results': "🔎 {count} match(es) for \"{query}\":",
+        'search_unavailable': "🔎 Search is unavailable: the history catalog could not be opened.",
+        'stats_title': "📊 {turns} turns ({failed} failed), {scope}:",
+        'stats_scope_session': "this session",
+        'stats_scope_all': "all sessions in the metrics file",
+        'stats_totals': "  Totals: {input} input tokens ({cached} cached), {output} output tokens, {files} files / {size_mb:.1f} MB uploaded",
+        'stats_empty': "📊 No turns recorded yet.",
         'saving_history': "Saving history and ending session.",
+        'response_timing': "⏱️ First token: {ttft:.2f}s, total: {total:.2f}s",
         
         # Analyze/Upload
         'analyze_start': "Starting analysis of folder: ",
         'analyze_folder': "Analyzing folder: ",
         'upload_skipping_large': "Skipping large file: ",
+        'scan_summary': "  Scan: {files} files selected ({size_mb:.1f} MB) in {elapsed:.2f}s",
+        'scan_skipped': "  Skipped {count} ({reason}): {examples}",
+        'scan_reason_ignored': "ignore rules",
+        'scan_reason_type': "unsupported type",
+        'scan_reason_large': "larger than the per-file limit",
+        'scan_reason_budget': "over the file count/size budget",
+        'scan_reason_error': "unreadable",
         'upload_file': "  Uploading: {file_name} as {mime_type}...",
         'upload_fallback': "  [Fallback]: Uploading without explicit mime_type...",
         'upload_failed': "  Failed to upload {file_name}: {error}",
+        'upload_cached': "  Reusing cached upload: {file_name}",
+        'upload_duplicate': "  Skipping duplicate content: {file_name}",
+        'upload_cache_evicted': "🗑️ Removed {count} unavailable file(s) from the upload cache; run /analyze again to upload them afresh.",
+        'image_preprocessed': "  🖼️ {count} image(s) resized/recompressed before upload: {before_mb:.1f} MB -> {after_mb:.1f} MB",
+        'image_pillow_missing': "  💡 Install Pillow (pip install Pillow) to shrink large images before upload; they are sent unchanged.",
+        'map_reduce_start': "🧩 Map-reduce: {files} files ({size_mb:.1f} MB) in {parts} parts, up to {parallel} at a time",
+        'map_reduce_progress': "  Analyzed {done}/{total} parts ({relevant} with findings, {failed} failed, {elapsed:.0f}s)",
+        'map_reduce_merging': "  Merging {count} partial answers in {groups} groups...",
+        'map_reduce_merge_failed': "  Could not merge a group of partial answers (kept as they are): {error}",
+        'map_reduce_failed_parts': "  ⚠️ {count} part(s) could not be analyzed: {parts}",
+        'map_reduce_hint': "  💡 Some text files are too large or over the budget; add --map-reduce to analyze all of them in parts.",
+        'upload_bundled': "  Bundled {count} small text files into {parts} inline part(s) ({size_kb:.1f} KB)",
+        'upload_progress': "  Uploaded {done}/{total} files ({size_mb:.1f} MB, {rate_mb:.2f} MB/s, {failed} failed)",
+        'context_cache_created': "🗄️ Files cached on the server for follow-up questions (kept while you ask, dropped after {ttl} min of inactivity)",
+        'context_cache_failed': "  Note: Server-side caching is unavailable ({error}); the files are sent with the question instead.",
+        'context_cache_expired': "🗄️ The server-side cache of the last /analyze has expired; its files are sent with this question instead.",
+        'context_cache_cleanup_warning': "  Warning: Failed to delete the cached context {name}: {error}",
         'analyze_usage_error': "🛑 Usage Error: /analyze folder_name \"Your analysis prompt\"",
         'analyze_usage_note': "   NOTE: The prompt (question) must be enclosed in double quotes.",
         'error_folder_not_found': "Error: Folder path not found: ",
@@ -75,6 +322,7 @@ LOCALIZATION_STRINGS = {
         'analyze_failed_no_files': "🛑 Analysis failed for path '{path}'. Path check result: '{check}'. No valid files were uploaded.",
         'cleanup_start': "Cleaning up uploaded files...",
         'cleanup_warning': "  Warning: Failed to delete {file_name}: {error}",
+        'cleanup_orphans': "🧹 Removed {count} uploaded files left over from previous sessions.",
         
         # Language Selection
         'lang_title': "Language Selection",
@@ -95,6 +343,13 @@ LOCALIZATION_STRINGS = {
         'mode_input': "Your choice [1/2]: ",
         'mode_selected_text': "Starting Standard Text Chat...",
         'mode_selected_voice': "Starting Voice Chat Mode (Listening for input)...",
+        'stt_title': "Speech Recognition Engine",
+        'stt_1': "[1] Google (online, default)",
+        'stt_2': "[2] Vosk (offline, requires: pip install vosk + a language model)",
+        'stt_3': "[3] Whisper (offline on CPU, requires: pip install faster-whisper)",
+        'stt_input': "Your choice [1/2/3]: ",
+        'stt_selected': "Speech recognition engine: {backend}",
+        'stt_load_failed': "❌ Could not load the '{backend}' engine ({error}). Falling back to Google.",
         
         # --- VOICE SPECIFIC STRINGS ---
         'voice_prompt': ">> Speak: ",
@@ -104,6 +359,9 @@ LOCALIZATION_STRINGS = {
         'voice_error_speech': "❌ Could not understand audio. Please try again.",
         'voice_error_mic': "❌ No suitable microphone found or error during audio capture.",
         'voice_sending': "✨ Sending to Gemini: ",
+        'voice_calibrated': "🔊 Noise level adjusted. Ready.",
+        'voice_calibration_loaded': "🔊 Using saved microphone calibration (energy threshold {threshold:.0f}). Ready.",
+        'voice_stage_timing': "⏱️ Speech {speech:.1f}s | queued {wait:.2f}s | recognition {recognition:.2f}s | model {model:.2f}s",
         
         # System Instruction (For Gemini)
         'system_instruction': "You are a highly intelligent CLI assistant. Your task is to analyze the provided files (code, text, images) and command history, responding briefly, accurately, and using Markdown for code formatting. If files are attached, focus on their analysis. If the user attempts to upload files but the operation failed, politely explain that files could not be found or the folder does not exist, and ask them to check the path.",
@@ -115,8 +373,24 @@ LOCALIZATION_STRINGS = {
         'exit_command': "exit или quit",
         'error_api': "Ошибка API Gemini: ",
         'error_unexpected': "Непредвиденная ошибка: ",
+        'error_api_continue': "   Запрос не удался даже после повторных попыток. История не пострадала; попробуйте еще раз чуть позже.",
+        'api_stats': "📶 API: вызовов {calls}, повторов {retries}, ограничений 429: {throttled}, ошибок {failures}, ожиданий лимита {waits} ({wait_s:.1f} с)",
         'error_init': "Ошибка инициализации Gemini: ",
         'error_api_key': "Ошибка: Не найдена переменная окружения 'GEMINI_API_KEY'.",
+        'batch_start': "Пакетный режим: заданий {jobs}, параллельно до {parallel}, модель {model}",
+        'batch_progress': "  Пакет: выполнено {done}/{total}, ошибок: {failed}",
+        'history_converted': "  {name}: {before_mb:.2f} МБ -> {after_mb:.2f} МБ",
+        'history_convert_summary': "Преобразовано историй: {count}, {before_mb:.2f} МБ -> {after_mb:.2f} МБ",
+        'batch_summary': "Пакет завершен: успешно {ok}, ошибок {failed} за {elapsed:.1f} с",
+        'batch_no_jobs': "Пакетный режим: в {path} нет заданий",
+        'batch_invalid_job': "Некорректная строка пакета (ожидается запрос, команда /analyze или JSON-объект с \"prompt\"): {error}",
+        'daemon_listening': "Демон слушает {path} (модель {model}). Задавайте вопросы через ai_ask.py, остановка — Ctrl+C.",
+        'daemon_already_running': "На {path} уже работает другой демон.",
+        'daemon_unsupported': "Демону нужны Unix-сокеты, которые эта платформа не поддерживает.",
+        'session_empty_prompt': "Пустой вопрос.",
+        'session_analyze_disabled': "Команда /analyze здесь недоступна.",
+        'session_analyze_outside_root': "/analyze может читать только папки внутри общей папки для анализа.",
+        'daemon_stopping': "Остановка демона и сохранение истории...",
         
         # History Selection
         'history_title': "Выбор истории",
@@ -129,22 +403,64 @@ LOCALIZATION_STRINGS = {
         'history_loading_existing': "Загрузка существующей истории: ",
         'history_creating_new': "Создание новой истории: ",
         'history_invalid_number_1': "Неверный номер. Введите число от 1 до ",
+        'history_prompt_3': "3. '>' / '<' — следующая/предыдущая страница, '?текст' — фильтр по имени или содержимому ('?' показывает все).",
+        'history_entry': "  [{index}] {name} — {title} (ходов: {turns}, {modified})",
+        'history_page': "   Страница {page} из {pages}",
+        'history_filter_active': "📚 Истории, подходящие под \"{filter}\" ({total}):",
+        'context_summarizing': "🗜️ Сжатие {count} старых сообщений в краткое резюме...",
+        'context_summary_failed': "  Предупреждение: Не удалось сжать старые сообщения, они будут отправлены полностью: {error}",
         
         # Runtime Instructions (Text Mode)
         'chat_mode_title': "Gemini CLI Режим Чата. История: ",
         'command_title': "КОМАНДЫ:",
         'command_1': "1. Диалог: Просто введите ваш вопрос.",
-        'command_2': "2. Анализ:  /analyze <путь_к_папке> \"Ваш вопрос\" (Поддерживает код, текст, PNG, JPG)",
-        'command_3': "3. Выход:     exit или quit",
+        'command_2': "2. Анализ:  /analyze <путь_к_папке> \"Ваш вопрос\" [--bundle=64k] [--cache] [--map-reduce] (Поддерживает код, текст, PNG, JPG)",
+        'command_3': "3. Статистика: /stats [all] (время ответа и расход токенов: эта сессия или все сессии)",
+        'command_4': "4. Поиск:     /search <слова> (ищет сообщения во всех сохранённых историях)",
+        'command_5': "5. Выход:     exit или quit",
+        'search_usage': "🔎 Использование: /search <слова>",
+        'search_none': "🔎 По запросу \"{query}\" ничего не найдено.",
+        'search_results': "🔎 Найдено совпадений для \"{query}\": {count}",
+        'search_unavailable': "🔎 Поиск недоступен: не удалось открыть каталог историй.",
+        'stats_title': "📊 Ходов: {turns} (с ошибкой: {failed}), {scope}:",
+        'stats_scope_session': "эта сессия",
+        'stats_scope_all': "все сессии из файла метрик",
+        'stats_totals': "  Итого: входных токенов {input} (из кэша {cached}), выходных токенов {output}, загружено файлов {files} / {size_mb:.1f} МБ",
+        'stats_empty': "📊 Пока нет записанных ходов.",
         'saving_history': "Сохранение истории и завершение сессии.",
+        'response_timing': "⏱️ Первый токен: {ttft:.2f} с, всего: {total:.2f} с",
         
         # Analyze/Upload
         'analyze_start': "Начало анализа папки: ",
         'analyze_folder': "Анализируется папка: ",
         'upload_skipping_large': "Пропуск большого файла: ",
+        'scan_summary': "  Сканирование: выбрано файлов: {files} ({size_mb:.1f} МБ) за {elapsed:.2f} с",
+        'scan_skipped': "  Пропущено {count} ({reason}): {examples}",
+        'scan_reason_ignored': "правила игнорирования",
+        'scan_reason_type': "неподдерживаемый тип",
+        'scan_reason_large': "больше лимита на файл",
+        'scan_reason_budget': "превышен лимит количества/объёма",
+        'scan_reason_error': "нет доступа",
         'upload_file': "  Загрузка: {file_name} как {mime_type}...",
         'upload_fallback': "  [Резерв]: Загрузка без явного mime_type из-за старой версии SDK...",
         'upload_failed': "  Не удалось загрузить {file_name}: {error}",
+        'upload_cached': "  Используется кэшированная загрузка: {file_name}",
+        'upload_duplicate': "  Пропуск файла с повторяющимся содержимым: {file_name}",
+        'upload_cache_evicted': "🗑️ Из кэша загрузок удалено недоступных файлов: {count}; выполните /analyze снова, чтобы загрузить их заново.",
+        'image_preprocessed': "  🖼️ Изображений уменьшено/пережато перед загрузкой: {count}, {before_mb:.1f} МБ -> {after_mb:.1f} МБ",
+        'image_pillow_missing': "  💡 Установите Pillow (pip install Pillow), чтобы уменьшать большие изображения перед загрузкой; сейчас они отправляются без изменений.",
+        'map_reduce_start': "🧩 Map-reduce: файлов {files} ({size_mb:.1f} МБ), частей {parts}, одновременно до {parallel}",
+        'map_reduce_progress': "  Проанализировано частей {done}/{total} (с находками: {relevant}, ошибок: {failed}, {elapsed:.0f} с)",
+        'map_reduce_merging': "  Объединение частичных ответов: {count}, групп: {groups}...",
+        'map_reduce_merge_failed': "  Не удалось объединить группу частичных ответов (оставлены как есть): {error}",
+        'map_reduce_failed_parts': "  ⚠️ Не удалось проанализировать частей: {count} ({parts})",
+        'map_reduce_hint': "  💡 Некоторые текстовые файлы слишком большие или превышают лимит; добавьте --map-reduce, чтобы проанализировать их все по частям.",
+        'upload_bundled': "  Объединено небольших текстовых файлов: {count}, встроенных частей: {parts} ({size_kb:.1f} КБ)",
+        'upload_progress': "  Загружено {done}/{total} файлов ({size_mb:.1f} МБ, {rate_mb:.2f} МБ/с, ошибок: {failed})",
+        'context_cache_created': "🗄️ Файлы закешированы на сервере для уточняющих вопросов (хранятся, пока вы спрашиваете, и удаляются после {ttl} мин бездействия)",
+        'context_cache_failed': "  Примечание: Серверное кеширование недоступно ({error}); файлы отправляются вместе с вопросом.",
+        'context_cache_expired': "🗄️ Срок хранения серверного кэша последнего /analyze истек; его файлы будут отправлены вместе с этим вопросом.",
+        'context_cache_cleanup_warning': "  Предупреждение: Не удалось удалить закешированный контекст {name}: {error}",
         'analyze_usage_error': "🛑 Ошибка использования: /analyze folder_name \"Ваш запрос анализа\"",
         'analyze_usage_note': "   ПРИМЕЧАНИЕ: Запрос (вопрос) должен быть заключен в двойные кавычки.",
         'error_folder_not_found': "Ошибка: Путь к папке не найден: ",
@@ -153,6 +469,7 @@ LOCALIZATION_STRINGS = {
         'analyze_failed_no_files': "🛑 Анализ не удался для пути '{path}'. Результат проверки пути: '{check}'. Файлы не были загружены.",
         'cleanup_start': "Очистка загруженных файлов...",
         'cleanup_warning': "  Предупреждение: Не удалось удалить {file_name}: {error}",
+        'cleanup_orphans': "🧹 Удалено файлов, оставшихся от прошлых сессий: {count}.",
 
         # Language Selection
         'lang_title': "Выбор языка",
@@ -173,6 +490,13 @@ LOCALIZATION_STRINGS = {
         'mode_input': "Ваш выбор [1/2]: ",
         'mode_selected_text': "Запуск Стандартного Текстового Чата...",
         'mode_selected_voice': "Запуск Голосового Чата (Ожидание голосового ввода)...",
+        'stt_title': "Движок распознавания речи",
+        'stt_1': "[1] Google (онлайн, по умолчанию)",
+        'stt_2': "[2] Vosk (офлайн, требуется: pip install vosk + языковая модель)",
+        'stt_3': "[3] Whisper (офлайн на CPU, требуется: pip install faster-whisper)",
+        'stt_input': "Ваш выбор [1/2/3]: ",
+        'stt_selected': "Движок распознавания речи: {backend}",
+        'stt_load_failed': "❌ Не удалось загрузить движок '{backend}' ({error}). Используется Google.",
         
         # --- VOICE SPECIFIC STRINGS ---
         'voice_prompt': ">> Скажите: ",
@@ -182,6 +506,9 @@ LOCALIZATION_STRINGS = {
         'voice_error_speech': "❌ Не удалось распознать речь. Попробуйте снова.",
         'voice_error_mic': "❌ Не найден подходящий микрофон или ошибка при захвате аудио.",
         'voice_sending': "✨ Отправляю в Gemini: ",
+        'voice_calibrated': "🔊 Уровень шума настроен. Готово.",
+        'voice_calibration_loaded': "🔊 Используется сохранённая калибровка микрофона (порог энергии {threshold:.0f}). Готово.",
+        'voice_stage_timing': "⏱️ Речь {speech:.1f} с | в очереди {wait:.2f} с | распознавание {recognition:.2f} с | модель {model:.2f} с",
         
         # System Instruction (For Gemini)
         'system_instruction': "Ты — высокоинтеллектуальный CLI-ассистент. Твоя задача — анализировать предоставленные файлы (код, текст, изображения) и историю команд, отвечая кратко, точно и используя Markdown для форматирования кода. Если файлы прикреплены, фокусируйся на их анализе. Если пользователь пытается загрузить файлы, но операция завершилась с ошибкой, вежливо объясни, что не удалось найти файлы или папка не существует, и попроси проверить путь.",
@@ -193,8 +520,24 @@ LOCALIZATION_STRINGS = {
         'exit_command': "çıkış veya çık",
         'error_api': "Gemini API Hatası: ",
         'error_unexpected': "Beklenmeyen hata: ",
+        'error_api_continue': "   İstek yeniden denemelere rağmen başarısız oldu. Geçmişiniz korunuyor; biraz sonra tekrar deneyin.",
+        'api_stats': "📶 API: {calls} çağrı, {retries} yeniden deneme, {throttled} kısıtlama (429), {failures} başarısız, {waits} hız sınırı beklemesi ({wait_s:.1f} sn)",
         'error_init': "Gemini başlatma hatası: ",
         'error_api_key': "Hata: 'GEMINI_API_KEY' ortam değişkeni bulunamadı.",
+        'batch_start': "Toplu iş: {jobs} görev, en fazla {parallel} paralel, model {model}",
+        'batch_progress': "  Toplu iş: {done}/{total} tamamlandı, {failed} başarısız",
+        'history_converted': "  {name}: {before_mb:.2f} MB -> {after_mb:.2f} MB",
+        'history_convert_summary': "{count} geçmiş dönüştürüldü: {before_mb:.2f} MB -> {after_mb:.2f} MB",
+        'batch_summary': "Toplu iş bitti: {ok} başarılı, {failed} başarısız, {elapsed:.1f} sn",
+        'batch_no_jobs': "Toplu iş: {path} içinde görev bulunamadı",
+        'batch_invalid_job': "Geçersiz toplu iş satırı (bir sorgu, /analyze komutu veya \"prompt\" içeren bir JSON nesnesi bekleniyordu): {error}",
+        'daemon_listening': "Arka plan hizmeti {path} üzerinde dinliyor (model {model}). ai_ask.py ile soru sorun, Ctrl+C ile durdurun.",
+        'daemon_already_running': "{path} üzerinde zaten başka bir arka plan hizmeti çalışıyor.",
+        'daemon_unsupported': "Arka plan hizmeti Unix soketlerine ihtiyaç duyar, bu platform bunları desteklemiyor.",
+        'session_empty_prompt': "Boş soru.",
+        'session_analyze_disabled': "/analyze burada kullanılamıyor.",
+        'session_analyze_outside_root': "/analyze yalnızca paylaşılan analiz klasörünün içindeki klasörleri okuyabilir.",
+        'daemon_stopping': "Arka plan hizmeti durduruluyor ve geçmiş kaydediliyor...",
         
         # History Selection
         'history_title': "Geçmiş Seçimi",
@@ -207,22 +550,64 @@ LOCALIZATION_STRINGS = {
         'history_loading_existing': "Mevcut geçmiş yükleniyor: ",
         'history_creating_new': "Yeni geçmiş oluşturuluyor: ",
         'history_invalid_number_1': "Geçersiz numara. 1 ile ",
+        'history_prompt_3': "3. Sonraki/önceki sayfa için '>' / '<', ada veya içeriğe göre filtrelemek için '?metin' ('?' hepsini gösterir).",
+        'history_entry': "  [{index}] {name} — {title} ({turns} tur, {modified})",
+        'history_page': "   Sayfa {page} / {pages}",
+        'history_filter_active': "📚 \"{filter}\" ile eşleşen geçmişler ({total}):",
+        'context_summarizing': "🗜️ Bağlamı küçük tutmak için {count} eski mesaj özetleniyor...",
+        'context_summary_failed': "  Uyarı: Eski mesajlar özetlenemedi, tamamı gönderiliyor: {error}",
         
         # Runtime Instructions (Text Mode)
         'chat_mode_title': "Gemini CLI Sohbet Modu. Geçmiş: ",
         'command_title': "KOMUTLAR:",
         'command_1': "1. Diyalog: Sadece sorunuzu yazın.",
-        'command_2': "2. Analiz:  /analyze <klasör_yolu> \"Sorunuz\" (Kod, metin, PNG, JPG destekler)",
-        'command_3': "3. Çıkış:     çıkış veya çık",
+        'command_2': "2. Analiz:  /analyze <klasör_yolu> \"Sorunuz\" [--bundle=64k] [--cache] [--map-reduce] (Kod, metin, PNG, JPG destekler)",
+        'command_3': "3. İstatistik: /stats [all] (yanıt süreleri ve token kullanımı: bu oturum veya tüm oturumlar)",
+        'command_4': "4. Arama:     /search <kelimeler> (kayıtlı tüm geçmişlerde mesaj arar)",
+        'command_5': "5. Çıkış:     çıkış veya çık",
+        'search_usage': "🔎 Kullanım: /search <kelimeler>",
+        'search_none': "🔎 \"{query}\" için sonuç bulunamadı.",
+        'search_results': "🔎 \"{query}\" için {count} sonuç:",
+        'search_unavailable': "🔎 Arama kullanılamıyor: geçmiş kataloğu açılamadı.",
+        'stats_title': "📊 {turns} tur ({failed} başarısız), {scope}:",
+        'stats_scope_session': "bu oturum",
+        'stats_scope_all': "metrik dosyasındaki tüm oturumlar",
+        'stats_totals': "  Toplam: {input} giriş tokeni ({cached} önbellekten), {output} çıkış tokeni, {files} dosya / {size_mb:.1f} MB yüklendi",
+        'stats_empty': "📊 Henüz kaydedilmiş tur yok.",
         'saving_history': "Geçmiş kaydediliyor ve oturum sonlandırılıyor.",
+        'response_timing': "⏱️ İlk token: {ttft:.2f} sn, toplam: {total:.2f} sn",
         
         # Analyze/Upload
         'analyze_start': "Klasör analizi başlatılıyor: ",
         'analyze_folder': "Klasör analiz ediliyor: ",
         'upload_skipping_large': "Büyük dosya atlanıyor: ",
+        'scan_summary': "  Tarama: {files} dosya seçildi ({size_mb:.1f} MB), süre {elapsed:.2f} sn",
+        'scan_skipped': "  Atlandı {count} ({reason}): {examples}",
+        'scan_reason_ignored': "yoksayma kuralları",
+        'scan_reason_type': "desteklenmeyen tür",
+        'scan_reason_large': "dosya başına sınırdan büyük",
+        'scan_reason_budget': "dosya sayısı/boyut bütçesi aşıldı",
+        'scan_reason_error': "okunamadı",
         'upload_file': "  Yükleniyor: {file_name}, tür: {mime_type}...",
         'upload_fallback': "  [Yedek]: Eski SDK sürümü nedeniyle açık mime_type olmadan yükleniyor...",
         'upload_failed': "  Yüklenemedi {file_name}: {error}",
+        'upload_cached': "  Önbellekteki yükleme kullanılıyor: {file_name}",
+        'upload_duplicate': "  Aynı içerikli dosya atlanıyor: {file_name}",
+        'upload_cache_evicted': "🗑️ Erişilemeyen {count} dosya yükleme önbelleğinden kaldırıldı; yeniden yüklemek için /analyze komutunu tekrar çalıştırın.",
+        'image_preprocessed': "  🖼️ Yüklemeden önce {count} görsel küçültüldü/yeniden sıkıştırıldı: {before_mb:.1f} MB -> {after_mb:.1f} MB",
+        'image_pillow_missing': "  💡 Büyük görselleri yüklemeden önce küçültmek için Pillow kurun (pip install Pillow); şu an değiştirilmeden gönderiliyorlar.",
+        'map_reduce_start': "🧩 Map-reduce: {files} dosya ({size_mb:.1f} MB), {parts} parça, aynı anda en fazla {parallel}",
+        'map_reduce_progress': "  Analiz edilen parça {done}/{total} ({relevant} bulgulu, {failed} başarısız, {elapsed:.0f} sn)",
+        'map_reduce_merging': "  {count} kısmi yanıt {groups} grupta birleştiriliyor...",
+        'map_reduce_merge_failed': "  Bir kısmi yanıt grubu birleştirilemedi (olduğu gibi bırakıldı): {error}",
+        'map_reduce_failed_parts': "  ⚠️ {count} parça analiz edilemedi: {parts}",
+        'map_reduce_hint': "  💡 Bazı metin dosyaları çok büyük veya bütçeyi aşıyor; hepsini parçalar halinde analiz etmek için --map-reduce ekleyin.",
+        'upload_bundled': "  {count} küçük metin dosyası {parts} satır içi parçada birleştirildi ({size_kb:.1f} KB)",
+        'upload_progress': "  Yüklendi {done}/{total} dosya ({size_mb:.1f} MB, {rate_mb:.2f} MB/sn, {failed} başarısız)",
+        'context_cache_created': "🗄️ Dosyalar takip soruları için sunucuda önbelleğe alındı (soru sordukça saklanır, {ttl} dk işlem yapılmazsa silinir)",
+        'context_cache_failed': "  Not: Sunucu tarafı önbellekleme kullanılamıyor ({error}); dosyalar soruyla birlikte gönderiliyor.",
+        'context_cache_expired': "🗄️ Son /analyze işleminin sunucu önbelleğinin süresi doldu; dosyaları bu soruyla birlikte gönderiliyor.",
+        'context_cache_cleanup_warning': "  Uyarı: Önbellekteki bağlam {name} silinemedi: {error}",
         'analyze_usage_error': "🛑 Kullanım Hatası: /analyze klasör_adı \"Analiz sorgunuz\"",
         'analyze_usage_note': "   NOT: Sorgu (soru) çift tırnak içinde olmalıdır.",
         'error_folder_not_found': "Hata: Klasör yolu bulunamadı: ",
@@ -231,6 +616,7 @@ LOCALIZATION_STRINGS = {
         'analyze_failed_no_files': "🛑 Analiz başarısız oldu для пути '{path}'. Yol kontrol sonucu: '{check}'. Geçerli dosya yüklenemedi.",
         'cleanup_start': "Yüklenen dosyalar temizleniyor...",
         'cleanup_warning': "  Uyarı: {file_name} silinemedi: {error}",
+        'cleanup_orphans': "🧹 Önceki oturumlardan kalan {count} yüklenmiş dosya silindi.",
 
         # Language Selection
         'lang_title': "Dil Seçimi",
@@ -251,6 +637,13 @@ LOCALIZATION_STRINGS = {
         'mode_input': "Seçiminiz [1/2]: ",
         'mode_selected_text': "Standart Metin Sohbeti başlatılıyor...",
         'mode_selected_voice': "Sesli Sohbet Modu başlatılıyor (Giriş bekleniyor)...",
+        'stt_title': "Konuşma Tanıma Motoru",
+        'stt_1': "[1] Google (çevrimiçi, varsayılan)",
+        'stt_2': "[2] Vosk (çevrimdışı, gerekli: pip install vosk + dil modeli)",
+        'stt_3': "[3] Whisper (CPU üzerinde çevrimdışı, gerekli: pip install faster-whisper)",
+        'stt_input': "Seçiminiz [1/2/3]: ",
+        'stt_selected': "Konuşma tanıma motoru: {backend}",
+        'stt_load_failed': "❌ '{backend}' motoru yüklenemedi ({error}). Google kullanılıyor.",
         
         # --- VOICE SPECIFIC STRINGS ---
         'voice_prompt': ">> Konuşun: ",
@@ -260,6 +653,9 @@ LOCALIZATION_STRINGS = {
         'voice_error_speech': "❌ Ses anlaşılamadı. Lütfen tekrar deneyin.",
         'voice_error_mic': "❌ Uygun mikrofon bulunamadı veya ses yakalama sırasında hata oluştu.",
         'voice_sending': "✨ Gemini'ye gönderiliyor: ",
+        'voice_calibrated': "🔊 Gürültü seviyesi ayarlandı. Hazır.",
+        'voice_calibration_loaded': "🔊 Kayıtlı mikrofon kalibrasyonu kullanılıyor (enerji eşiği {threshold:.0f}). Hazır.",
+        'voice_stage_timing': "⏱️ Konuşma {speech:.1f} sn | kuyrukta {wait:.2f} sn | tanıma {recognition:.2f} sn | model {model:.2f} sn",
         
         # System Instruction (For Gemini)
         'system_instruction': "Sen yüksek zekalı bir CLI asistanısın. Görevin, sağlanan dosyaları (kod, metin, görseller) ve komut geçmişini analiz etmek, kısa, doğru yanıtlar vermek и используя Markdown для форматирования кода. Dosyalar eklenmişse analize odaklan. Kullanıcı dosya yüklemeye çalışırsa ancak işlem başarısız olursa, dosyaların bulunamadığını veya klasörün mevcut olmadığını kibarca açıklayın ve yolu kontrol etmesini isteyin.",
@@ -272,10 +668,14 @@ def get_string(key):
     return LOCALIZATION_STRINGS[CURRENT_LANGUAGE][key]
 
 # --- LANGUAGE SELECTION ---
-def select_language():
-    """Prompts the user to select the interface language."""
+def select_language(preset=None):
+    """Prompts the user to select the interface language (skipped when given with --language)."""
     global CURRENT_LANGUAGE
     
+    if preset:
+        CURRENT_LANGUAGE = preset
+        return
+    
     loc = LOCALIZATION_STRINGS['en'] # Always start with English prompt for safety
     
     print("\n" + "=" * 60)
@@ -312,10 +712,14 @@ def select_language():
     print("=" * 60)
 
 # --- MODE SELECTION FUNCTION ---
-def select_mode():
-    """Prompts the user to select between Text Chat and Voice Chat modes."""
+def select_mode(preset=None):
+    """Prompts the user to select between Text Chat and Voice Chat modes (skipped when given with --mode)."""
     loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
     
+    if preset:
+        print(loc['mode_selected_' + preset])
+        return preset
+    
     print("\n" + "=" * 60)
     print(loc['mode_title'])
     print("-" * 60)
@@ -339,39 +743,345 @@ def select_mode():
         else:
             print(loc['lang_invalid'])
 
+def select_speech_backend():
+    """Prompts the user to select the speech-to-text engine for voice mode."""
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    
+    print("\n" + "=" * 60)
+    print(loc['stt_title'])
+    print("-" * 60)
+    print(loc['stt_1'])
+    print(loc['stt_2'])
+    print(loc['stt_3'])
+    print("-" * 60)
+    
+    while True:
+        choice = input(loc['stt_input']).strip().lower()
+        
+        if choice in ['', '1', 'google']:
+            return 'google'
+        elif choice in ['2', 'vosk']:
+            return 'vosk'
+        elif choice in ['3', 'whisper']:
+            return 'whisper'
+        else:
+            print(loc['lang_invalid'])
+
+# --- HISTORY CATALOG (SQLITE FULL-TEXT INDEX) ---
+# One SQLite database indexes every history file the assistant writes: title, turn count,
+# modification time and the message texts (FTS5 when available). ChatJournal indexes each
+# appended line right away; a directory is only re-scanned when its mtime changed.
+
+HISTORY_CATALOG_SCHEMA = """
+CREATE TABLE IF NOT EXISTS histories (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    title TEXT,
+    turns INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL DEFAULT 0,
+    mtime_ns INTEGER NOT NULL DEFAULT 0,
+    inode INTEGER NOT NULL DEFAULT 0,
+    indexed_bytes INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS histories_by_directory ON histories (directory, mtime_ns);
+CREATE TABLE IF NOT EXISTS directories (directory TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL);
+"""
+
+def get_history_catalog():
+    """Opens (creating if needed) the catalog database; returns None if SQLite is unusable (callers fall back to globbing)."""
+    if HISTORY_CATALOG['connection'] is None and not HISTORY_CATALOG['failed']:
+        try:
+            import sqlite3
+            os.makedirs(os.path.dirname(HISTORY_CATALOG_FILE), exist_ok=True)
+            # One connection shared by all threads, serialized with HISTORY_CATALOG_LOCK
+            connection = sqlite3.connect(HISTORY_CATALOG_FILE, timeout=5.0, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(HISTORY_CATALOG_SCHEMA)
+            existing = connection.execute("SELECT sql FROM sqlite_master WHERE name = 'messages'").fetchone()
+            if existing:
+                HISTORY_CATALOG['fts'] = 'fts5' in existing[0].lower()
+            else:
+                try:
+                    connection.execute("CREATE VIRTUAL TABLE messages USING fts5(text, role UNINDEXED, path UNINDEXED)")
+                    HISTORY_CATALOG['fts'] = True
+                except sqlite3.OperationalError:
+                    # SQLite built without FTS5: plain table, searched with LIKE
+                    connection.execute("CREATE TABLE messages (text TEXT, role TEXT, path TEXT)")
+                    connection.execute("CREATE INDEX messages_by_path ON messages (path)")
+                    HISTORY_CATALOG['fts'] = False
+            connection.commit()
+            HISTORY_CATALOG['connection'] = connection
+        except Exception as e:
+            HISTORY_CATALOG['failed'] = True
+            # NOTE: This string is not localized because it's only an error fallback
+            print(f"History catalog unavailable ({e}); listing history files directly.")
+    return HISTORY_CATALOG['connection']
+
+def strip_context_block(text):
+    """Drops the system/terminal context sent with a first prompt, keeping the question itself."""
+    marker = "[USER QUESTION]: "
+    return text.split(marker, 1)[1] if text.startswith("[CONTEXT: SYSTEM]") and marker in text else text
+
+def make_history_title(text):
+    """Title of a history: the first line of its first question."""
+    lines = strip_context_block(text).strip().splitlines()
+    title = lines[0].strip() if lines else ""
+    return title if len(title) <= 60 else title[:57] + "..."
+
+def index_history_file(connection, history_file_path):
+    """Indexes the journal lines added since the last call; a rewritten file (new inode, shorter) is indexed again."""
+    path = os.path.abspath(history_file_path)
+    stat = os.stat(path)
+    row = connection.execute("SELECT inode, indexed_bytes, turns, title FROM histories WHERE path = ?", (path,)).fetchone()
+    if row and row[0] == stat.st_ino and row[1] <= stat.st_size:
+        offset, turns, title = row[1], row[2], row[3]
+    else:
+        if row:
+            # The path column is not indexed in FTS5, so only rewritten files pay for this scan
+            connection.execute("DELETE FROM messages WHERE path = ?", (path,))
+        offset, turns, title = 0, 0, None
+
+    if is_compressed_history(path):
+        records, indexed_bytes = read_container_records(path, offset)
+    else:
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # Only complete lines; a torn last write is picked up once the journal terminates it
+        complete = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:complete].splitlines():
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        indexed_bytes = offset + complete
+    
+    rows = []
+    for record in records:
+        if not isinstance(record, dict) or record.get('role') not in ('user', 'model') or not record.get('text'):
+            continue
+        text = record['text']
+        if record['role'] == 'user':
+            turns += 1
+            text = strip_context_block(text)
+            if not title:
+                title = make_history_title(text)
+        rows.append((text, record['role'], path))
+
+    connection.executemany("INSERT INTO messages (text, role, path) VALUES (?, ?, ?)", rows)
+    connection.execute(
+        "INSERT OR REPLACE INTO histories (path, directory, title, turns, size, mtime_ns, inode, indexed_bytes) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (path, os.path.dirname(path), title, turns, stat.st_size, stat.st_mtime_ns, stat.st_ino, indexed_bytes)
+    )
+
+def forget_history_files(connection, paths):
+    """Removes deleted histories from the catalog (one pass over the messages for all of them)."""
+    paths = list(paths)
+    if not paths:
+        return
+    placeholders = ",".join("?" * len(paths))
+    connection.execute(f"DELETE FROM messages WHERE path IN ({placeholders})", paths)
+    connection.execute(f"DELETE FROM histories WHERE path IN ({placeholders})", paths)
+
+def sync_history_directory(connection, directory):
+    """Re-scans a directory only if files were added, removed or renamed there since the last scan."""
+    directory = os.path.abspath(directory)
+    dir_mtime = os.stat(directory).st_mtime_ns
+    row = connection.execute("SELECT mtime_ns FROM directories WHERE directory = ?", (directory,)).fetchone()
+    if row and row[0] == dir_mtime:
+        return
+
+    on_disk = set(glob.glob(os.path.join(directory, HISTORY_PATTERN)))
+    known = {path: (size, mtime_ns) for path, size, mtime_ns in connection.execute(
+        "SELECT path, size, mtime_ns FROM histories WHERE directory = ?", (directory,))}
+    forget_history_files(connection, known.keys() - on_disk)
+    for path in on_disk:
+        try:
+            stat = os.stat(path)
+            if known.get(path) != (stat.st_size, stat.st_mtime_ns):
+                index_history_file(connection, path)
+        except OSError:
+            continue
+    connection.execute("INSERT OR REPLACE INTO directories (directory, mtime_ns) VALUES (?, ?)", (directory, dir_mtime))
+
+def update_history_catalog(history_file_path):
+    """Indexes the newly saved turns of one history (called by ChatJournal after every append)."""
+    connection = get_history_catalog()
+    if connection is None:
+        return
+    try:
+        with HISTORY_CATALOG_LOCK, connection:
+            index_history_file(connection, history_file_path)
+    except Exception as e:
+        # NOTE: This string is not localized because it's only an error fallback
+        print(f"Error updating the history catalog: {e}")
+
+def fts_query(text):
+    """Turns free text into an FTS5 query matching all words (quoted, so punctuation is harmless)."""
+    return " ".join('"' + word.replace('"', '""') + '"' for word in text.split())
+
+def list_history_page(directory, text_filter="", page=0):
+    """
+    One page of the histories in a directory, newest first, as ([(path, title, turns, mtime)], total).
+    text_filter matches file names, titles and (with the catalog) message texts.
+    """
+    connection = get_history_catalog()
+    if connection is not None:
+        try:
+            with HISTORY_CATALOG_LOCK, connection:
+                sync_history_directory(connection, directory)
+                where, params = "directory = ?", [os.path.abspath(directory)]
+                if text_filter:
+                    where += " AND (path LIKE ? OR title LIKE ? OR path IN ({}))".format(
+                        "SELECT path FROM messages WHERE messages MATCH ?" if HISTORY_CATALOG['fts'] else
+                        "SELECT path FROM messages WHERE text LIKE ?"
+                    )
+                    like = f"%{text_filter}%"
+                    params += [like, like, fts_query(text_filter) if HISTORY_CATALOG['fts'] else like]
+                total = connection.execute(f"SELECT COUNT(*) FROM histories WHERE {where}", params).fetchone()[0]
+                rows = connection.execute(
+                    f"SELECT path, title, turns, mtime_ns FROM histories WHERE {where} ORDER BY mtime_ns DESC LIMIT ? OFFSET ?",
+                    params + [HISTORY_PAGE_SIZE, page * HISTORY_PAGE_SIZE]
+                ).fetchall()
+            return [(path, title, turns, mtime_ns / 1e9) for path, title, turns, mtime_ns in rows], total
+        except Exception as e:
+            # NOTE: This string is not localized because it's only an error fallback
+            print(f"History catalog query failed ({e}); listing history files directly.")
+
+    paths = sorted(glob.glob(os.path.join(directory, HISTORY_PATTERN)))
+    if text_filter:
+        paths = [path for path in paths if text_filter.lower() in os.path.basename(path).lower()]
+    start = page * HISTORY_PAGE_SIZE
+    return [(path, None, None, os.path.getmtime(path)) for path in paths[start:start + HISTORY_PAGE_SIZE]], len(paths)
+
+def print_history_page(rows, total, page, text_filter):
+    """Prints one page of the selection menu (numbers continue across pages)."""
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    if text_filter:
+        print(loc['history_filter_active'].format(filter=text_filter, total=total))
+    else:
+        print(loc['history_available'])
+    for i, (path, title, turns, mtime) in enumerate(rows, start=page * HISTORY_PAGE_SIZE + 1):
+        filename = os.path.basename(path)
+        if turns is None:
+            print(f"  [{i}] {filename}")
+        else:
+            print(loc['history_entry'].format(
+                index=i, name=filename, title=title or "-", turns=turns,
+                modified=time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime))
+            ))
+    pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+    if pages > 1 or text_filter:
+        print(loc['history_page'].format(page=page + 1, pages=pages))
+
+def search_histories(text, limit=SEARCH_RESULT_LIMIT):
+    """Full-text search over all indexed histories: [(path, role, snippet)], best matches first (None without a catalog)."""
+    connection = get_history_catalog()
+    if connection is None:
+        return None
+    with HISTORY_CATALOG_LOCK, connection:
+        if HISTORY_CATALOG['fts']:
+            rows = connection.execute(
+                "SELECT path, role, snippet(messages, 0, '«', '»', ' … ', 16) FROM messages "
+                "WHERE messages MATCH ? ORDER BY bm25(messages) LIMIT ?",
+                (fts_query(text), limit)
+            ).fetchall()
+        else:
+            rows = connection.execute(
+                "SELECT path, role, substr(text, max(1, instr(lower(text), lower(?)) - 60), 160) FROM messages "
+                "WHERE text LIKE ? ORDER BY rowid DESC LIMIT ?",
+                (text, f"%{text}%", limit)
+            ).fetchall()
+        results = [(path, role, " ".join(snippet.split())) for path, role, snippet in rows if os.path.exists(path)]
+        forget_history_files(connection, {path for path, _, _ in rows if not os.path.exists(path)})
+    return results
+
+def print_search_results(text):
+    """Handles /search <words>: prints matching past messages with their history file."""
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    if not text.strip():
+        print(loc['search_usage'])
+        return
+    try:
+        results = search_histories(text)
+    except Exception as e:
+        # NOTE: This string is not localized because it's only an error fallback
+        print(f"Search failed: {e}")
+        return
+    if results is None:
+        print(loc['search_unavailable'])
+    elif not results:
+        print(loc['search_none'].format(query=text))
+    else:
+        print(loc['search_results'].format(count=len(results), query=text))
+        for path, role, snippet in results:
+            print(f"  [{os.path.basename(path)}] ({role}) {snippet}")
+
 # --- HISTORY MANAGEMENT FUNCTIONS ---
 
-def select_history_file():
-    """Prompts the user to select an existing history file or start a new one."""
+def resolve_history_file(name):
+    """Maps a history name or path given with --history to a *.chat_history.txt path."""
+    path = os.path.abspath(os.path.expanduser(name))
+    if not path.lower().endswith('.chat_history.txt'):
+        path = os.path.splitext(path)[0] + ".chat_history.txt"
+    return path
+
+def select_history_file(preset=None):
+    """Prompts the user to select an existing history file or start a new one (skipped when given with --history)."""
     global CURRENT_LANGUAGE
     loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
     current_dir = os.getcwd()
     
-    history_files = sorted(glob.glob(os.path.join(current_dir, HISTORY_PATTERN)))
+    if preset:
+        selected_file = resolve_history_file(preset)
+        if os.path.exists(selected_file):
+            print(loc['history_loading_existing'] + os.path.basename(selected_file))
+        else:
+            print(loc['history_creating_new'] + os.path.basename(selected_file))
+        return selected_file
+    
+    # Only one page is listed, from the catalog (see list_history_page)
+    text_filter = ""
+    page = 0
+    rows, total = list_history_page(current_dir, text_filter, page)
     
     # --- Help message displayed on startup ---
     print("=" * 60)
     print(loc['app_title'])
     print("-" * 60)
     
-    if not history_files:
+    if not total:
         default_name = f"default_{int(time.time())}.chat_history.txt"
         print(loc['history_none'])
         print(loc['history_default_name'].format(default_name=default_name))
     else:
-        print(loc['history_available'])
-        for i, h_file in enumerate(history_files):
-            filename = os.path.basename(h_file)
-            print(f"  [{i+1}] {filename}")
+        print_history_page(rows, total, page, text_filter)
     
     print("-" * 60)
     print("👉 " + loc['history_prompt_1'])
     print("   " + loc['history_prompt_2'])
+    if total > HISTORY_PAGE_SIZE:
+        print("   " + loc['history_prompt_3'])
     print("=" * 60)
     
     while True:
         choice = input(loc['history_prompt_input']).strip()
         
+        if choice in ('>', '<') or choice.startswith('?'):
+            # Paging and filtering
+            if choice.startswith('?'):
+                text_filter = choice[1:].strip()
+                page = 0
+            else:
+                pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+                page = min(pages - 1, page + 1) if choice == '>' else max(0, page - 1)
+            rows, total = list_history_page(current_dir, text_filter, page)
+            print_history_page(rows, total, page, text_filter)
+            continue
+        
         if not choice:
             # Default to a unique filename if nothing is entered
             selected_file_name = f"default_{int(time.time())}.chat_history.txt"
@@ -384,15 +1094,19 @@ def select_history_file():
             index = int(choice)
             
             # --- FIX: If no files exist, treat number input as a filename attempt ---
-            if not history_files:
+            if not total:
                 raise ValueError
             
-            if 1 <= index <= len(history_files):
-                selected_file = history_files[index - 1]
+            if 1 <= index <= total:
+                index_page = (index - 1) // HISTORY_PAGE_SIZE
+                if index_page != page:
+                    rows, total = list_history_page(current_dir, text_filter, index_page)
+                    page = index_page
+                selected_file = rows[(index - 1) % HISTORY_PAGE_SIZE][0]
                 print(loc['history_loading_existing'] + os.path.basename(selected_file))
                 return selected_file
             else:
-                print(loc['history_invalid_number_1'] + str(len(history_files)) + ".")
+                print(loc['history_invalid_number_1'] + str(total) + ".")
                 continue
         except ValueError:
             # 2. User entered a custom name (or failed number conversion/no files)
@@ -409,298 +1123,2927 @@ def select_history_file():
             
             return selected_file
 
-def load_chat_history(history_file_path):
-    """Loads chat history from the specified file path."""
-    history = []
+def is_legacy_history_file(history_file_path):
+    """Returns True if the file uses the old 'role: ...' / content line format instead of JSON lines."""
+    with open(history_file_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.strip():
+                return line.lstrip().lower().startswith("role:")
+    return False
+
+def import_legacy_history(history_file_path):
+    """
+    Converts an old-format history file into the JSONL journal format in place.
+    Content lines are collected until the next 'role:' line, so multi-line answers survive.
+    The original file is kept next to it with a '.legacy.bak' suffix.
+    """
+    entries = []
+    current = None
+    with open(history_file_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            role_match = re.match(r'^role: (user|model|system)\s*$', line.strip(), re.IGNORECASE)
+            if role_match:
+                current = {'role': role_match.group(1).lower(), 'lines': []}
+                entries.append(current)
+            elif current is not None:
+                current['lines'].append(line.rstrip("\n"))
+
+    records = []
+    for entry in entries:
+        text = "\n".join(entry['lines']).strip()
+        if entry['role'] in ('user', 'model') and text:
+            records.append({'role': entry['role'], 'text': text})
+
+    backup_path = history_file_path + ".legacy.bak"
+    if not os.path.exists(backup_path):
+        with open(history_file_path, "rb") as src, open(backup_path, "wb") as dst:
+            dst.write(src.read())
+    write_history_journal(history_file_path, records)
+
+def write_history_journal(history_file_path, records):
+    """Atomically writes a complete JSONL journal (used for imports, not per-turn saves)."""
+    tmp_path = history_file_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, history_file_path)
+
+def read_history_journal(history_file_path):
+    """Yields {'role', 'text'} records from a JSONL journal, skipping damaged lines (e.g. a torn last write)."""
+    with open(history_file_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(record, dict) and record.get('role') in ('user', 'model') and record.get('text'):
+                yield record
+
+def load_history_records(history_file_path):
+    """
+    Loads the {'role', 'text'} records of a history file, importing the legacy two-line format first if needed.
+    A compressed history is returned as a lazy CompressedHistory (see close_history_records); with
+    HISTORY_COMPRESSION on, other histories are migrated into one first.
+    """
+    records = []
     if os.path.exists(history_file_path):
         try:
-            with open(history_file_path, "r") as f:
-                lines = f.readlines()
-            for i in range(0, len(lines), 2):
-                if i + 1 < len(lines):
-                    role_line = lines[i].strip()
-                    if "role: system" in role_line.lower():
-                        continue 
-                    role_match = re.search(r'role: (user|model)', role_line)
-                    if not role_match:
-                        continue
-                    role = role_match.group(1)
-                    content = lines[i+1].strip()
-                    history.append(types.Content(role=role, parts=[types.Part.from_text(text=content)]))
+            if is_compressed_history(history_file_path):
+                return CompressedHistory(history_file_path)
+            if is_legacy_history_file(history_file_path):
+                import_legacy_history(history_file_path)
+            if HISTORY_COMPRESSION:
+                try:
+                    compress_history_file(history_file_path)
+                    return CompressedHistory(history_file_path)
+                except Exception as e:
+                    # NOTE: This string is not localized because it's only an error fallback
+                    print(f"Error compressing history (kept as is): {e}")
+            records = list(read_history_journal(history_file_path))
         except Exception:
             pass
-    return history
+    return records
 
-def save_chat_history(chat, history_file_path):
-    """Saves the entire current chat history (old + new messages) to the specified file path."""
+def records_to_contents(records):
+    """Converts history records into chat Content objects."""
+    return [types.Content(role=record['role'], parts=[types.Part.from_text(text=record['text'])]) for record in records]
+
+def load_chat_history(history_file_path):
+    """Loads the complete chat history from the specified file path."""
+    records = load_history_records(history_file_path)
     try:
-        with open(history_file_path, "w") as f:
-            for message in chat.get_history():
-                if message.role not in ['user', 'model']:
-                    continue
-                
-                f.write(f"role: {message.role}\n")
-                if message.parts and hasattr(message.parts[0], 'text'):
-                    f.write(f"{message.parts[0].text}\n")
-    except Exception as e:
-        # NOTE: This string is not localized because it's only an error fallback
-        print(f"Error saving history: {e}") 
+        return records_to_contents(records)
+    finally:
+        close_history_records(records)
 
-# --- FILE UPLOAD AND ANALYSIS FUNCTIONS ---
+# --- COMPRESSED HISTORY CONTAINER ---
+# Layout: CONTAINER_MAGIC + 8-byte container id, then one frame per message:
+# HISTORY_FRAME header (payload length, CRC-32, token estimate, role) + zlib-compressed JSON record.
+# <history>.idx holds INDEX_MAGIC + the same id and one HISTORY_INDEX_ENTRY per frame, so the
+# context window is chosen from the index and only the messages actually sent are decompressed.
 
-def upload_folder_contents(client, folder_path):
-    """Recursively reads and uploads files from a folder to the Gemini API, with SDK version fallback."""
-    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
-    
-    if not os.path.isdir(folder_path):
-        print(loc['error_folder_not_found'] + folder_path)
-        return []
-    
-    uploaded_files = []
-    allowed_extensions = ('.py', '.txt', '.md', '.html', '.css', '.js', '.json', '.sh', '.log', '.conf', '.png', '.jpg', '.jpeg')
-    
-    print(loc['analyze_folder'] + folder_path)
+def is_compressed_history(history_file_path):
+    """True if the file is a compressed history container."""
+    try:
+        with open(history_file_path, "rb") as f:
+            return f.read(len(CONTAINER_MAGIC)) == CONTAINER_MAGIC
+    except OSError:
+        return False
 
-    for root, _, files in os.walk(folder_path):
-        for file_name in files:
-            file_path = os.path.join(root, file_name)
-            
-            if os.path.getsize(file_path) > 20 * 1024 * 1024:
-                print(loc['upload_skipping_large'] + file_name)
-                continue
-            
-            file_extension = os.path.splitext(file_name)[1].lower()
-            
-            if file_extension in allowed_extensions:
-                try:
-                    # Determine MIME type
-                    if file_extension in ('.png', '.jpg', '.jpeg'):
-                        mime_type = {
-                            '.png': 'image/png',
-                            '.jpg': 'image/jpeg',
-                            '.jpeg': 'image/jpeg'
-                        }.get(file_extension, 'application/octet-stream')
-                    else:
-                        mime_type = "text/plain"
-                    
-                    print(loc['upload_file'].format(file_name=file_name, mime_type=mime_type))
-                    
-                    file_obj = None
-                    try:
-                        # Attempt 1: Use syntax with mime_type (for modern SDKs)
-                        file_obj = client.files.upload(
-                            file=file_path,
-                            mime_type=mime_type
-                        )
-                    except TypeError as e:
-                        # Fallback for "unexpected keyword argument" (older SDKs)
-                        if 'unexpected keyword argument' in str(e):
-                            print(loc['upload_fallback'])
-                            file_obj = client.files.upload(
-                                file=file_path
-                            )
-                        else:
-                            raise 
-                    
-                    if file_obj:
-                         uploaded_files.append(file_obj)
-                         TEMP_FILE_LIST.append(file_obj) 
-                    
-                except Exception as e:
-                    print(loc['upload_failed'].format(file_name=file_name, error=e))
-                    
-    return uploaded_files
+def get_history_index_file(history_file_path):
+    """Returns the path of the offset index stored next to a compressed history."""
+    return history_file_path + ".idx"
 
-def cleanup_uploaded_files(client):
-    """Deletes temporary files uploaded to the Gemini service."""
-    if not TEMP_FILE_LIST:
-        return
-    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
-    print("\n" + loc['cleanup_start'])
-    for file_obj in TEMP_FILE_LIST:
-        try:
-            client.files.delete(name=file_obj.name)
-        except Exception as e:
-            print(loc['cleanup_warning'].format(file_name=file_obj.name, error=e))
-    TEMP_FILE_LIST.clear()
+def encode_history_frame(record):
+    """Returns (frame bytes, token estimate, role code) for one history record."""
+    payload = zlib.compress(json.dumps(record, ensure_ascii=False).encode("utf-8"), HISTORY_COMPRESSION_LEVEL)
+    tokens = estimate_tokens(record['text'])
+    role = HISTORY_ROLES.index(record['role'])
+    return HISTORY_FRAME.pack(len(payload), zlib.crc32(payload), tokens, role) + payload, tokens, role
 
-# --- UTILITY AND CLIENT FUNCTIONS (System and Terminal History) ---
+def decode_history_frame(buffer, offset):
+    """Decodes the frame at offset: (record, frame length). Raises ValueError for a torn or damaged frame."""
+    if offset + HISTORY_FRAME.size > len(buffer):
+        raise ValueError("truncated history frame")
+    length, crc, _, _ = HISTORY_FRAME.unpack_from(buffer, offset)
+    start = offset + HISTORY_FRAME.size
+    payload = buffer[start:start + length]
+    if len(payload) != length or zlib.crc32(payload) != crc:
+        raise ValueError("damaged history frame")
+    return json.loads(zlib.decompress(payload)), HISTORY_FRAME.size + length
 
-def get_system_info():
+def scan_history_frames(buffer, offset):
+    """Index entries of the intact frames from offset on (checks the CRCs without decompressing)."""
+    entries = []
+    while offset + HISTORY_FRAME.size <= len(buffer):
+        length, crc, tokens, role = HISTORY_FRAME.unpack_from(buffer, offset)
+        start = offset + HISTORY_FRAME.size
+        if start + length > len(buffer) or zlib.crc32(buffer[start:start + length]) != crc:
+            break
+        entries.append((offset, HISTORY_FRAME.size + length, tokens, role))
+        offset = start + length
+    return entries
+
+def load_history_index(history_file_path, buffer):
     """
-    Retrieves system information using 'neofetch' on Linux/macOS. 
-    Returns a localized fallback message on other OSs (like Windows).
+    Returns (entries, index_is_current) for a container mapped in buffer. Entries missing from the
+    .idx file (a crash between the two writes) are recovered by scanning the frames after the last one.
     """
-    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
-    
-    if platform.system() != 'Linux': # Check for non-Linux system
-        return loc['sysinfo_non_linux']
-        
+    header = buffer[:CONTAINER_HEADER_SIZE]
+    entries = []
+    index_size = None
     try:
-        output = subprocess.check_output(
-            ['neofetch', '--stdout', '--disable', 'ascii'],
-            stderr=subprocess.STDOUT
-        ).decode('utf-8')
-        clean_output = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', output).strip()
-        return clean_output
-    except (FileNotFoundError, Exception):
-        return "System info retrieval failed. Neofetch not found or error occurred."
+        with open(get_history_index_file(history_file_path), "rb") as f:
+            data = f.read()
+        index_size = len(data)
+        if data[:CONTAINER_HEADER_SIZE] == INDEX_MAGIC + header[len(CONTAINER_MAGIC):]:
+            usable = (len(data) - CONTAINER_HEADER_SIZE) // HISTORY_INDEX_ENTRY.size * HISTORY_INDEX_ENTRY.size
+            entries = list(HISTORY_INDEX_ENTRY.iter_unpack(data[CONTAINER_HEADER_SIZE:CONTAINER_HEADER_SIZE + usable]))
+    except OSError:
+        pass
+    
+    # Entries pointing past the data belong to frames that never reached the disk
+    while entries and entries[-1][0] + entries[-1][1] > len(buffer):
+        entries.pop()
+    indexed = len(entries)
+    end = entries[-1][0] + entries[-1][1] if entries else CONTAINER_HEADER_SIZE
+    entries.extend(scan_history_frames(buffer, end))
+    current = indexed == len(entries) and index_size == CONTAINER_HEADER_SIZE + indexed * HISTORY_INDEX_ENTRY.size
+    return entries, current
 
-def get_terminal_history():
+def write_history_index(history_file_path, container_id, entries):
+    """Atomically writes the complete offset index of a container."""
+    index_file = get_history_index_file(history_file_path)
+    tmp_path = index_file + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(INDEX_MAGIC + container_id)
+        f.write(b"".join(HISTORY_INDEX_ENTRY.pack(*entry) for entry in entries))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, index_file)
+
+def open_history_container(history_file_path):
     """
-    Retrieves the last commands from the shell history file on Linux/macOS. 
-    Returns an empty list on other OSs (like Windows).
+    Opens a container for appending (creating it if needed) and returns (data file, index file).
+    A torn last frame is cut off and a stale index is rewritten first.
     """
-    if platform.system() != 'Linux': # Check for non-Linux system
-        return []
+    if not os.path.exists(history_file_path) or os.path.getsize(history_file_path) == 0:
+        container_id = os.urandom(8)
+        with open(history_file_path, "wb") as f:
+            f.write(CONTAINER_MAGIC + container_id)
+        write_history_index(history_file_path, container_id, [])
+    else:
+        with open(history_file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            container_id = bytes(buffer[len(CONTAINER_MAGIC):CONTAINER_HEADER_SIZE])
+            entries, current = load_history_index(history_file_path, buffer)
+            size = len(buffer)
+        if not current:
+            write_history_index(history_file_path, container_id, entries)
+        valid_end = entries[-1][0] + entries[-1][1] if entries else CONTAINER_HEADER_SIZE
+        if valid_end < size:
+            os.truncate(history_file_path, valid_end)
+    return open(history_file_path, "ab"), open(get_history_index_file(history_file_path), "ab")
 
-    shell = os.environ.get("SHELL", "").split('/')[-1]
-    history_file = None
-    if shell == 'bash':
-        history_file = os.path.expanduser("~/.bash_history")
-    elif shell == 'zsh':
-        history_file = os.path.expanduser("~/.zsh_history")
-    elif shell == 'fish':
-        history_file = os.path.expanduser("~/.local/share/fish/fish_history")
-    commands = []
-    if history_file and os.path.exists(history_file):
-        try:
-            with open(history_file, "r") as file:
-                history = file.readlines()
-                if shell == 'fish':
-                    commands = [line.strip()[6:] for line in history if line.startswith('- cmd: ')]
-                else:
-                    commands = [line.strip() for line in history if line.strip() and not line.strip().startswith('#')]
-        except Exception:
-            return []
-    return commands[-HISTORY_LIMIT:]
+def read_container_records(history_file_path, offset):
+    """Decodes the frames from byte offset to the last intact one: (records, end offset). Used by the catalog."""
+    records = []
+    with open(history_file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        offset = max(offset, CONTAINER_HEADER_SIZE)
+        while True:
+            try:
+                record, length = decode_history_frame(buffer, offset)
+            except ValueError:
+                break
+            records.append(record)
+            offset += length
+    return records, offset
 
-# --- INITIALIZATION ---
+class HistoryFrame(Mapping):
+    """One record of a CompressedHistory: role and token estimate come from the index, the text is decompressed on first access."""
 
-def initialize_client_and_chat():
-    """Initializes the Gemini client, selects history, and loads the chat session."""
-    global CURRENT_HISTORY_FILE
-    
-    # 0. Select Language first
-    select_language()
-    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    def __init__(self, history, index):
+        self._history = history
+        self._index = index
+        self._record = None
 
-    api_key = os.environ.get("GEMINI_API_KEY")
-    if not api_key:
-        print(loc['error_api_key'])
-        sys.exit(1)
-        
-    # 1. Interactive history file selection
-    CURRENT_HISTORY_FILE = select_history_file()
+    def _load(self):
+        if self._record is None:
+            self._record = self._history.read_record(self._index)
+        return self._record
 
-    try:
-        client = genai.Client(api_key=api_key)
-        
-        # 2. Load selected history
-        history = load_chat_history(CURRENT_HISTORY_FILE)
-        
-        # 3. Use localized System Instruction
-        config = types.GenerateContentConfig(
-            system_instruction=loc['system_instruction']
-        )
-        
-        # MODEL_NAME is gemini-2.5-flash-lite
-        chat = client.chats.create(
-            model=MODEL_NAME, 
-            history=history,
-            config=config
-        )
-        return client, chat
-        
-    except Exception as e:
-        print(loc['error_init'] + str(e))
-        sys.exit(1)
+    def __getitem__(self, key):
+        _, _, tokens, role = self._history.entries[self._index]
+        if key == 'role':
+            return HISTORY_ROLES[role]
+        if key == 'tokens':
+            return tokens
+        return self._load()[key]
 
-# --- NEW VOICE CHAT MODE ---
+    def __iter__(self):
+        return iter(list(self._load()) + ['tokens'])
 
-def voice_chat_mode(client, chat):
-    """Runs a loop for voice-based user dialogue."""
-    global CURRENT_HISTORY_FILE
-    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
-    # Use selected language code for better speech recognition accuracy
-    lang_code = loc['code'] 
+    def __len__(self):
+        return len(self._load()) + 1
 
-    print("\n-------------------------------------------------------------")
-    print(loc['chat_mode_title'] + os.path.basename(CURRENT_HISTORY_FILE))
-    print(f"🎙️ {loc['voice_exit']}")
-    print("-------------------------------------------------------------")
+class CompressedHistory(Sequence):
+    """Read-only, memory-mapped view of a compressed history; only the records that are accessed get decompressed."""
 
-    terminal_history = get_terminal_history()
-    system_info = get_system_info()
-    
-    context_data = (
-        f"[CONTEXT: SYSTEM]: {system_info}\n"
-        f"[CONTEXT: HISTORY (last {HISTORY_LIMIT} commands)]: {', '.join(terminal_history)}"
-    )
-    first_prompt_sent = False 
+    def __init__(self, history_file_path):
+        self.history_file_path = history_file_path
+        self._file = open(history_file_path, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.entries, _ = load_history_index(history_file_path, self._buffer)
 
-    try:
-        # Check if there are microphones available
-        if not sr.Microphone.list_microphone_names():
-            print(loc['voice_error_mic'])
-            return
+    def __len__(self):
+        return len(self.entries)
 
-        with sr.Microphone() as source:
-            try:
-                # Adjust ambient noise level only once
-                r.adjust_for_ambient_noise(source)
-                print("🔊 Noise level adjusted. Ready.")
-            except Exception as e:
-                # This often fails if pyaudio/portaudio isn't installed correctly
-                print(loc['voice_error_mic'])
-                print(f"Error details: {e}")
-                return # Exit voice mode if mic fails
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [HistoryFrame(self, i) for i in range(*index.indices(len(self.entries)))]
+        if index < 0:
+            index += len(self.entries)
+        if not 0 <= index < len(self.entries):
+            raise IndexError(index)
+        return HistoryFrame(self, index)
 
-            while True:
-                try:
-                    print(loc['voice_prompt'], end="")
-                    print(loc['voice_listening'])
-                    
-                    # Listen to the audio (10 second limit per phrase)
-                    audio = r.listen(source, phrase_time_limit=10) 
-                    
-                    print(loc['voice_recognizing'])
-                    
-                    # Recognize speech using Google Speech Recognition
-                    # Uses the localized language code for recognition
-                    user_input = r.recognize_google(audio, language=lang_code)
-                    print(f"✅ Recognized: {user_input}")
+    def read_record(self, index):
+        """Decompresses one record (a damaged frame yields a placeholder instead of failing the whole load)."""
+        offset, _, _, role = self.entries[index]
+        try:
+            return decode_history_frame(self._buffer, offset)[0]
+        except (ValueError, zlib.error):
+            # NOTE: This string is not localized because it's only an error fallback
+            return {'role': HISTORY_ROLES[role], 'text': "(unreadable history entry)"}
 
-                    if user_input.lower() in ['exit', 'quit']:
-                        break
-                    
-                    if not user_input.strip():
-                        continue
+    def close(self):
+        self._buffer.close()
+        self._file.close()
+
+def close_history_records(records):
+    """Releases the file mapping behind records loaded from a compressed history."""
+    if isinstance(records, CompressedHistory):
+        records.close()
+
+def compress_history_file(history_file_path):
+    """
+    Migrates a JSON-lines (or legacy) history into a compressed container in place, one record at a time.
+    Returns (bytes before, bytes after, including the index).
+    """
+    if is_compressed_history(history_file_path):
+        size = os.path.getsize(history_file_path)
+        return size, size
+    if is_legacy_history_file(history_file_path):
+        import_legacy_history(history_file_path)
+    size_before = os.path.getsize(history_file_path)
+
+    container_id = os.urandom(8)
+    entries = []
+    tmp_path = history_file_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(CONTAINER_MAGIC + container_id)
+        offset = CONTAINER_HEADER_SIZE
+        for record in read_history_journal(history_file_path):
+            frame, tokens, role = encode_history_frame(record)
+            f.write(frame)
+            entries.append((offset, len(frame), tokens, role))
+            offset += len(frame)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, history_file_path)
+    write_history_index(history_file_path, container_id, entries)
+    return size_before, os.path.getsize(history_file_path) + os.path.getsize(get_history_index_file(history_file_path))
+
+def expand_history_file(history_file_path):
+    """Converts a compressed container back into a JSON-lines history. Returns (bytes before, bytes after)."""
+    if not is_compressed_history(history_file_path):
+        size = os.path.getsize(history_file_path)
+        return size, size
+    index_file = get_history_index_file(history_file_path)
+    size_before = os.path.getsize(history_file_path) + (os.path.getsize(index_file) if os.path.exists(index_file) else 0)
+
+    tmp_path = history_file_path + ".tmp"
+    history = CompressedHistory(history_file_path)
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for index in range(len(history)):
+                f.write(json.dumps(history.read_record(index), ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    finally:
+        history.close()
+    os.replace(tmp_path, history_file_path)
+    if os.path.exists(index_file):
+        os.remove(index_file)
+    return size_before, os.path.getsize(history_file_path)
+
+def convert_histories(directory, compress=True, language=None):
+    """--compress-histories / --expand-histories: converts every history in a directory and prints the sizes. Returns the exit code."""
+    select_language(language or 'en')
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    total_before = total_after = 0
+    converted = failed = 0
+    for path in sorted(glob.glob(os.path.join(directory, HISTORY_PATTERN))):
+        try:
+            before, after = compress_history_file(path) if compress else expand_history_file(path)
+        except Exception as e:
+            failed += 1
+            # NOTE: This string is not localized because it's only an error fallback
+            print(f"  {os.path.basename(path)}: conversion failed: {e}", file=sys.stderr)
+            continue
+        converted += 1
+        total_before += before
+        total_after += after
+        print(loc['history_converted'].format(name=os.path.basename(path), before_mb=before / (1024 * 1024), after_mb=after / (1024 * 1024)))
+    print(loc['history_convert_summary'].format(count=converted, before_mb=total_before / (1024 * 1024), after_mb=total_after / (1024 * 1024)))
+    return 1 if failed else 0
+
+class ChatJournal:
+    """
+    Append-only, crash-safe history writer: each turn is written as one JSON line as soon as it completes.
+    Lines are flushed to the OS immediately; fsync is batched (HISTORY_FSYNC_EVERY / HISTORY_FSYNC_INTERVAL).
+    """
+
+    def __init__(self, history_file_path):
+        self.history_file_path = history_file_path
+        self.file = None
+        self.index_file = None  # Set when the history is a compressed container
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def _open(self):
+        # The daemon's default history lives under the cache dir, which may not exist yet
+        os.makedirs(os.path.dirname(os.path.abspath(self.history_file_path)), exist_ok=True)
+        exists = os.path.exists(self.history_file_path) and os.path.getsize(self.history_file_path) > 0
+        if is_compressed_history(self.history_file_path) or (HISTORY_COMPRESSION and not exists):
+            self.file, self.index_file = open_history_container(self.history_file_path)
+            return
+        
+        # Terminate a torn last line from a previous crash before appending
+        needs_newline = False
+        if os.path.exists(self.history_file_path) and os.path.getsize(self.history_file_path) > 0:
+            with open(self.history_file_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self.file = open(self.history_file_path, "a", encoding="utf-8")
+        if needs_newline:
+            self.file.write("\n")
+
+    def append(self, role, text):
+        """Appends one message; cost is independent of the history length."""
+        if not text:
+            return
+        if self.file is None:
+            self._open()
+        record = {'role': role, 'text': text, 'ts': round(time.time(), 3)}
+        if self.index_file is not None:
+            # Frame first: an index entry without its frame is dropped when the container is reopened
+            frame, tokens, role_code = encode_history_frame(record)
+            offset = self.file.tell()
+            self.file.write(frame)
+            self.file.flush()
+            self.index_file.write(HISTORY_INDEX_ENTRY.pack(offset, len(frame), tokens, role_code))
+            self.index_file.flush()
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+        update_history_catalog(self.history_file_path)
+        self.unsynced += 1
+        if self.unsynced >= HISTORY_FSYNC_EVERY or time.monotonic() - self.last_sync >= HISTORY_FSYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        """Forces appended lines to disk."""
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+            if self.index_file is not None:
+                os.fsync(self.index_file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        """Syncs and closes the journal file."""
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
+
+def message_to_text(message):
+    """
+    Extracts the text of a chat message (a string or a list of strings/Parts/Files) for the journal.
+    Only plain string items are kept: uploaded files and inline file bundles are not journaled.
+    """
+    if isinstance(message, str):
+        return message
+    return "\n".join(part for part in message if isinstance(part, str))
+
+def record_chat_turn(user_message, reply_text, metrics=None):
+    """Appends a completed user/model exchange to the current history journal."""
+    if CURRENT_JOURNAL is None:
+        return
+    started_at = time.monotonic()
+    try:
+        CURRENT_JOURNAL.append('user', message_to_text(user_message))
+        CURRENT_JOURNAL.append('model', reply_text)
+    except Exception as e:
+        # NOTE: This string is not localized because it's only an error fallback
+        print(f"Error saving history: {e}")
+    if metrics is not None:
+        metrics['history_save_s'] = time.monotonic() - started_at
+
+def close_chat_history():
+    """Flushes and closes the history journal at the end of the session."""
+    try:
+        if CURRENT_JOURNAL is not None:
+            CURRENT_JOURNAL.close()
+    except Exception as e:
+        # NOTE: This string is not localized because it's only an error fallback
+        print(f"Error saving history: {e}")
+
+# --- CONTEXT WINDOW (TOKEN BUDGET + ROLLING SUMMARY) ---
+
+def estimate_tokens(text):
+    """Cheap token estimate for budgeting (no API call)."""
+    return len(text) // CONTEXT_CHARS_PER_TOKEN + 1
+
+def record_tokens(record):
+    """Token estimate of a history record (compressed histories keep it in their index, so nothing is decompressed)."""
+    return record.get('tokens') or estimate_tokens(record['text'])
+
+def get_summary_file(history_file_path):
+    """Returns the path of the rolling summary stored next to a history file."""
+    return history_file_path + ".summary.json"
+
+def load_context_summary(history_file_path):
+    """Loads the persisted rolling summary: {'covered': number of records folded in, 'summary': text}."""
+    summary_file = get_summary_file(history_file_path)
+    if os.path.exists(summary_file):
+        try:
+            with open(summary_file, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            if isinstance(state.get('covered'), int) and isinstance(state.get('summary'), str):
+                return state
+        except Exception:
+            pass
+    return {'covered': 0, 'summary': ""}
+
+def save_context_summary(history_file_path, state):
+    """Atomically writes the rolling summary next to the history file."""
+    summary_file = get_summary_file(history_file_path)
+    try:
+        tmp_path = summary_file + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, summary_file)
+    except Exception as e:
+        # NOTE: This string is not localized because it's only an error fallback
+        print(f"Error saving history summary: {e}")
+
+def summarize_turns(client, previous_summary, records):
+    """Folds older turns (and the previous summary) into a new compact summary with one model call."""
+    transcript = "\n\n".join(f"{record['role'].upper()}: {record['text']}" for record in records)
+    prompt = (
+        "Update the running summary of an earlier conversation between a user and a CLI assistant. "
+        "Keep facts, decisions, file names, commands and open questions; drop pleasantries. "
+        "Answer with the summary only.\n\n"
+        f"[PREVIOUS SUMMARY]:\n{previous_summary or '(none)'}\n\n"
+        f"[TURNS TO ADD]:\n{transcript}"
+    )
+    response = client.models.generate_content(model=MODEL_NAME, contents=prompt)
+    return (response.text or "").strip()
+
+def summary_to_contents(summary):
+    """Represents the rolling summary as a user/model exchange at the start of the chat history."""
+    return [
+        types.Content(role='user', parts=[types.Part.from_text(text=f"[CONTEXT: SUMMARY OF EARLIER CONVERSATION]: {summary}")]),
+        types.Content(role='model', parts=[types.Part.from_text(text="Understood. I will use this summary as context.")]),
+    ]
+
+def is_summary_paused(history_file_path):
+    """True while summarizing this history is paused after a failure (see CONTEXT_SUMMARY_RETRY_DELAY)."""
+    return CONTEXT_SUMMARY_RETRY_AT.get(history_file_path, 0) > time.time()
+
+def is_corpus_part(part):
+    """True for a message part that carries analyzed files: an uploaded/inline file or a bundle/findings text."""
+    text = getattr(part, 'text', None)
+    if text is None:
+        return getattr(part, 'file_data', None) is not None or getattr(part, 'inline_data', None) is not None or getattr(part, 'uri', None) is not None
+    return text.startswith(CORPUS_TEXT_PREFIXES)
+
+def get_latest_corpus(chat):
+    """Returns the file parts of the latest /analyze turn still in the chat's history (they are not journaled)."""
+    for message in reversed(chat.get_history()):
+        if getattr(message, 'role', None) != 'user':
+            continue
+        parts = [part for part in message.parts or [] if is_corpus_part(part)]
+        if parts:
+            return parts
+    return []
+
+def corpus_to_contents(parts):
+    """Represents the files of the latest /analyze as a user/model exchange, so a rebuilt chat keeps them."""
+    return [
+        types.Content(role='user', parts=[types.Part.from_text(text="[CONTEXT: FILES OF THE LATEST /analyze]:")] + list(parts)),
+        types.Content(role='model', parts=[types.Part.from_text(text="Understood. I will use these files as context.")]),
+    ]
+
+def build_context_window(client, history_file_path, records=None, corpus=None, language=None):
+    """
+    Returns the chat history to send: a rolling summary of old turns, the corpus parts of the
+    latest /analyze (if given) and the most recent turns that fit in CONTEXT_TOKEN_BUDGET.
+    Old turns are only summarized when the window overflows, and the summary is persisted
+    so reloading the history does not recompute it. Notices are printed in the given language.
+    """
+    loc = LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]
+    records_loaded_here = records is None
+    if records is None:
+        records = load_history_records(history_file_path)
+
+    state = load_context_summary(history_file_path)
+    if state['covered'] > len(records):
+        # The history file was edited or replaced; the summary no longer applies
+        state = {'covered': 0, 'summary': ""}
+
+    keep_from = state['covered']
+    window_tokens = sum(record_tokens(record) for record in records[keep_from:])
+
+    if window_tokens > CONTEXT_TOKEN_BUDGET:
+        # Keep the newest turns within the trimmed budget, starting on a user turn
+        target = CONTEXT_TOKEN_BUDGET * CONTEXT_TRIM_RATIO
+        kept_tokens = 0
+        new_keep_from = len(records)
+        while new_keep_from > keep_from:
+            cost = record_tokens(records[new_keep_from - 1])
+            if kept_tokens + cost > target:
+                break
+            kept_tokens += cost
+            new_keep_from -= 1
+        while new_keep_from < len(records) and records[new_keep_from]['role'] != 'user':
+            new_keep_from += 1
+
+        if new_keep_from > keep_from and not is_summary_paused(history_file_path):
+            print(loc['context_summarizing'].format(count=new_keep_from - keep_from))
+            try:
+                summary = summarize_turns(client, state['summary'], records[keep_from:new_keep_from])
+                state = {'covered': new_keep_from, 'summary': summary}
+                save_context_summary(history_file_path, state)
+                keep_from = new_keep_from
+                CONTEXT_SUMMARY_RETRY_AT.pop(history_file_path, None)
+            except Exception as e:
+                # Without a fresh summary, resend the unsummarized turns rather than lose them,
+                # and do not retry (and rebuild the chat) on every following turn
+                print(loc['context_summary_failed'].format(error=e))
+                CONTEXT_SUMMARY_RETRY_AT[history_file_path] = time.time() + CONTEXT_SUMMARY_RETRY_DELAY
+
+    history = summary_to_contents(state['summary']) if state['summary'] else []
+    if corpus:
+        history.extend(corpus_to_contents(corpus))
+    history.extend(records_to_contents(records[keep_from:]))
+    if records_loaded_here:
+        close_history_records(records)
+    return history
+
+def get_chat_config(language=None):
+    """Chat config with the localized system instruction (default: the current language)."""
+    loc = LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]
+    return types.GenerateContentConfig(
+        system_instruction=loc['system_instruction']
+    )
+
+def create_chat(client, history):
+    """Creates a chat session with the localized system instruction."""
+    config = get_chat_config()
+    
+    # MODEL_NAME is gemini-2.5-flash-lite
+    return client.chats.create(
+        model=MODEL_NAME, 
+        history=history,
+        config=config
+    )
+
+def needs_compaction(chat, history_file_path=None):
+    """
+    True once the conversation in a chat's history exceeds CONTEXT_TOKEN_BUDGET and summarizing is
+    not paused for its history file. Turns are counted the way build_context_window counts their
+    journal records (one text per turn); analyzed files and the summary/corpus preamble are left out,
+    so a freshly rebuilt chat is never over the budget again before a new turn pushes it there.
+    """
+    if history_file_path is not None and is_summary_paused(history_file_path):
+        return False
+    turns = []  # [role, texts] with streamed chunks of one reply merged, as in the journal
+    for message in chat.get_history():
+        texts = [part.text for part in message.parts or [] if getattr(part, 'text', None) and not is_corpus_part(part)]
+        if turns and turns[-1][0] == message.role:
+            turns[-1][1].extend(texts)
+        else:
+            turns.append([message.role, texts])
+    history_tokens = 0
+    skip_reply = False
+    for role, texts in turns:
+        if skip_reply and role == 'model':
+            # The acknowledgment of a preamble message
+            skip_reply = False
+            continue
+        skip_reply = bool(texts) and texts[0].startswith(CONTEXT_PREAMBLE_PREFIXES)
+        if texts and not skip_reply:
+            history_tokens += estimate_tokens(("\n" if role == 'user' else "").join(texts))
+    return history_tokens > CONTEXT_TOKEN_BUDGET
+
+def compact_chat_if_needed(client, chat):
+    """
+    Rebuilds the chat from the journal with a fresh context window once the in-session history exceeds
+    the budget. The files of the latest /analyze are carried over, since the journal only has the text.
+    """
+    if CURRENT_HISTORY_FILE is None or not needs_compaction(chat, CURRENT_HISTORY_FILE):
+        return chat
+
+    if CURRENT_JOURNAL is not None:
+        CURRENT_JOURNAL.sync()
+    return create_chat(client, build_context_window(client, CURRENT_HISTORY_FILE, corpus=get_latest_corpus(chat)))
+
+# --- UPLOAD CACHE (CONTENT-ADDRESSED MANIFEST) ---
+
+def get_upload_cache_scope():
+    """Identifies the API key (hashed) that owns the cached uploads; files are only accessible from their project."""
+    return hashlib.sha256((get_api_key() or "").encode("utf-8")).hexdigest()[:16]
+
+def load_upload_cache():
+    """
+    Loads the on-disk upload manifest of the current API key and evicts expired remote handles.
+    'paths' maps a local file path to its size/mtime and content hash (stat fast-path),
+    'blobs' maps a content hash (plus the variant tag for preprocessed images) to the remote
+    File name, URI, MIME type and expiry.
+    """
+    cache = {'scope': get_upload_cache_scope(), 'paths': {}, 'blobs': {}}
+    if not UPLOAD_CACHE_ENABLED or not os.path.exists(UPLOAD_CACHE_FILE):
+        return cache
+    try:
+        with open(UPLOAD_CACHE_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get('scope') != cache['scope']:
+            # Written with another API key: its files belong to a project this key cannot access
+            return cache
+        cache['paths'] = data.get('paths', {})
+        cache['blobs'] = data.get('blobs', {})
+    except Exception:
+        return cache
+
+    # Evict remote handles that are expired (or about to expire)
+    now = time.time()
+    cache['blobs'] = {
+        digest: blob for digest, blob in cache['blobs'].items()
+        if blob.get('expires_at', 0) - UPLOAD_CACHE_SAFETY_MARGIN > now
+    }
+    # Path entries are only useful while their content is still uploaded
+    uploaded_digests = {key.split(':', 1)[0] for key in cache['blobs']}
+    cache['paths'] = {
+        path: entry for path, entry in cache['paths'].items()
+        if entry.get('sha256') in uploaded_digests
+    }
+    return cache
+
+def save_upload_cache(cache):
+    """Atomically writes the upload manifest to disk."""
+    if not UPLOAD_CACHE_ENABLED:
+        return
+    try:
+        os.makedirs(os.path.dirname(UPLOAD_CACHE_FILE), exist_ok=True)
+        tmp_path = UPLOAD_CACHE_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.replace(tmp_path, UPLOAD_CACHE_FILE)
+    except Exception as e:
+        # NOTE: This string is not localized because it's only an error fallback
+        print(f"Error saving upload cache: {e}")
+
+def hash_file(file_path):
+    """Returns the SHA-256 hex digest of a file, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def get_file_digest(cache, file_path, stat_result):
+    """Returns the content hash of a file, skipping the read when size and mtime are unchanged."""
+    entry = cache['paths'].get(file_path)
+    if entry and entry.get('size') == stat_result.st_size and entry.get('mtime_ns') == stat_result.st_mtime_ns:
+        return entry['sha256']
+
+    digest = hash_file(file_path)
+    cache['paths'][file_path] = {
+        'size': stat_result.st_size,
+        'mtime_ns': stat_result.st_mtime_ns,
+        'sha256': digest,
+    }
+    return digest
+
+def remember_upload(cache, digest, file_obj, mime_type):
+    """Records a freshly uploaded File in the manifest under its content hash."""
+    expiration = getattr(file_obj, 'expiration_time', None)
+    if expiration is not None and hasattr(expiration, 'timestamp'):
+        expires_at = expiration.timestamp()
+    else:
+        expires_at = time.time() + UPLOAD_CACHE_DEFAULT_TTL
+
+    cache['blobs'][digest] = {
+        'name': file_obj.name,
+        'uri': file_obj.uri,
+        'mime_type': getattr(file_obj, 'mime_type', None) or mime_type,
+        'expires_at': expires_at,
+    }
+
+def is_inaccessible_file_error(error):
+    """True if a request failed because a referenced file is gone (404) or belongs to another project (403)."""
+    return get_error_code(error) in (403, 404) or is_missing_file_error(error) or 'PERMISSION_DENIED' in str(error).upper()
+
+def forget_failed_uploads(error, message=None, chat=None, language=None):
+    """
+    After a request failed on a missing or inaccessible file, drops the upload-cache entries of the
+    files in the message (and the chat history), so the next /analyze uploads them again.
+    """
+    if not UPLOAD_CACHE_ENABLED or not is_inaccessible_file_error(error):
+        return
+    items = list(message) if isinstance(message, (list, tuple)) else []
+    if chat is not None:
+        items.extend(part for content in chat.get_history() for part in content.parts or [])
+    uris = set()
+    for item in items:
+        file_data = getattr(item, 'file_data', None)
+        uri = getattr(file_data, 'file_uri', None) or getattr(item, 'file_uri', None) or getattr(item, 'uri', None)
+        if uri:
+            uris.add(uri)
+    if not uris:
+        return
+    
+    cache = load_upload_cache()
+    stale = [key for key, blob in cache['blobs'].items() if blob.get('uri') in uris]
+    if stale:
+        for key in stale:
+            del cache['blobs'][key]
+        save_upload_cache(cache)
+        print(LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]['upload_cache_evicted'].format(count=len(stale)))
+
+# --- FOLDER SCANNER (/analyze) ---
+
+def compile_ignore_pattern(pattern):
+    """
+    Compiles one gitignore-style line into a rule dict, or returns None for blanks/comments.
+    Supports '!' negation, trailing '/' (directories only), leading or inner '/' (anchored), '*', '?' and '**'.
+    """
+    pattern = pattern.rstrip("\n").rstrip()
+    if not pattern or pattern.startswith('#'):
+        return None
+
+    negated = pattern.startswith('!')
+    if negated:
+        pattern = pattern[1:]
+    pattern = pattern.replace('\\#', '#').replace('\\!', '!')
+
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    if not pattern:
+        return None
+
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith('**/', i):
+            regex += "(?:.*/)?"
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            regex += "/.*"
+            i += 3
+        elif pattern.startswith('**', i):
+            regex += ".*"
+            i += 2
+        elif pattern[i] == '*':
+            regex += "[^/]*"
+            i += 1
+        elif pattern[i] == '?':
+            regex += "[^/]"
+            i += 1
+        elif pattern[i] == '[' and ']' in pattern[i + 1:]:
+            close = pattern.index(']', i + 1)
+            regex += "[" + pattern[i + 1:close].replace('!', '^', 1) + "]"
+            i = close + 1
+        else:
+            regex += re.escape(pattern[i])
+            i += 1
+
+    if not anchored:
+        # Unanchored patterns match at any depth below the .gitignore
+        regex = "(?:.*/)?" + regex
+    return {'regex': re.compile(regex + "$"), 'negated': negated, 'dir_only': dir_only}
+
+def load_ignore_rules(directory, base_rel_path):
+    """Reads the .gitignore of a directory; rules are matched relative to base_rel_path."""
+    rules = []
+    gitignore_path = os.path.join(directory, ".gitignore")
+    if os.path.isfile(gitignore_path):
+        try:
+            with open(gitignore_path, "r", encoding="utf-8", errors="replace") as f:
+                for line in f:
+                    rule = compile_ignore_pattern(line)
+                    if rule:
+                        rule['base'] = base_rel_path
+                        rules.append(rule)
+        except OSError:
+            pass
+    return rules
+
+def is_ignored(rel_path, is_dir, rules):
+    """Applies ignore rules in order; the last matching rule decides (gitignore semantics)."""
+    ignored = False
+    for rule in rules:
+        if rule['dir_only'] and not is_dir:
+            continue
+        base = rule['base']
+        if base:
+            if not rel_path.startswith(base + "/"):
+                continue
+            candidate = rel_path[len(base) + 1:]
+        else:
+            candidate = rel_path
+        if rule['regex'].match(candidate):
+            ignored = not rule['negated']
+    return ignored
+
+def get_scan_priority(file_info):
+    """Sort key for scanned files: source/text before images, shallow paths first, then smaller files."""
+    is_image = file_info['extension'] in ANALYZE_IMAGE_EXTENSIONS
+    return (is_image, file_info['rel_path'].count('/'), file_info['size'], file_info['rel_path'])
+
+def scan_folder(folder_path, extensions=ANALYZE_ALLOWED_EXTENSIONS, max_file_size=ANALYZE_MAX_FILE_SIZE,
+                max_total_bytes=ANALYZE_MAX_TOTAL_BYTES, max_files=ANALYZE_MAX_FILES):
+    """
+    Scans a folder for /analyze with os.scandir before anything is uploaded.
+    Ignored directories (ANALYZE_DEFAULT_IGNORES and .gitignore files) are never entered.
+    Returns {'files': [...], 'skipped': [(rel_path, reason)], 'total_bytes': int, 'elapsed': float},
+    where 'files' is prioritized (see get_scan_priority) and trimmed to max_files / max_total_bytes
+    (max_file_size None: no per-file limit).
+    """
+    started_at = time.monotonic()
+    default_rules = []
+    for pattern in ANALYZE_DEFAULT_IGNORES:
+        rule = compile_ignore_pattern(pattern)
+        if rule:
+            rule['base'] = ""
+            default_rules.append(rule)
+
+    candidates = []
+    skipped = []
+    # Depth-first stack of (absolute dir, relative dir, rules in effect)
+    stack = [(folder_path, "", default_rules + load_ignore_rules(folder_path, ""))]
+
+    while stack:
+        directory, rel_dir, rules = stack.pop()
+        try:
+            with os.scandir(directory) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            skipped.append((rel_dir or ".", 'error'))
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    if is_ignored(rel_path, True, rules):
+                        skipped.append((rel_path + "/", 'ignored'))
+                    else:
+                        subdirectories.append((entry.path, rel_path))
+                    continue
+                if not entry.is_file():
+                    continue
+                if is_ignored(rel_path, False, rules):
+                    skipped.append((rel_path, 'ignored'))
+                    continue
+
+                extension = os.path.splitext(entry.name)[1].lower()
+                if extension not in extensions:
+                    skipped.append((rel_path, 'type'))
+                    continue
+
+                file_stat = entry.stat()
+                if max_file_size is not None and file_stat.st_size > max_file_size:
+                    skipped.append((rel_path, 'large'))
+                    continue
+
+                candidates.append({
+                    'path': entry.path,
+                    'rel_path': rel_path,
+                    'name': entry.name,
+                    'extension': extension,
+                    'size': file_stat.st_size,
+                    'stat': file_stat,
+                })
+            except OSError:
+                skipped.append((rel_path, 'error'))
+
+        # Push in reverse so subdirectories are visited in name order
+        for sub_path, sub_rel in reversed(subdirectories):
+            stack.append((sub_path, sub_rel, rules + load_ignore_rules(sub_path, sub_rel)))
+
+    # Enforce the budgets on the prioritized list
+    files = []
+    total_bytes = 0
+    for file_info in sorted(candidates, key=get_scan_priority):
+        if len(files) >= max_files or total_bytes + file_info['size'] > max_total_bytes:
+            skipped.append((file_info['rel_path'], 'budget'))
+            continue
+        files.append(file_info)
+        total_bytes += file_info['size']
+
+    return {'files': files, 'skipped': skipped, 'total_bytes': total_bytes, 'elapsed': time.monotonic() - started_at}
+
+def print_scan_report(scan, map_reduce_hint=True, language=None):
+    """Prints the scan summary and what was skipped, grouped by reason (and when --map-reduce would help)."""
+    loc = LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]
+    print(loc['scan_summary'].format(
+        files=len(scan['files']),
+        size_mb=scan['total_bytes'] / (1024 * 1024),
+        elapsed=scan['elapsed']
+    ))
+    for reason in ('ignored', 'type', 'large', 'budget', 'error'):
+        paths = [rel_path for rel_path, skip_reason in scan['skipped'] if skip_reason == reason]
+        if not paths:
+            continue
+        if reason == 'large':
+            for rel_path in paths:
+                print(loc['upload_skipping_large'] + rel_path)
+            continue
+        examples = ", ".join(paths[:5]) + (", ..." if len(paths) > 5 else "")
+        print(loc['scan_skipped'].format(count=len(paths), reason=loc['scan_reason_' + reason], examples=examples))
+    if map_reduce_hint and any(
+            skip_reason in ('large', 'budget') and os.path.splitext(rel_path)[1].lower() in MAP_REDUCE_EXTENSIONS
+            for rel_path, skip_reason in scan['skipped']):
+        print(loc['map_reduce_hint'])
+
+# --- FILE UPLOAD AND ANALYSIS FUNCTIONS ---
+
+def upload_single_file(client, file_path, mime_type, language=None):
+    """Uploads one file to the Gemini API, with SDK version fallback."""
+    loc = LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]
+    try:
+        # Attempt 1: Use syntax with mime_type (for modern SDKs)
+        return client.files.upload(
+            file=file_path,
+            mime_type=mime_type
+        )
+    except TypeError as e:
+        # Fallback for "unexpected keyword argument" (older SDKs)
+        if 'unexpected keyword argument' in str(e):
+            print(loc['upload_fallback'])
+            return client.files.upload(
+                file=file_path
+            )
+        raise
+
+def print_upload_progress(done, total, uploaded_bytes, started_at, failed, language=None):
+    """Rewrites a single progress/throughput line for the running upload batch."""
+    loc = LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]
+    elapsed = max(time.monotonic() - started_at, 1e-6)
+    line = loc['upload_progress'].format(
+        done=done,
+        total=total,
+        size_mb=uploaded_bytes / (1024 * 1024),
+        rate_mb=uploaded_bytes / (1024 * 1024) / elapsed,
+        failed=failed
+    )
+    end = "\n" if done == total else ""
+    print("\r" + line, end=end, flush=True)
+
+def read_bundle_text(file_path):
+    """Reads a small text file for inline bundling (undecodable bytes are replaced)."""
+    with open(file_path, "rb") as f:
+        data = f.read()
+    return data, data.decode("utf-8", errors="replace")
+
+def build_bundle_parts(entries):
+    """
+    Packs (rel_path, text) entries into as few inline text parts as possible,
+    each at most BUNDLE_MAX_PART_BYTES, with clear per-file path delimiters.
+    """
+    parts = []
+    current = []
+    current_size = 0
+    for rel_path, text in entries:
+        block = f"===== FILE: {rel_path} =====\n{text}\n===== END FILE: {rel_path} =====\n"
+        block_size = len(block.encode("utf-8"))
+        if current and current_size + block_size > BUNDLE_MAX_PART_BYTES:
+            parts.append("".join(current))
+            current = []
+            current_size = 0
+        current.append(block)
+        current_size += block_size
+    if current:
+        parts.append("".join(current))
+    return [types.Part.from_text(text="[INLINE FILES]\n" + part) for part in parts]
+
+def upload_folder_contents(client, folder_path, bundle_threshold=None, session=None, metrics=None):
+    """
+    Scans a folder (see scan_folder) and uploads the selected files to the Gemini API.
+    Text files up to bundle_threshold bytes (default BUNDLE_SMALL_FILE_THRESHOLD) are bundled into inline text parts,
+    files whose content is already uploaded (per the upload cache) are reused instead of re-uploaded,
+    the remaining files are uploaded in parallel (UPLOAD_CONCURRENCY) while keeping the scan order.
+    Large images are preprocessed first (see preprocess_image) in a worker pool while other files upload.
+    Temporary uploads are cleaned up with the given ChatSession (default: the process-wide list),
+    whose language is also used for the reports. Scan/upload figures are added to the metrics dict, if given.
+    """
+    language = session.language if session else None
+    loc = LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]
+    if bundle_threshold is None:
+        bundle_threshold = BUNDLE_SMALL_FILE_THRESHOLD
+    
+    if not os.path.isdir(folder_path):
+        print(loc['error_folder_not_found'] + folder_path)
+        return []
+    
+    cache = load_upload_cache()
+    seen_digests = set()
+    standby = {}  # digest -> jobs of duplicate files, uploaded only if the first copy fails
+    
+    # Ordered result slots: a cached Part, or None until the pending upload finishes
+    slots = []
+    pending = []  # (slot_index, file_name, file_path, mime_type, digest, cache_key, size, preprocess)
+    bundle_entries = []  # (rel_path, text) of small text files sent inline
+    bundle_bytes = 0
+    
+    print(loc['analyze_folder'] + folder_path)
+
+    # 1. Scan: ignore rules, budgets and priorities (no network)
+    scan = scan_folder(folder_path)
+    print_scan_report(scan, language=language)
+    reused = 0
+
+    # 2. Bundle small text files, hash the rest and resolve cache hits (no network)
+    for file_info in scan['files']:
+        file_name = file_info['rel_path']
+        file_path = file_info['path']
+        file_extension = file_info['extension']
+        
+        if file_extension not in ANALYZE_IMAGE_EXTENSIONS and file_info['size'] <= bundle_threshold:
+            try:
+                data, text = read_bundle_text(file_path)
+            except Exception as e:
+                print(loc['upload_failed'].format(file_name=file_name, error=e))
+                continue
+            digest = hashlib.sha256(data).hexdigest()
+            if digest in seen_digests:
+                print(loc['upload_duplicate'].format(file_name=file_name))
+                continue
+            seen_digests.add(digest)
+            bundle_entries.append((file_name, text))
+            bundle_bytes += len(data)
+            continue
+        
+        # Determine MIME type
+        if file_extension in ANALYZE_IMAGE_EXTENSIONS:
+            mime_type = {
+                '.png': 'image/png',
+                '.jpg': 'image/jpeg',
+                '.jpeg': 'image/jpeg'
+            }.get(file_extension, 'application/octet-stream')
+        else:
+            mime_type = "text/plain"
+        
+        try:
+            # Content-addressed lookup: identical files are uploaded only once
+            digest = get_file_digest(cache, file_path, file_info['stat'])
+        except Exception as e:
+            print(loc['upload_failed'].format(file_name=file_name, error=e))
+            continue
+        
+        # Preprocessed images are cached remotely per settings, so changing them uploads new variants
+        preprocess = is_image_preprocessed(file_info)
+        cache_key = f"{digest}:{get_image_variant_tag()}" if preprocess else digest
+        if digest in seen_digests:
+            print(loc['upload_duplicate'].format(file_name=file_name))
+            if digest in standby:
+                # Same content as a pending upload: this copy fills its slot if that upload fails
+                first_job = standby[digest][0]
+                standby[digest].append((first_job[0], file_name, file_path, mime_type, digest, cache_key, file_info['size'], preprocess))
+            continue
+        seen_digests.add(digest)
+        
+        blob = cache['blobs'].get(cache_key)
+        if blob:
+            print(loc['upload_cached'].format(file_name=file_name))
+            reused += 1
+            slots.append(types.Part.from_uri(file_uri=blob['uri'], mime_type=blob['mime_type']))
+            continue
+        
+        print(loc['upload_file'].format(file_name=file_name, mime_type=mime_type))
+        pending.append((len(slots), file_name, file_path, mime_type, digest, cache_key, file_info['size'], preprocess))
+        standby[digest] = [pending[-1]]
+        slots.append(None)
+    
+    if IMAGE_PREPROCESS_ENABLED and load_pillow() is None and any(
+            file_info['extension'] in ANALYZE_IMAGE_EXTENSIONS and file_info['size'] >= IMAGE_PREPROCESS_MIN_BYTES
+            for file_info in scan['files']):
+        print(loc['image_pillow_missing'])
+
+    # 3. Upload: bounded thread pool, per-file failure isolation
+    uploaded_bytes = 0
+    uploaded = 0
+    failed = 0
+    image_bytes = [0, 0, 0]  # Preprocessed images: count, source bytes, bytes sent
+    upload_started_at = time.monotonic()
+    if pending:
+        done = 0
+        total = len(pending)
+        
+        image_pool = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix="image") if any(job[7] for job in pending) else None
+        with ThreadPoolExecutor(max_workers=max(1, UPLOAD_CONCURRENCY)) as executor:
+            round_jobs = pending
+            while round_jobs:
+                futures = {
+                    executor.submit(upload_pending_file, client, job[2], job[3], job[4], image_pool if job[7] else None, language): job
+                    for job in round_jobs
+                }
+                failed_digests = []
+                for future in as_completed(futures):
+                    slot_index, file_name, _, mime_type, digest, cache_key, size, preprocess = futures[future]
+                    done += 1
+                    try:
+                        file_obj, sent_bytes = future.result()
+                        if not file_obj:
+                            raise ValueError(file_name)
+                        slots[slot_index] = file_obj
+                        uploaded += 1
+                        uploaded_bytes += sent_bytes
+                        if preprocess:
+                            image_bytes[0] += 1
+                            image_bytes[1] += size
+                            image_bytes[2] += sent_bytes
+                        if UPLOAD_CACHE_ENABLED:
+                            # Cached uploads stay remote until they expire and are reused later
+                            remember_upload(cache, cache_key, file_obj, mime_type)
+                        else:
+                            record_temp_upload(file_obj, session)
+                    except Exception as e:
+                        failed += 1
+                        failed_digests.append(digest)
+                        print("\r" + loc['upload_failed'].format(file_name=file_name, error=e))
+                    print_upload_progress(done, total, uploaded_bytes, upload_started_at, failed, language)
+                
+                # Give content whose upload failed another chance through a duplicate copy, if there is one
+                round_jobs = []
+                for digest in failed_digests:
+                    standby[digest].pop(0)
+                    if standby[digest]:
+                        round_jobs.append(standby[digest][0])
+                total += len(round_jobs)
+        if image_pool is not None:
+            image_pool.shutdown()
+            prune_image_cache()
+    
+    if image_bytes[0]:
+        print(loc['image_preprocessed'].format(
+            count=image_bytes[0], before_mb=image_bytes[1] / (1024 * 1024), after_mb=image_bytes[2] / (1024 * 1024)
+        ))
+    save_upload_cache(cache)
+    
+    if metrics is not None:
+        metrics['scan_s'] = scan['elapsed']
+        metrics['upload_s'] = time.monotonic() - upload_started_at
+        metrics['files_uploaded'] = uploaded
+        metrics['bytes_uploaded'] = uploaded_bytes
+        metrics['files_reused'] = reused
+        metrics['files_bundled'] = len(bundle_entries)
+        metrics['bytes_bundled'] = bundle_bytes
+        metrics['images_preprocessed'] = image_bytes[0]
+        metrics['image_bytes_saved'] = image_bytes[1] - image_bytes[2]
+    
+    bundle_parts = build_bundle_parts(bundle_entries) if bundle_entries else []
+    if bundle_parts:
+        print(loc['upload_bundled'].format(count=len(bundle_entries), parts=len(bundle_parts), size_kb=bundle_bytes / 1024))
+    return bundle_parts + [part for part in slots if part is not None]
+
+# --- IMAGE PREPROCESSING (/analyze) ---
+# Screenshots and photos are downsampled to IMAGE_MAX_DIMENSION, recompressed and stripped of
+# metadata (EXIF, ICC, text chunks) before upload. Variants are cached in IMAGE_CACHE_DIR under
+# the source hash and the settings, so unchanged images are processed only once.
+
+def load_pillow():
+    """Imports Pillow on first use; returns (Image, ImageOps) or None if it is not installed."""
+    global PILLOW
+    if PILLOW is None:
+        try:
+            # Optional: pip install Pillow (without it images are uploaded unchanged)
+            from PIL import Image, ImageOps
+            PILLOW = (Image, ImageOps)
+        except ImportError:
+            PILLOW = False
+    return PILLOW or None
+
+def get_image_variant_tag():
+    """Identifies the preprocessing settings; part of the image cache and upload cache keys."""
+    return f"img{IMAGE_MAX_DIMENSION}px-q{IMAGE_JPEG_QUALITY}-v2"
+
+def is_image_preprocessed(file_info):
+    """True if an /analyze image goes through preprocess_image before upload."""
+    return (IMAGE_PREPROCESS_ENABLED and file_info['extension'] in ANALYZE_IMAGE_EXTENSIONS
+            and file_info['size'] >= IMAGE_PREPROCESS_MIN_BYTES and load_pillow() is not None)
+
+def preprocess_image(file_path, digest):
+    """
+    Returns the path of the image variant to upload: downsampled, recompressed in its own format
+    and without metadata, cached by source hash. The original is used when the image cannot be
+    decoded or when the variant is not smaller than it.
+    """
+    Image, ImageOps = load_pillow()
+    extension = os.path.splitext(file_path)[1].lower()
+    key = hashlib.sha256(f"{digest}:{get_image_variant_tag()}".encode("utf-8")).hexdigest()[:32]
+    cached_path = os.path.join(IMAGE_CACHE_DIR, key + extension)
+    if os.path.exists(cached_path):
+        os.utime(cached_path)  # Most recently used variants survive pruning
+        return cached_path
+    if os.path.exists(cached_path + ".orig"):
+        return file_path
+
+    try:
+        with Image.open(file_path) as source:
+            # Apply the EXIF orientation before the EXIF block is dropped
+            image = ImageOps.exif_transpose(source)
+            if max(image.size) > IMAGE_MAX_DIMENSION:
+                image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+            image.info = {key: value for key, value in image.info.items() if key == 'transparency'}
+            output = io.BytesIO()
+            if extension in ('.jpg', '.jpeg'):
+                if image.mode not in ('RGB', 'L'):
+                    image = image.convert('RGB')
+                image.save(output, 'JPEG', quality=IMAGE_JPEG_QUALITY, optimize=True, progressive=True)
+            else:
+                # Screenshots stay lossless so small text remains legible
+                image.save(output, 'PNG', optimize=True)
+    except Exception:
+        return file_path
+
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    data = output.getvalue()
+    if len(data) >= os.path.getsize(file_path):
+        # Not smaller (e.g. a flat screenshot whose resampled edges compress worse): remember to send it as is
+        open(cached_path + ".orig", "wb").close()
+        return file_path
+    tmp_path = f"{cached_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, cached_path)
+    return cached_path
+
+def prune_image_cache():
+    """Deletes the least recently used variants once IMAGE_CACHE_DIR exceeds IMAGE_CACHE_MAX_BYTES."""
+    try:
+        entries = [entry for entry in os.scandir(IMAGE_CACHE_DIR) if entry.is_file()]
+    except OSError:
+        return
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+        if total <= IMAGE_CACHE_MAX_BYTES:
+            break
+        try:
+            total -= entry.stat().st_size
+            os.remove(entry.path)
+        except OSError:
+            continue
+
+def upload_pending_file(client, file_path, mime_type, digest=None, image_pool=None, language=None):
+    """
+    Upload worker: images are first preprocessed in image_pool (bounded CPU work that overlaps
+    with the other uploads). Returns (File, bytes sent).
+    """
+    if image_pool is not None:
+        file_path = image_pool.submit(preprocess_image, file_path, digest).result()
+    return upload_single_file(client, file_path, mime_type, language), os.path.getsize(file_path)
+
+# --- MAP-REDUCE ANALYSIS (/analyze --map-reduce) ---
+# Folders and logs larger than one context are split into shards of about MAP_REDUCE_SHARD_BYTES
+# (whole lines, small files packed together). The question is asked about every shard in parallel
+# ("map"), then the partial answers are merged ("reduce"): in groups while they are too large for
+# one request, and finally by the chat turn itself, so the answer streams and stays in the history.
+
+MAP_REDUCE_NO_DATA = "NO_RELEVANT_DATA"
+
+def scan_map_reduce_target(path):
+    """Scans a folder (or a single text file) for map-reduce: no per-file limit, text files only, path order."""
+    if os.path.isfile(path):
+        file_stat = os.stat(path)
+        file_info = {'path': path, 'rel_path': os.path.basename(path), 'name': os.path.basename(path),
+                     'extension': os.path.splitext(path)[1].lower(), 'size': file_stat.st_size, 'stat': file_stat}
+        return {'files': [file_info], 'skipped': [], 'total_bytes': file_stat.st_size, 'elapsed': 0.0}
+    scan = scan_folder(path, MAP_REDUCE_EXTENSIONS, None, MAP_REDUCE_MAX_TOTAL_BYTES, MAP_REDUCE_MAX_FILES)
+    # Keep related files (and rotated logs) next to each other instead of the upload priority order
+    scan['files'].sort(key=lambda file_info: file_info['rel_path'])
+    return scan
+
+def plan_shards(files, shard_bytes):
+    """
+    Splits files into shards: lists of (file_info, start, end) byte ranges of about shard_bytes.
+    Large files are cut after a line break (only the bytes around each cut are read),
+    small files are packed together and never split.
+    """
+    shards = []
+    current = []
+    current_size = 0
+    for file_info in files:
+        size = file_info['size']
+        if current and current_size + size > shard_bytes:
+            shards.append(current)
+            current = []
+            current_size = 0
+        if size <= shard_bytes:
+            current.append((file_info, 0, size))
+            current_size += size
+            continue
+        
+        start = 0
+        with open(file_info['path'], 'rb') as f:
+            while size - start > shard_bytes:
+                f.seek(start + shard_bytes)
+                f.readline(shard_bytes)  # Finish the line (a huge line is cut after another shard_bytes)
+                end = min(f.tell(), size)
+                shards.append([(file_info, start, end)])
+                start = end
+        # The tail of a large file may share its shard with the following files
+        if start < size:
+            current = [(file_info, start, size)]
+            current_size = size - start
+    if current:
+        shards.append(current)
+    return shards
+
+def read_shard(shard):
+    """Reads the byte ranges of a shard into one text with per-file delimiters (like the inline bundles)."""
+    blocks = []
+    for file_info, start, end in shard:
+        with open(file_info['path'], 'rb') as f:
+            f.seek(start)
+            text = f.read(end - start).decode("utf-8", errors="replace")
+        label = file_info['rel_path']
+        if start or end != file_info['size']:
+            label += f" (bytes {start}-{end} of {file_info['size']})"
+        blocks.append(f"===== FILE: {label} =====\n{text}\n===== END FILE: {label} =====\n")
+    return "".join(blocks)
+
+def run_map_step(generate, shard, prompt, index, total, config):
+    """Map step: asks the question about one shard (read here, so only the shards in flight are in memory)."""
+    instruction = (
+        f"[MAP-REDUCE PART {index}/{total}]: The files above are one part of a set that is too large to read at once; "
+        f"the other parts are analyzed separately and the answers are merged afterwards. Answer the question using "
+        f"only this part and keep the evidence: file names, relevant lines, timestamps and counts. If this part "
+        f"contains nothing relevant to the question, reply only with {MAP_REDUCE_NO_DATA}.\n\n[USER QUESTION]: {prompt}"
+    )
+    return generate(model=MODEL_NAME, contents=[read_shard(shard), instruction], config=config)
+
+def format_findings(findings, total):
+    """Joins (first_part, last_part, text) findings into one text with part labels."""
+    blocks = []
+    for first, last, text in findings:
+        label = f"part {first}" if first == last else f"parts {first}-{last}"
+        blocks.append(f"===== FINDINGS: {label} of {total} =====\n{text.strip()}\n")
+    return "\n".join(blocks)
+
+def add_map_reduce_usage(metrics, response):
+    """Adds the token counts of a map/reduce response to the turn metrics."""
+    usage = getattr(response, 'usage_metadata', None)
+    if metrics is None or usage is None:
+        return
+    metrics['map_input_tokens'] = metrics.get('map_input_tokens', 0) + (getattr(usage, 'prompt_token_count', None) or 0)
+    metrics['map_output_tokens'] = metrics.get('map_output_tokens', 0) + (getattr(usage, 'candidates_token_count', None) or 0)
+
+def reduce_findings(generate, prompt, findings, total, config, loc, metrics=None):
+    """
+    Intermediate reduce steps: merges findings in groups of up to MAP_REDUCE_REDUCE_BYTES (at least two
+    per group) until they fit into one request. Returns the remaining findings.
+    """
+    while len(findings) > 1 and len(format_findings(findings, total).encode("utf-8")) > MAP_REDUCE_REDUCE_BYTES:
+        groups = []
+        group_size = 0
+        for finding in findings:
+            finding_size = len(finding[2].encode("utf-8"))
+            if not groups or (len(groups[-1]) >= 2 and group_size + finding_size > MAP_REDUCE_REDUCE_BYTES):
+                groups.append([])
+                group_size = 0
+            groups[-1].append(finding)
+            group_size += finding_size
+        print(loc['map_reduce_merging'].format(count=len(findings), groups=len(groups)))
+        
+        instruction = (
+            "[MAP-REDUCE MERGE]: The findings above were produced separately for consecutive parts of a large set "
+            "of files. Merge them into one set of findings for the question: combine duplicates, keep the concrete "
+            f"evidence (file names, lines, timestamps, counts) and note contradictions.\n\n[USER QUESTION]: {prompt}"
+        )
+        merged = []
+        with ThreadPoolExecutor(max_workers=max(1, MAP_REDUCE_PARALLELISM)) as executor:
+            futures = [
+                executor.submit(generate, model=MODEL_NAME,
+                                contents=[format_findings(group, total), instruction], config=config)
+                if len(group) > 1 else None
+                for group in groups
+            ]
+            for group, future in zip(groups, futures):
+                if future is None:
+                    merged.append(group[0])
+                    continue
+                try:
+                    response = future.result()
+                    add_map_reduce_usage(metrics, response)
+                    merged.append((group[0][0], group[-1][1], response.text or ""))
+                except Exception as e:
+                    # Keep the unmerged findings; the final merge still sees them
+                    print(loc['map_reduce_merge_failed'].format(error=e))
+                    merged.append((group[0][0], group[-1][1], format_findings(group, total)))
+        if len(merged) == len(findings):
+            break
+        findings = merged
+    return findings
+
+def print_map_progress(done, total, relevant, failed, started_at, language=None):
+    """Rewrites a single progress line for the running map step."""
+    loc = LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]
+    line = loc['map_reduce_progress'].format(done=done, total=total, relevant=relevant, failed=failed, elapsed=time.monotonic() - started_at)
+    end = "\n" if done == total else ""
+    print("\r" + line, end=end, flush=True)
+
+def map_reduce_folder(client, path, prompt, shard_bytes=None, language=None, metrics=None, generate=None):
+    """
+    Runs the map step and the intermediate reduce steps of /analyze --map-reduce over a folder or a
+    single text file, with at most MAP_REDUCE_PARALLELISM model calls in flight. generate replaces
+    client.models.generate_content, e.g. to share the call slots of a batch run.
+    Returns the text part that asks the chat for the final merge, or None if there was no text to read.
+    """
+    loc = LOCALIZATION_STRINGS[language or CURRENT_LANGUAGE]
+    generate = generate or client.models.generate_content
+    shard_bytes = shard_bytes or MAP_REDUCE_SHARD_BYTES
+    try:
+        scan = scan_map_reduce_target(path)
+    except OSError:
+        return None
+    print_scan_report(scan, map_reduce_hint=False, language=language)
+    if metrics is not None:
+        metrics['scan_s'] = scan['elapsed']
+    if not scan['files'] or not scan['total_bytes']:
+        return None
+    
+    shards = plan_shards(scan['files'], shard_bytes)
+    total = len(shards)
+    print(loc['map_reduce_start'].format(
+        files=len(scan['files']), size_mb=scan['total_bytes'] / (1024 * 1024),
+        parts=total, parallel=max(1, MAP_REDUCE_PARALLELISM)
+    ))
+    
+    config = get_chat_config(language)
+    findings = []  # (first_part, last_part, text) of the parts with relevant data
+    failed = []  # (part, error)
+    map_started_at = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, MAP_REDUCE_PARALLELISM)) as executor:
+        futures = {
+            executor.submit(run_map_step, generate, shard, prompt, index, total, config): index
+            for index, shard in enumerate(shards, 1)
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            try:
+                response = future.result()
+                add_map_reduce_usage(metrics, response)
+                text = (response.text or "").strip()
+                if text and MAP_REDUCE_NO_DATA not in text[:len(MAP_REDUCE_NO_DATA) + 20]:
+                    findings.append((index, index, text))
+            except Exception as e:
+                failed.append((index, e))
+            print_map_progress(done, total, len(findings), len(failed), map_started_at, language)
+    findings.sort()
+    
+    reduce_started_at = time.monotonic()
+    findings = reduce_findings(generate, prompt, findings, total, config, loc, metrics)
+    if metrics is not None:
+        metrics['map_s'] = reduce_started_at - map_started_at
+        metrics['reduce_s'] = time.monotonic() - reduce_started_at
+        metrics['map_parts'] = total
+        metrics['map_failed'] = len(failed)
+        metrics['bytes_analyzed'] = scan['total_bytes']
+    
+    header = f"[MAP-REDUCE FINDINGS]: {os.path.basename(path.rstrip(os.sep)) or path} ({len(scan['files'])} files, {scan['total_bytes']} bytes) "
+    if total == 1:
+        header += "fit into one part, so the question was asked about all of it at once."
+    else:
+        header += (f"was split into {total} parts of up to about {shard_bytes} bytes each, and the question "
+                   f"was asked about each part separately. Parts without relevant data are left out.")
+    if failed:
+        print(loc['map_reduce_failed_parts'].format(count=len(failed), parts=", ".join(str(index) for index, _ in sorted(failed, key=lambda item: item[0]))))
+        header += f" {len(failed)} of {total} parts could not be analyzed because of API errors ({failed[0][1]}); mention that the answer may be incomplete."
+    if findings:
+        header += (" Merge the findings below into one complete answer to the question: combine duplicates, "
+                   "keep the concrete evidence (file names, lines, timestamps, counts) and point out contradictions or gaps.\n\n")
+        return header + format_findings(findings, total)
+    if len(failed) == total:
+        return header + " No part could be analyzed, so explain the failure to the user instead of answering."
+    return header + f" None of the {total} parts contained data relevant to the question; tell the user so."
+
+# --- TEMPORARY UPLOAD CLEANUP (LEDGER + ORPHAN SWEEP) ---
+
+def get_session_ledger_file(session_id=None):
+    """
+    Returns the ledger file of this process (or of one of its ChatSessions);
+    the leading PID in the name tells the sweep whether the session is still alive.
+    """
+    if session_id is None:
+        return os.path.join(UPLOAD_LEDGER_DIR, f"{os.getpid()}.jsonl")
+    tag = hashlib.sha1(str(session_id).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(UPLOAD_LEDGER_DIR, f"{os.getpid()}.{tag}.jsonl")
+
+def record_temp_upload(file_obj, session=None):
+    """Remembers a temporary upload for cleanup, in memory and in the on-disk ledger (written immediately)."""
+    (session.temp_files if session else TEMP_FILE_LIST).append(file_obj)
+    try:
+        os.makedirs(UPLOAD_LEDGER_DIR, exist_ok=True)
+        with open(session.ledger_file if session else get_session_ledger_file(), "a", encoding="utf-8") as f:
+            f.write(json.dumps({'name': file_obj.name, 'ts': round(time.time(), 3)}) + "\n")
+    except Exception as e:
+        # NOTE: This string is not localized because it's only an error fallback
+        print(f"Error writing upload ledger: {e}")
+
+def write_ledger(ledger_file, names):
+    """Rewrites a ledger with the names that still need deleting, or removes it when none are left."""
+    if not names:
+        if os.path.exists(ledger_file):
+            os.remove(ledger_file)
+        return
+    tmp_path = ledger_file + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for name in names:
+            f.write(json.dumps({'name': name, 'ts': round(time.time(), 3)}) + "\n")
+    os.replace(tmp_path, ledger_file)
+
+def is_missing_file_error(error):
+    """True if a delete failed only because the remote file is already gone."""
+    text = str(error).upper()
+    return '404' in text or 'NOT_FOUND' in text or 'NOT FOUND' in text
+
+def delete_remote_files(client, names):
+    """Deletes remote files concurrently (CLEANUP_CONCURRENCY). Returns a list of (name, error) failures."""
+    failures = []
+    if not names:
+        return failures
+    with ThreadPoolExecutor(max_workers=max(1, min(CLEANUP_CONCURRENCY, len(names)))) as executor:
+        futures = {executor.submit(client.files.delete, name=name): name for name in names}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                if not is_missing_file_error(e):
+                    failures.append((futures[future], e))
+    return failures
+
+def cleanup_uploaded_files(client, session=None):
+    """Deletes temporary files uploaded to the Gemini service (concurrently) and clears the session's ledger."""
+    temp_files = session.temp_files if session else TEMP_FILE_LIST
+    if not temp_files:
+        return
+    loc = LOCALIZATION_STRINGS[session.language if session else CURRENT_LANGUAGE]
+    print("\n" + loc['cleanup_start'])
+    failures = delete_remote_files(client, [file_obj.name for file_obj in temp_files])
+    for name, error in failures:
+        print(loc['cleanup_warning'].format(file_name=name, error=error))
+    temp_files.clear()
+    try:
+        # Failed deletions stay in the ledger and are retried by the next session's sweep
+        write_ledger(session.ledger_file if session else get_session_ledger_file(), [name for name, _ in failures])
+    except Exception:
+        pass
+
+def is_process_alive(pid):
+    """
+    Best-effort check whether a process still runs (ledgers of live sessions must not be swept).
+    Returns None when it cannot be determined.
+    """
+    if pid == os.getpid():
+        return True
+    if platform.system() == 'Windows':
+        # os.kill would terminate the process on Windows; the caller relies on the ledger age instead
+        return None
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    except OSError:
+        return False
+    return True
+
+def sweep_orphaned_uploads(client):
+    """Deletes uploads listed in ledgers of sessions that ended without cleaning up (crash, kill). Returns the count."""
+    if not os.path.isdir(UPLOAD_LEDGER_DIR):
+        return 0
+    removed = 0
+    now = time.time()
+    for entry in os.scandir(UPLOAD_LEDGER_DIR):
+        if not entry.name.endswith(".jsonl"):
+            continue
+        try:
+            pid = int(entry.name.split(".")[0])
+            age = now - entry.stat().st_mtime
+            if age > UPLOAD_LEDGER_MAX_AGE:
+                # Everything listed has already expired remotely
+                os.remove(entry.path)
+                continue
+            alive = is_process_alive(pid)
+            if alive or (alive is None and age < UPLOAD_LEDGER_MAX_AGE / 4):
+                continue
+
+            names = []
+            with open(entry.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        names.append(json.loads(line)['name'])
+                    except (ValueError, KeyError, TypeError):
+                        continue
+            failures = delete_remote_files(client, names)
+            write_ledger(entry.path, [name for name, _ in failures])
+            removed += len(names) - len(failures)
+        except Exception:
+            continue
+    return removed
+
+def _orphan_sweep_worker(client):
+    """Background thread body for sweep_orphaned_uploads."""
+    removed = sweep_orphaned_uploads(client)
+    if removed:
+        loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+        print("\n" + loc['cleanup_orphans'].format(count=removed))
+
+def start_orphan_sweep(client):
+    """Runs the orphan sweep in the background so startup is not delayed."""
+    threading.Thread(target=_orphan_sweep_worker, args=(client,), daemon=True).start()
+
+# --- SERVER-SIDE CONTEXT CACHE (/analyze FOLLOW-UPS) ---
+# The corpus of an /analyze --cache run is registered once with client.caches; follow-up questions
+# then only send the chat history and the new message, referring to the cache by name.
+
+def to_content_part(item):
+    """Converts an /analyze corpus item (uploaded File, Part or text) into a Part."""
+    if isinstance(item, str):
+        return types.Part.from_text(text=item)
+    if getattr(item, 'uri', None):
+        return types.Part.from_uri(file_uri=item.uri, mime_type=item.mime_type)
+    return item
+
+def create_context_cache(client, corpus, folder_path):
+    """
+    Registers the corpus plus the localized system instruction as cached content and makes it
+    the active cache. Returns False (after printing why) if the API refuses, e.g. when the corpus
+    is smaller than the model's minimum cacheable size; the caller then sends the files inline.
+    """
+    global ACTIVE_CONTEXT_CACHE
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    config = types.CreateCachedContentConfig(
+        display_name=("ai_assistant: " + os.path.basename(folder_path))[:128],
+        system_instruction=loc['system_instruction'],
+        contents=[types.Content(role='user', parts=[to_content_part(item) for item in corpus])],
+        ttl=f"{CONTEXT_CACHE_TTL}s",
+    )
+    try:
+        cache = client.caches.create(model=MODEL_NAME, config=config)
+    except Exception as e:
+        print(loc['context_cache_failed'].format(error=e))
+        return False
+    
+    # The corpus is kept to be re-attached to the chat if the cache disappears (see send_with_context_cache)
+    ACTIVE_CONTEXT_CACHE = {'name': cache.name, 'folder': folder_path, 'expires_at': time.time() + CONTEXT_CACHE_TTL, 'corpus': list(corpus)}
+    print(loc['context_cache_created'].format(ttl=CONTEXT_CACHE_TTL // 60))
+    return True
+
+def get_context_cache_config(client):
+    """
+    Returns a GenerateContentConfig attaching the active cache to a request, or None without one.
+    The TTL is extended while the cache is in use; an expired cache is forgotten.
+    """
+    global ACTIVE_CONTEXT_CACHE
+    if ACTIVE_CONTEXT_CACHE is None:
+        return None
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    
+    remaining = ACTIVE_CONTEXT_CACHE['expires_at'] - time.time()
+    expired = remaining <= 0
+    if not expired and remaining < CONTEXT_CACHE_TTL * CONTEXT_CACHE_REFRESH_RATIO:
+        try:
+            client.caches.update(
+                name=ACTIVE_CONTEXT_CACHE['name'],
+                config=types.UpdateCachedContentConfig(ttl=f"{CONTEXT_CACHE_TTL}s")
+            )
+            ACTIVE_CONTEXT_CACHE['expires_at'] = time.time() + CONTEXT_CACHE_TTL
+        except Exception:
+            # Already gone on the server
+            expired = True
+    if expired:
+        ACTIVE_CONTEXT_CACHE = None
+        print(loc['context_cache_expired'])
+        return None
+    
+    # The cache already carries the system instruction, which must not be sent again with it
+    return types.GenerateContentConfig(cached_content=ACTIVE_CONTEXT_CACHE['name'])
+
+def attach_corpus(corpus, message):
+    """Prepends corpus items to a message (a string or a list of parts)."""
+    return list(corpus) + (list(message) if isinstance(message, (list, tuple)) else [message])
+
+def send_with_context_cache(client, chat, message, metrics=None):
+    """
+    Sends a message with the active cache attached. If the cache is gone, the files were never part
+    of the chat history, so they are re-attached to this message (and stay in the history from then on).
+    """
+    global ACTIVE_CONTEXT_CACHE
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    cache = ACTIVE_CONTEXT_CACHE
+    config = get_context_cache_config(client)
+    if config is None:
+        if cache is not None:
+            message = attach_corpus(cache['corpus'], message)
+        return send_and_print(chat, message, metrics=metrics)
+    try:
+        return send_and_print(chat, message, config, metrics)
+    except Exception as e:
+        if not is_missing_file_error(e):
+            raise
+        # Deleted or expired on the server before the local TTL ran out
+        ACTIVE_CONTEXT_CACHE = None
+        if STREAM_RESPONSES:
+            print()  # End the reply line opened by send_message_streaming
+        print(loc['context_cache_expired'])
+        return send_and_print(chat, attach_corpus(cache['corpus'], message), metrics=metrics)
+
+def release_context_cache(client):
+    """Deletes the active cache (a new /analyze replaces it, and it is not kept past the session)."""
+    global ACTIVE_CONTEXT_CACHE
+    if ACTIVE_CONTEXT_CACHE is None:
+        return
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    name = ACTIVE_CONTEXT_CACHE['name']
+    ACTIVE_CONTEXT_CACHE = None
+    try:
+        client.caches.delete(name=name)
+    except Exception as e:
+        if not is_missing_file_error(e):
+            print(loc['context_cache_cleanup_warning'].format(name=name, error=e))
+
+# --- UTILITY AND CLIENT FUNCTIONS (System and Terminal History) ---
+
+def get_sysinfo_cache_key():
+    """Cache key for neofetch output: the result only changes with the host or kernel."""
+    return f"{platform.node()}|{platform.release()}"
+
+def load_cached_system_info():
+    """Returns cached neofetch output for this host/kernel if it is younger than SYSINFO_CACHE_TTL."""
+    try:
+        with open(SYSINFO_CACHE_FILE, "r", encoding="utf-8") as f:
+            entry = json.load(f).get(get_sysinfo_cache_key())
+        if entry and time.time() - entry['created_at'] < SYSINFO_CACHE_TTL:
+            return entry['output']
+    except Exception:
+        pass
+    return None
+
+def save_cached_system_info(output):
+    """Stores neofetch output for this host/kernel (other hosts sharing the home directory are kept)."""
+    try:
+        data = {}
+        if os.path.exists(SYSINFO_CACHE_FILE):
+            with open(SYSINFO_CACHE_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        data[get_sysinfo_cache_key()] = {'created_at': time.time(), 'output': output}
+        os.makedirs(os.path.dirname(SYSINFO_CACHE_FILE), exist_ok=True)
+        tmp_path = SYSINFO_CACHE_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, SYSINFO_CACHE_FILE)
+    except Exception:
+        pass
+
+def get_system_info():
+    """
+    Retrieves system information using 'neofetch' on Linux/macOS (cached on disk, see SYSINFO_CACHE_TTL). 
+    Returns a localized fallback message on other OSs (like Windows).
+    """
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    
+    if platform.system() != 'Linux': # Check for non-Linux system
+        return loc['sysinfo_non_linux']
+    
+    cached_output = load_cached_system_info()
+    if cached_output is not None:
+        return cached_output
+        
+    try:
+        output = subprocess.check_output(
+            ['neofetch', '--stdout', '--disable', 'ascii'],
+            stderr=subprocess.STDOUT
+        ).decode('utf-8')
+        clean_output = re.sub(r'\x1B\[[0-?]*[ -/]*[@-~]', '', output).strip()
+        save_cached_system_info(clean_output)
+        return clean_output
+    except (FileNotFoundError, Exception):
+        return "System info retrieval failed. Neofetch not found or error occurred."
+
+def iter_lines_reversed(file_path, block_size=HISTORY_TAIL_BLOCK_SIZE):
+    """Yields the raw lines (bytes, without newline) of a file from last to first, reading backwards in blocks."""
+    with open(file_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            lines = (f.read(read_size) + remainder).split(b"\n")
+            # The first piece may be the tail of a line that starts in an earlier block
+            remainder = lines.pop(0)
+            for line in reversed(lines):
+                yield line
+        yield remainder
+
+def unmetafy_zsh(raw_line):
+    """Decodes zsh's 'metafied' history bytes (0x83 marks a byte XOR-ed with 0x20)."""
+    if b"\x83" not in raw_line:
+        return raw_line
+    result = bytearray()
+    escaped = False
+    for byte in raw_line:
+        if escaped:
+            result.append(byte ^ 0x20)
+            escaped = False
+        elif byte == 0x83:
+            escaped = True
+        else:
+            result.append(byte)
+    return bytes(result)
+
+def read_shell_history_tail(history_file, shell, limit):
+    """
+    Returns the last `limit` commands of a shell history file, oldest first.
+    Only the end of the file is read, so time and memory do not depend on the file size.
+    Handles zsh extended history (': <ts>:<dur>;cmd') with backslash-continued lines and
+    fish YAML entries ('- cmd: ...' followed by 'when:'/'paths:' lines).
+    """
+    commands = []
+    pending = []  # zsh: lines of a multi-line command, in file order
+
+    for raw_line in iter_lines_reversed(history_file):
+        if len(commands) >= limit:
+            break
+
+        if shell == 'fish':
+            line = raw_line.decode("utf-8", errors="replace")
+            if line.startswith('- cmd: '):
+                command = unescape_fish_command(line[len('- cmd: '):]).strip()
+                if command:
+                    commands.append(command)
+            continue
+
+        if shell == 'zsh':
+            line = unmetafy_zsh(raw_line).decode("utf-8", errors="replace")
+            if pending and line.endswith('\\'):
+                # Earlier line of a backslash-continued command
+                pending.insert(0, line[:-1])
+                continue
+            if pending:
+                commands.append(clean_zsh_command("\n".join(pending)))
+                pending = []
+            if line.strip():
+                pending = [line]
+            continue
+
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        if line and not line.startswith('#'):
+            commands.append(line)
+
+    if pending and len(commands) < limit:
+        commands.append(clean_zsh_command("\n".join(pending)))
+
+    commands = [command for command in commands if command]
+    commands.reverse()
+    return commands[-limit:] if limit else []
+
+def unescape_fish_command(entry):
+    """Decodes fish's history escapes ('\\n' newline, '\\\\' backslash) in one pass, so '\\\\n' stays a backslash + 'n'."""
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) == 'n' else m.group(1), entry)
+
+def clean_zsh_command(entry):
+    """Strips the extended-history prefix (': <timestamp>:<duration>;') from a zsh entry."""
+    return re.sub(r'^: \d+:\d+;', '', entry).strip()
+
+def get_terminal_history():
+    """
+    Retrieves the last commands from the shell history file on Linux/macOS. 
+    Returns an empty list on other OSs (like Windows).
+    """
+    if platform.system() != 'Linux': # Check for non-Linux system
+        return []
+
+    shell = os.environ.get("SHELL", "").split('/')[-1]
+    history_file = None
+    if shell == 'bash':
+        history_file = os.path.expanduser("~/.bash_history")
+    elif shell == 'zsh':
+        history_file = os.path.expanduser("~/.zsh_history")
+    elif shell == 'fish':
+        history_file = os.path.expanduser("~/.local/share/fish/fish_history")
+    if history_file and os.path.exists(history_file):
+        try:
+            return read_shell_history_tail(history_file, shell, HISTORY_LIMIT)
+        except Exception:
+            return []
+    return []
+
+# --- TURN METRICS (/stats) ---
+# Every turn (text, voice, batch, daemon sessions) produces one record: scan/upload figures,
+# time to first token, response and history-save times, token usage and the total turn time.
+
+def new_turn_metrics(mode, kind='chat'):
+    """Starts the metrics record of one turn."""
+    return {'ts': round(time.time(), 3), 'mode': mode, 'kind': kind, 'model': MODEL_NAME, '_started_at': time.monotonic()}
+
+def record_usage(metrics, usage):
+    """Copies the token counts of a response's usage_metadata (the last streamed chunk carries the totals)."""
+    if metrics is None or usage is None:
+        return
+    for field, key in (('prompt_token_count', 'input_tokens'), ('candidates_token_count', 'output_tokens'), ('cached_content_token_count', 'cached_tokens')):
+        value = getattr(usage, field, None)
+        if value is not None:
+            metrics[key] = value
+
+def rotate_metrics_file():
+    """Shifts metrics.jsonl -> .1 -> .2 ..., dropping the oldest beyond METRICS_BACKUP_COUNT."""
+    if METRICS_BACKUP_COUNT <= 0:
+        os.remove(METRICS_FILE)
+        return
+    for index in range(METRICS_BACKUP_COUNT - 1, 0, -1):
+        older = f"{METRICS_FILE}.{index}"
+        if os.path.exists(older):
+            os.replace(older, f"{METRICS_FILE}.{index + 1}")
+    os.replace(METRICS_FILE, METRICS_FILE + ".1")
+
+def write_metrics_record(record):
+    """Appends one record to METRICS_FILE, rotating it once it exceeds METRICS_MAX_BYTES."""
+    with METRICS_LOCK:
+        try:
+            os.makedirs(os.path.dirname(METRICS_FILE), exist_ok=True)
+            if os.path.exists(METRICS_FILE) and os.path.getsize(METRICS_FILE) >= METRICS_MAX_BYTES:
+                rotate_metrics_file()
+            with open(METRICS_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except Exception as e:
+            # NOTE: This string is not localized because it's only an error fallback
+            print(f"Error writing metrics: {e}")
+
+def finish_turn_metrics(metrics, ok=True):
+    """Completes a turn's record, keeps it for /stats and appends it to the metrics file."""
+    if metrics is None or '_started_at' not in metrics:
+        return
+    metrics['total_s'] = time.monotonic() - metrics.pop('_started_at')
+    metrics['ok'] = ok
+    for key, value in metrics.items():
+        if isinstance(value, float) and key != 'ts':
+            metrics[key] = round(value, 4)
+    with METRICS_LOCK:
+        SESSION_METRICS.append(metrics)
+        del SESSION_METRICS[:-METRICS_SESSION_LIMIT]
+    if METRICS_ENABLED:
+        write_metrics_record(metrics)
+
+def load_metrics_records():
+    """Reads all records from the metrics file and its rotated backups, oldest first."""
+    paths = [f"{METRICS_FILE}.{index}" for index in range(METRICS_BACKUP_COUNT, 0, -1)] + [METRICS_FILE]
+    records = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+    return records
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(-(-q * len(ordered) // 100)) - 1))
+    return ordered[index]
+
+def format_metric_value(field, value):
+    """Formats one metric for the /stats table."""
+    if field.endswith('_s'):
+        return f"{value:.2f}s"
+    if field.startswith('bytes'):
+        return f"{value / (1024 * 1024):.1f}MB"
+    return str(int(value))
+
+def print_stats(records, scope):
+    """Prints p50/p90/p99/max of every metric over the given turn records."""
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    if not records:
+        print(loc['stats_empty'])
+        return
+    failed = sum(1 for record in records if not record.get('ok', True))
+    print(loc['stats_title'].format(turns=len(records), failed=failed, scope=scope))
+    print(f"  {'':<16}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'n':>7}")
+    for field in STATS_FIELDS:
+        values = [record[field] for record in records if isinstance(record.get(field), (int, float))]
+        if not values:
+            continue
+        row = [format_metric_value(field, percentile(values, q)) for q in (50, 90, 99)] + [format_metric_value(field, max(values))]
+        print(f"  {field:<16}" + "".join(f"{cell:>10}" for cell in row) + f"{len(values):>7}")
+    
+    def total(field):
+        return sum(record.get(field) or 0 for record in records)
+    print(loc['stats_totals'].format(
+        input=total('input_tokens'), cached=total('cached_tokens'), output=total('output_tokens'),
+        files=total('files_uploaded'), size_mb=total('bytes_uploaded') / (1024 * 1024)
+    ))
+
+# --- MODEL RESPONSE OUTPUT ---
+
+def stream_reply(chat, message, config=None, metrics=None):
+    """Yields the non-empty text chunks of a streamed reply (token usage goes into metrics)."""
+    for chunk in chat.send_message_stream(message, config=config):
+        record_usage(metrics, getattr(chunk, 'usage_metadata', None))
+        if chunk.text:
+            yield chunk.text
+
+def send_message_streaming(chat, message, config=None, metrics=None):
+    """
+    Sends a message with the chat's streaming API and prints tokens as they arrive.
+    The chat records the complete turn in its history once the stream is consumed.
+    A config replaces the chat's own config for this turn. Returns the full response text.
+    """
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    started_at = time.monotonic()
+    first_token_at = None
+    chunks = []
+
+    print("✨ Gemini: ", end="", flush=True)
+    for text in stream_reply(chat, message, config, metrics):
+        if first_token_at is None:
+            first_token_at = time.monotonic()
+        print(text, end="", flush=True)
+        chunks.append(text)
+    print()
+
+    finished_at = time.monotonic()
+    ttft = (first_token_at or finished_at) - started_at
+    print(loc['response_timing'].format(ttft=ttft, total=finished_at - started_at))
+    if metrics is not None:
+        metrics['ttft_s'] = ttft
+        metrics['response_s'] = finished_at - started_at
+    return "".join(chunks)
+
+def send_and_print(chat, message, config=None, metrics=None):
+    """Sends a message to Gemini and prints the reply (streamed when STREAM_RESPONSES is on)."""
+    if STREAM_RESPONSES:
+        return send_message_streaming(chat, message, config, metrics)
+
+    started_at = time.monotonic()
+    response = chat.send_message(message, config=config)
+    print(f"✨ Gemini: {response.text}")
+    if metrics is not None:
+        # Without streaming the first token arrives with the whole reply
+        metrics['ttft_s'] = metrics['response_s'] = time.monotonic() - started_at
+        record_usage(metrics, getattr(response, 'usage_metadata', None))
+    return response.text
+
+# --- API GUARD (RATE LIMIT, CONCURRENCY CAP, RETRIES) ---
+# Every remote call of the process (uploads, deletes, chat turns, summaries, caches, batch and
+# session calls) goes through one ApiGuard: a token bucket matched to the quota, a concurrency cap
+# shared by uploads and model calls, and exponential backoff with full jitter for transient errors.
+
+class TokenBucket:
+    """Thread-safe token bucket; callers reserve a token and sleep for the returned wait time."""
+
+    def __init__(self, rate_per_second, capacity):
+        self.rate = rate_per_second
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self):
+        """Takes one token and returns how many seconds the caller must wait before using it."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class ConcurrencySlots:
+    """
+    Concurrency cap shared by threads (blocking acquire, `with slots:`) and coroutines (awaitable
+    acquire, no polling). A released slot is handed straight to the longest waiting caller.
+    """
+
+    def __init__(self, limit):
+        self.free = max(1, limit)
+        self.waiters = deque()  # threading.Event of a thread or asyncio.Future of a coroutine
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.free and not self.waiters:
+                self.free -= 1
+                return
+            event = threading.Event()
+            self.waiters.append(event)
+        event.wait()
+
+    async def acquire_async(self):
+        import asyncio
+        with self.lock:
+            if self.free and not self.waiters:
+                self.free -= 1
+                return
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                waiting = future in self.waiters
+                if waiting:
+                    self.waiters.remove(future)
+            if not waiting and future.done() and not future.cancelled():
+                # The slot arrived just before the cancellation: pass it on
+                self.release()
+            raise
+
+    def _hand_over(self, future):
+        """Runs on the waiter's event loop; a waiter cancelled in the meantime passes the slot on."""
+        if future.done():
+            self.release()
+        else:
+            future.set_result(None)
+
+    def release(self):
+        with self.lock:
+            while self.waiters:
+                waiter = self.waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                try:
+                    waiter.get_loop().call_soon_threadsafe(self._hand_over, waiter)
+                    return
+                except RuntimeError:
+                    continue  # Its event loop is already closed
+            self.free += 1
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+def count_api_event(name, amount=1):
+    """Adds to one of the API_STATS counters."""
+    with API_STATS_LOCK:
+        API_STATS[name] += amount
+
+def get_error_code(error):
+    """HTTP status of an API error (APIError.code), or None."""
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+def is_retryable_error(error):
+    """True for errors worth retrying: throttling, server overload and transport failures."""
+    if get_error_code(error) in RETRYABLE_STATUS_CODES:
+        return True
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    # httpx.TransportError (connect/read timeouts, dropped connections) without importing httpx
+    return any(cls.__name__ == 'TransportError' for cls in type(error).__mro__)
+
+def get_retry_delay(error, attempt):
+    """Backoff before the next attempt: the server's RetryInfo hint if present, else full jitter."""
+    backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+    hint = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?(\d+(?:\.\d+)?)s", str(error))
+    if hint:
+        return min(RETRY_MAX_DELAY, float(hint.group(1))) + backoff / 4
+    return backoff
+
+class ApiGuard:
+    """Rate limit, concurrency cap and retries shared by all API calls of the process."""
+
+    def __init__(self, requests_per_minute=RATE_LIMIT_RPM, burst=RATE_LIMIT_BURST, max_concurrency=API_MAX_CONCURRENCY):
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst) if requests_per_minute else None
+        self.slots = ConcurrencySlots(max_concurrency)
+
+    def _rate_limit_wait(self):
+        """Reserves a token; returns the time to wait (and counts it) before the call may start."""
+        wait = self.bucket.reserve() if self.bucket else 0.0
+        if wait > 0:
+            count_api_event('rate_limit_waits')
+            count_api_event('rate_limit_wait_s', wait)
+        return wait
+
+    def _should_retry(self, error, attempt, streamed):
+        """Counts a failed attempt and decides whether to try again."""
+        if get_error_code(error) == 429:
+            count_api_event('throttled')
+        if streamed or attempt + 1 >= RETRY_MAX_ATTEMPTS or not is_retryable_error(error):
+            count_api_event('failures')
+            return False
+        count_api_event('retries')
+        return True
+
+    def call(self, func, *args, **kwargs):
+        """Runs a blocking API call with rate limiting, the concurrency cap and retries."""
+        attempt = 0
+        while True:
+            time.sleep(self._rate_limit_wait())
+            count_api_event('calls')
+            try:
+                with self.slots:
+                    return func(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(e, attempt, False):
+                    raise
+                time.sleep(get_retry_delay(e, attempt))
+                attempt += 1
+
+    def stream(self, func, *args, **kwargs):
+        """Like call() for a streaming call; retried only while nothing has been yielded yet."""
+        attempt = 0
+        while True:
+            time.sleep(self._rate_limit_wait())
+            count_api_event('calls')
+            streamed = False
+            try:
+                with self.slots:
+                    for chunk in func(*args, **kwargs):
+                        streamed = True
+                        yield chunk
+                return
+            except Exception as e:
+                if not self._should_retry(e, attempt, streamed):
+                    raise
+                time.sleep(get_retry_delay(e, attempt))
+                attempt += 1
+
+    async def call_async(self, func, *args, **kwargs):
+        """Runs an awaitable API call (client.aio) with rate limiting, the concurrency cap and retries."""
+        import asyncio
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._rate_limit_wait())
+            count_api_event('calls')
+            await self.slots.acquire_async()
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                if not self._should_retry(e, attempt, False):
+                    raise
+                retry_delay = get_retry_delay(e, attempt)
+            finally:
+                self.slots.release()
+            await asyncio.sleep(retry_delay)
+            attempt += 1
+
+    async def stream_async(self, func, *args, **kwargs):
+        """
+        Like stream() for client.aio streaming calls (func returns an async iterator when awaited).
+        The slot is held until the stream ends; a consumer that stops early must await aclose()
+        on the returned generator, which also closes the underlying response.
+        """
+        import asyncio
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._rate_limit_wait())
+            count_api_event('calls')
+            streamed = False
+            retry_delay = None
+            response = None
+            await self.slots.acquire_async()
+            try:
+                response = await func(*args, **kwargs)
+                async for chunk in response:
+                    streamed = True
+                    yield chunk
+                return
+            except Exception as e:
+                if not self._should_retry(e, attempt, streamed):
+                    raise
+                retry_delay = get_retry_delay(e, attempt)
+            finally:
+                try:
+                    if response is not None and hasattr(response, 'aclose'):
+                        await response.aclose()
+                finally:
+                    self.slots.release()
+            await asyncio.sleep(retry_delay)
+            attempt += 1
+
+class GuardedService:
+    """Proxy for client.files/models/caches (or their client.aio versions) that routes calls through an ApiGuard."""
+
+    def __init__(self, service, guard, is_async=False):
+        self._service = service
+        self._guard = guard
+        self._is_async = is_async
+
+    def __getattr__(self, name):
+        method = getattr(self._service, name)
+        if not callable(method):
+            return method
+        if self._is_async:
+            async def guarded_async(*args, **kwargs):
+                return await self._guard.call_async(method, *args, **kwargs)
+            return guarded_async
+        def guarded(*args, **kwargs):
+            return self._guard.call(method, *args, **kwargs)
+        return guarded
+
+class GuardedChat:
+    """Proxy for a chat session whose turns go through an ApiGuard."""
+
+    def __init__(self, chat, guard, is_async=False):
+        self._chat = chat
+        self._guard = guard
+        self._is_async = is_async
+
+    def get_history(self, *args, **kwargs):
+        return self._chat.get_history(*args, **kwargs)
+
+    def send_message(self, message, config=None):
+        if self._is_async:
+            return self._guard.call_async(self._chat.send_message, message, config=config)
+        return self._guard.call(self._chat.send_message, message, config=config)
+
+    def send_message_stream(self, message, config=None):
+        if self._is_async:
+            return self._send_message_stream_async(message, config)
+        return self._guard.stream(self._chat.send_message_stream, message, config=config)
+
+    async def _send_message_stream_async(self, message, config):
+        # Mirrors the SDK: `async for chunk in await chat.send_message_stream(...)`
+        return self._guard.stream_async(self._chat.send_message_stream, message, config=config)
+
+class GuardedChats:
+    """Proxy for client.chats / client.aio.chats returning GuardedChat sessions."""
+
+    def __init__(self, chats, guard, is_async=False):
+        self._chats = chats
+        self._guard = guard
+        self._is_async = is_async
+
+    def create(self, *args, **kwargs):
+        return GuardedChat(self._chats.create(*args, **kwargs), self._guard, self._is_async)
+
+class GuardedClient:
+    """
+    A genai.Client (or its client.aio) whose remote calls all share one ApiGuard; this is what
+    get_client returns. Services are wrapped on first access, like the SDK builds them.
+    """
+
+    def __init__(self, client, guard, is_async=False):
+        self.raw_client = client
+        self.guard = guard
+        self._is_async = is_async
+
+    def __getattr__(self, name):
+        service = getattr(self.raw_client, name)
+        if name == 'aio' and not self._is_async:
+            wrapped = GuardedClient(service, self.guard, is_async=True)
+        elif name == 'chats':
+            wrapped = GuardedChats(service, self.guard, self._is_async)
+        elif name in ('files', 'models', 'caches'):
+            wrapped = GuardedService(service, self.guard, self._is_async)
+        else:
+            return service
+        setattr(self, name, wrapped)
+        return wrapped
+
+def format_api_stats():
+    """One-line summary of API_STATS, or None if nothing was retried or throttled."""
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    with API_STATS_LOCK:
+        stats = dict(API_STATS)
+    if not (stats['retries'] or stats['throttled'] or stats['rate_limit_waits'] or stats['failures']):
+        return None
+    return loc['api_stats'].format(
+        calls=stats['calls'], retries=stats['retries'], throttled=stats['throttled'],
+        failures=stats['failures'], waits=stats['rate_limit_waits'], wait_s=stats['rate_limit_wait_s']
+    )
+
+def print_api_stats():
+    """Prints the throttling summary at the end of a session (only if anything happened)."""
+    line = format_api_stats()
+    if line:
+        print(line)
+
+# --- LAZY IMPORTS AND CLIENT WARM-UP ---
+
+def load_genai():
+    """Imports the google.genai stack on first use and publishes it as module globals."""
+    global genai, types, APIError
+    with GENAI_IMPORT_LOCK:
+        if genai is None:
+            from google import genai as genai_module
+            from google.genai import types as types_module
+            from google.genai.errors import APIError as api_error
+            types = types_module
+            APIError = api_error
+            genai = genai_module
+    return genai
+
+def load_speech_recognition():
+    """Imports speech_recognition and creates the Recognizer (voice mode only)."""
+    global sr, r
+    if sr is None:
+        # Requires: pip install SpeechRecognition pyaudio
+        import speech_recognition as sr_module
+        sr = sr_module
+        r = sr.Recognizer()
+    return sr
+
+def _client_warmup_worker(api_key):
+    """Background thread body: imports genai and constructs the client."""
+    try:
+        if USE_FAKE_CLIENT:
+            import fake_genai
+            load_genai()
+            client = fake_genai.FakeClient(api_key=api_key)
+        else:
+            client = load_genai().Client(api_key=api_key)
+        CLIENT_WARMUP['client'] = GuardedClient(client, ApiGuard())
+    except Exception as e:
+        CLIENT_WARMUP['error'] = e
+
+def start_client_warmup(api_key):
+    """Starts importing genai and building the client while the user answers the startup prompts."""
+    if CLIENT_WARMUP['thread'] is not None or not api_key:
+        return
+    thread = threading.Thread(target=_client_warmup_worker, args=(api_key,), daemon=True)
+    CLIENT_WARMUP['thread'] = thread
+    thread.start()
+
+def get_client(api_key):
+    """Returns the warmed-up client, waiting for the background thread (or building it now) if needed."""
+    start_client_warmup(api_key)
+    CLIENT_WARMUP['thread'].join()
+    if CLIENT_WARMUP['error'] is not None:
+        raise CLIENT_WARMUP['error']
+    return CLIENT_WARMUP['client']
+
+# --- FIRST-PROMPT CONTEXT PREFETCH ---
+
+def start_context_prefetch():
+    """Starts gathering system info and terminal history concurrently in the background."""
+    if CONTEXT_PREFETCH['system_info'] is not None:
+        return
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="context-prefetch")
+    CONTEXT_PREFETCH['system_info'] = executor.submit(get_system_info)
+    CONTEXT_PREFETCH['terminal_history'] = executor.submit(get_terminal_history)
+    executor.shutdown(wait=False)
+
+def get_context_data():
+    """Returns the context block for the first prompt, blocking only if the prefetch has not finished yet."""
+    start_context_prefetch()
+    return format_context_data(CONTEXT_PREFETCH['system_info'].result(), CONTEXT_PREFETCH['terminal_history'].result())
+
+async def gather_context_data():
+    """Collects a fresh context block (for each new conversation of a long-running process)."""
+    import asyncio
+    system_info, terminal_history = await asyncio.gather(
+        asyncio.to_thread(get_system_info), asyncio.to_thread(get_terminal_history)
+    )
+    return format_context_data(system_info, terminal_history)
+
+def format_context_data(system_info, terminal_history):
+    """Formats system info and recent shell commands as the first-prompt context block."""
+    return (
+        f"[CONTEXT: SYSTEM]: {system_info}\n"
+        f"[CONTEXT: HISTORY (last {HISTORY_LIMIT} commands)]: {', '.join(terminal_history)}"
+    )
+
+# --- INITIALIZATION ---
+
+def get_api_key():
+    """Returns GEMINI_API_KEY (any placeholder will do for the offline fake client)."""
+    api_key = os.environ.get("GEMINI_API_KEY")
+    if USE_FAKE_CLIENT:
+        api_key = api_key or "offline"
+    return api_key
+
+def initialize_client_and_chat(language=None, history_file=None):
+    """Initializes the Gemini client, selects history, and loads the chat session (prompts are skipped for preset values)."""
+    global CURRENT_HISTORY_FILE, CURRENT_JOURNAL
+    
+    # Build the client in the background while the language/history prompts are showing
+    api_key = get_api_key()
+    start_client_warmup(api_key)
+    
+    # 0. Select Language first
+    select_language(language)
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    
+    # Gather the first-prompt context while the remaining prompts are answered
+    start_context_prefetch()
+
+    if not api_key:
+        print(loc['error_api_key'])
+        sys.exit(1)
+        
+    # 1. Interactive history file selection
+    CURRENT_HISTORY_FILE = select_history_file(history_file)
+
+    try:
+        client = get_client(api_key)
+        
+        # Remove temporary uploads left behind by crashed sessions
+        start_orphan_sweep(client)
+        
+        # 2. Load selected history within the context budget (new turns are appended to it as they happen)
+        history = build_context_window(client, CURRENT_HISTORY_FILE)
+        CURRENT_JOURNAL = ChatJournal(CURRENT_HISTORY_FILE)
+        
+        # 3. Use localized System Instruction
+        chat = create_chat(client, history)
+        return client, chat
+        
+    except Exception as e:
+        print(loc['error_init'] + str(e))
+        sys.exit(1)
+
+# --- SPEECH-TO-TEXT BACKENDS ---
+# Every backend exposes recognize(audio) -> text for a speech_recognition.AudioData
+# and raises sr.UnknownValueError when nothing intelligible was said.
+
+class GoogleSpeechBackend:
+    """Google Web Speech API via speech_recognition (one network round trip per phrase)."""
+    name = 'google'
+
+    def __init__(self, lang_code):
+        self.lang_code = lang_code
+
+    def recognize(self, audio):
+        return r.recognize_google(audio, language=self.lang_code)
+
+class VoskSpeechBackend:
+    """Offline recognition with a local Vosk (Kaldi) model from VOSK_MODEL_DIR/<lang code>."""
+    name = 'vosk'
+    sample_rate = 16000
+
+    def __init__(self, lang_code):
+        import vosk
+        vosk.SetLogLevel(-1)
+        model_path = os.environ.get("VOSK_MODEL_PATH") or os.path.join(VOSK_MODEL_DIR, lang_code)
+        if not os.path.isdir(model_path):
+            raise FileNotFoundError(f"Vosk model not found: {model_path}")
+        self.vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def recognize(self, audio):
+        recognizer = self.vosk.KaldiRecognizer(self.model, self.sample_rate)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=self.sample_rate, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get('text', '').strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+class WhisperSpeechBackend:
+    """Offline recognition with faster-whisper on CPU (int8), model size WHISPER_MODEL_SIZE."""
+    name = 'whisper'
+    sample_rate = 16000
+
+    def __init__(self, lang_code):
+        import numpy
+        from faster_whisper import WhisperModel
+        self.numpy = numpy
+        self.lang_code = lang_code
+        self.model = WhisperModel(WHISPER_MODEL_SIZE, device="cpu", compute_type="int8")
+
+    def recognize(self, audio):
+        raw = audio.get_raw_data(convert_rate=self.sample_rate, convert_width=2)
+        samples = self.numpy.frombuffer(raw, dtype=self.numpy.int16).astype(self.numpy.float32) / 32768.0
+        segments, _ = self.model.transcribe(samples, language=self.lang_code, beam_size=1, vad_filter=True)
+        text = " ".join(segment.text.strip() for segment in segments).strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+SPEECH_BACKENDS = {
+    'google': GoogleSpeechBackend,
+    'vosk': VoskSpeechBackend,
+    'whisper': WhisperSpeechBackend,
+}
+
+def create_speech_backend(name, lang_code):
+    """Builds the selected backend, falling back to Google if an offline engine cannot be loaded."""
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    try:
+        backend = SPEECH_BACKENDS[name](lang_code)
+    except Exception as e:
+        print(loc['stt_load_failed'].format(backend=name, error=e))
+        backend = GoogleSpeechBackend(lang_code)
+    print(loc['stt_selected'].format(backend=backend.name))
+    return backend
+
+# --- VOICE PIPELINE (CAPTURE -> RECOGNITION -> MODEL) ---
+
+def get_audio_duration(audio):
+    """Length of captured speech in seconds."""
+    try:
+        return len(audio.frame_data) / float(audio.sample_rate * audio.sample_width)
+    except Exception:
+        return 0.0
+
+def get_microphone_id(source):
+    """Identifies the input device behind a Microphone source (calibration is stored per device)."""
+    try:
+        if source.device_index is not None:
+            return sr.Microphone.list_microphone_names()[source.device_index]
+        return source.audio.get_default_input_device_info()['name']
+    except Exception:
+        return "default"
+
+def load_mic_calibration(device_id):
+    """Returns the saved {'energy_threshold', 'pause_threshold'} of a device, or None if missing or stale."""
+    try:
+        with open(MIC_CALIBRATION_FILE, "r", encoding="utf-8") as f:
+            entry = json.load(f).get(device_id)
+        if entry and time.time() - entry['saved_at'] < MIC_CALIBRATION_MAX_AGE:
+            return entry
+    except Exception:
+        pass
+    return None
+
+def save_mic_calibration(device_id):
+    """Stores the recognizer's current (possibly adapted) thresholds for a device."""
+    try:
+        data = {}
+        if os.path.exists(MIC_CALIBRATION_FILE):
+            with open(MIC_CALIBRATION_FILE, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        data[device_id] = {
+            'energy_threshold': r.energy_threshold,
+            'pause_threshold': r.pause_threshold,
+            'saved_at': time.time(),
+        }
+        os.makedirs(os.path.dirname(MIC_CALIBRATION_FILE), exist_ok=True)
+        tmp_path = MIC_CALIBRATION_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, MIC_CALIBRATION_FILE)
+    except Exception:
+        pass
+
+def set_pause_threshold(value):
+    """Applies a clamped pause_threshold (non_speaking_duration must never exceed it)."""
+    low, high = VOICE_PAUSE_THRESHOLD_RANGE
+    r.pause_threshold = min(max(value, low), high)
+    r.non_speaking_duration = min(0.5, r.pause_threshold)
+
+def adapt_endpointing(state, audio, returned_at):
+    """
+    Tunes pause_threshold from the phrase just captured:
+    - the user resumed speaking shortly after the cut -> the phrase ended too early, wait longer;
+    - short utterances -> end phrases sooner so short commands finish quickly.
+    """
+    speech = max(get_audio_duration(audio) - 2 * r.non_speaking_duration, 0.0)
+    speech_end = returned_at - r.pause_threshold
+    speech_start = speech_end - speech
+    previous_end = state.get('last_speech_end')
+    state['last_speech_end'] = speech_end
+
+    if previous_end is not None and speech_start - previous_end < r.pause_threshold * 1.5:
+        set_pause_threshold(r.pause_threshold * 1.2)
+    elif speech < VOICE_SHORT_UTTERANCE_SECONDS:
+        set_pause_threshold(r.pause_threshold * 0.95)
+
+def voice_capture_worker(source, audio_queue, stop_event):
+    """
+    Producer thread: keeps listening and queues every captured phrase, so the microphone
+    is never deaf while earlier phrases are being recognized or answered.
+    """
+    seq = 0
+    endpointing_state = {}
+    phrase_time_limit = VOICE_ADAPTIVE_PHRASE_TIME_LIMIT if VOICE_ADAPTIVE_ENDPOINTING else VOICE_PHRASE_TIME_LIMIT
+    while not stop_event.is_set():
+        try:
+            audio = r.listen(source, timeout=VOICE_LISTEN_POLL_TIMEOUT, phrase_time_limit=phrase_time_limit)
+        except sr.WaitTimeoutError:
+            # No speech started; check the stop flag and listen again
+            continue
+        except Exception as e:
+            audio_queue.put({'seq': seq, 'error': e, 'fatal': True})
+            break
+        captured_at = time.monotonic()
+        if VOICE_ADAPTIVE_ENDPOINTING:
+            adapt_endpointing(endpointing_state, audio, captured_at)
+        seq += 1
+        audio_queue.put({'seq': seq, 'audio': audio, 'captured_at': captured_at})
+    audio_queue.put(None)
+
+def voice_recognition_worker(audio_queue, text_queue, backend, stop_event):
+    """
+    Recognition thread: turns queued audio into text in capture order.
+    Recognizing an exit word stops the capture thread right away.
+    """
+    while True:
+        item = audio_queue.get()
+        if item is None or 'error' in item:
+            text_queue.put(item)
+            if item is None:
+                break
+            continue
+
+        print(LOCALIZATION_STRINGS[CURRENT_LANGUAGE]['voice_recognizing'])
+        started_at = time.monotonic()
+        item['wait_s'] = started_at - item['captured_at']
+        try:
+            # Recognize speech with the selected backend (localized language code)
+            item['text'] = backend.recognize(item['audio'])
+        except Exception as e:
+            item['error'] = e
+        item['recognition_s'] = time.monotonic() - started_at
+
+        if item.get('text', '').lower() in ['exit', 'quit']:
+            stop_event.set()
+        text_queue.put(item)
+
+# --- NEW VOICE CHAT MODE ---
+
+def voice_chat_mode(client, chat):
+    """
+    Runs a loop for voice-based user dialogue.
+    Capture, recognition and the Gemini call run as an overlapped pipeline: the next utterance
+    is captured while the previous one is still being processed, and answers keep the spoken order.
+    """
+    global CURRENT_HISTORY_FILE
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    # Use selected language code for better speech recognition accuracy
+    lang_code = loc['code'] 
+
+    print("\n-------------------------------------------------------------")
+    print(loc['chat_mode_title'] + os.path.basename(CURRENT_HISTORY_FILE))
+    print(f"🎙️ {loc['voice_exit']}")
+    print("-------------------------------------------------------------")
+
+    # System info and terminal history are gathered in the background (see get_context_data)
+    start_context_prefetch()
+    first_prompt_sent = False 
+
+    try:
+        # Speech modules are only needed (and imported) in voice mode
+        load_speech_recognition()
+        backend = create_speech_backend(SPEECH_BACKEND or select_speech_backend(), lang_code)
+        
+        # Check if there are microphones available
+        if not sr.Microphone.list_microphone_names():
+            print(loc['voice_error_mic'])
+            return
+
+        with sr.Microphone() as source:
+            device_id = get_microphone_id(source)
+            calibration = load_mic_calibration(device_id)
+            if VOICE_ADAPTIVE_ENDPOINTING:
+                set_pause_threshold(calibration['pause_threshold'] if calibration else VOICE_PAUSE_THRESHOLD_START)
+            try:
+                if calibration:
+                    # Reuse the saved threshold instead of the calibration delay (it keeps adapting while listening)
+                    r.energy_threshold = calibration['energy_threshold']
+                    print(loc['voice_calibration_loaded'].format(threshold=r.energy_threshold))
+                else:
+                    # Adjust ambient noise level only once
+                    r.adjust_for_ambient_noise(source)
+                    print(loc['voice_calibrated'])
+            except Exception as e:
+                # This often fails if pyaudio/portaudio isn't installed correctly
+                print(loc['voice_error_mic'])
+                print(f"Error details: {e}")
+                return # Exit voice mode if mic fails
+
+            stop_event = threading.Event()
+            audio_queue = queue.Queue()
+            text_queue = queue.Queue()
+            capture_thread = threading.Thread(target=voice_capture_worker, args=(source, audio_queue, stop_event), daemon=True)
+            recognition_thread = threading.Thread(target=voice_recognition_worker, args=(audio_queue, text_queue, backend, stop_event), daemon=True)
+            capture_thread.start()
+            recognition_thread.start()
+
+            print(loc['voice_prompt'], end="")
+            print(loc['voice_listening'])
+
+            try:
+                # Model stage runs here, consuming recognized phrases in order
+                while True:
+                    item = text_queue.get()
+                    if item is None:
+                        break
+                    
+                    error = item.get('error')
+                    if item.get('fatal'):
+                        print(loc['voice_error_mic'])
+                        print(f"Error details: {error}")
+                        break
+                    if isinstance(error, sr.UnknownValueError):
+                        print(loc['voice_error_speech'])
+                        continue
+                    if isinstance(error, sr.RequestError):
+                        print(f"❌ Speech Recognition API Error: {error}")
+                        continue
+                    if error is not None:
+                        print(f"🛑 {loc['error_unexpected']}{error}")
+                        continue
+                    
+                    user_input = item['text']
+                    print(f"✅ Recognized: {user_input}")
+
+                    if user_input.lower() in ['exit', 'quit']:
+                        break
+                    
+                    if not user_input.strip():
+                        continue
 
                     # Prepare prompt for Gemini
                     if not first_prompt_sent:
                         # Send context data only with the very first prompt
-                        full_prompt = f"{context_data}\n\n[USER QUESTION]: {user_input}"
+                        full_prompt = f"{get_context_data()}\n\n[USER QUESTION]: {user_input}"
                         first_prompt_sent = True
                     else:
                         full_prompt = user_input 
 
                     print(loc['voice_sending'] + full_prompt)
                     
-                    # Send message to Gemini
-                    response = chat.send_message(full_prompt)
-                    print(f"✨ Gemini: {response.text}")
-
-                except sr.UnknownValueError:
-                    print(loc['voice_error_speech'])
-                except sr.RequestError as e:
-                    print(f"❌ Speech Recognition API Error: {e}")
-                except APIError as e:
-                    print(f"🛑 {loc['error_api']}{e.args[0]}")
-                    break
-                except Exception as e:
-                    print(f"🛑 {loc['error_unexpected']}{e}")
-                    break
+                    metrics = new_turn_metrics('voice')
+                    metrics['speech_s'] = get_audio_duration(item['audio'])
+                    metrics['recognition_s'] = item['recognition_s']
+                    try:
+                        # Send message to Gemini
+                        model_started_at = time.monotonic()
+                        reply = send_and_print(chat, full_prompt, metrics=metrics)
+                        record_chat_turn(full_prompt, reply, metrics)
+                        chat = compact_chat_if_needed(client, chat)
+                        finish_turn_metrics(metrics)
+                    except APIError as e:
+                        # Transient errors were already retried (ApiGuard); keep listening
+                        finish_turn_metrics(metrics, ok=False)
+                        print(f"🛑 {loc['error_api']}{e.args[0]}")
+                        print(loc['error_api_continue'])
+                        print(loc['voice_listening'])
+                        continue
+                    except Exception as e:
+                        finish_turn_metrics(metrics, ok=False)
+                        print(f"🛑 {loc['error_unexpected']}{e}")
+                        break
+                    
+                    print(loc['voice_stage_timing'].format(
+                        speech=get_audio_duration(item['audio']),
+                        wait=item['wait_s'],
+                        recognition=item['recognition_s'],
+                        model=time.monotonic() - model_started_at
+                    ))
+                    print(loc['voice_listening'])
+            except KeyboardInterrupt:
+                pass
+            finally:
+                # Let the capture thread finish its current listen before the microphone is closed
+                stop_event.set()
+                capture_thread.join(timeout=VOICE_ADAPTIVE_PHRASE_TIME_LIMIT + VOICE_LISTEN_POLL_TIMEOUT + 1)
+                save_mic_calibration(device_id)
                     
     except Exception as e:
         # Handle exceptions related to PyAudio/Microphone initialization
@@ -710,11 +4053,91 @@ def voice_chat_mode(client, chat):
 
     print("-" * 35)
     print(loc['saving_history'])
-    save_chat_history(chat, CURRENT_HISTORY_FILE) 
+    close_chat_history() 
     cleanup_uploaded_files(client) 
+    print_api_stats()
 
 # --- MAIN INTERACTIVE MODE (TEXT CHAT) ---
 
+def parse_analyze_options(text):
+    """
+    Parses the --bundle=<bytes>[k|m], --cache/--no-cache, --map-reduce and --shard=<bytes>[k|m]
+    options of /analyze (None if one is unknown).
+    """
+    options = {'bundle_threshold': None, 'cache': CONTEXT_CACHE_DEFAULT, 'map_reduce': False, 'shard_bytes': None}
+    for token in text.split():
+        size = re.fullmatch(r"--(bundle|shard)=(\d+)([km]?)", token, re.IGNORECASE)
+        if size:
+            value = int(size.group(2)) * {'': 1, 'k': 1024, 'm': 1024 * 1024}[size.group(3).lower()]
+            options['bundle_threshold' if size.group(1).lower() == 'bundle' else 'shard_bytes'] = value
+        elif token.lower() in ('--cache', '--no-cache'):
+            options['cache'] = token.lower() == '--cache'
+        elif token.lower() == '--map-reduce':
+            options['map_reduce'] = True
+        else:
+            return None
+    return options
+
+def build_analyze_message(client, command, context=None, base_dir=None, session=None, metrics=None):
+    """
+    Uploads the folder of a parsed /analyze command and returns the message parts for the turn
+    (preceded by the first-prompt context, if given). With --map-reduce the folder (or file) is analyzed
+    in parts first and the message carries the partial answers instead of the files.
+    If nothing could be uploaded, the parts carry an error note so Gemini can explain it politely.
+    """
+    loc = LOCALIZATION_STRINGS[session.language if session else CURRENT_LANGUAGE]
+    relative_folder_path, prompt, options = command
+    
+    folder_path = os.path.abspath(os.path.join(base_dir or os.getcwd(), os.path.expanduser(relative_folder_path)))
+    
+    print(loc['analyze_start'] + folder_path)
+    
+    if session is None:
+        # Follow-ups now refer to the new corpus
+        release_context_cache(client)
+    if options['map_reduce']:
+        # This turn is the final reduce step: the chat merges the findings into the answer
+        findings = map_reduce_folder(client, folder_path, prompt, options['shard_bytes'], session.language if session else None, metrics)
+        # A Part, like the inline bundles: the findings are corpus, not a journaled turn
+        uploaded_files = [types.Part.from_text(text=findings)] if findings else []
+    else:
+        uploaded_files = upload_folder_contents(client, folder_path, options['bundle_threshold'], session, metrics)
+    
+    content_parts = []
+    if context:
+        content_parts.append(context)
+
+    # Process upload result
+    if not uploaded_files:
+        check_result = loc['analyze_error_folder_check_exists'] if os.path.isdir(folder_path) else loc['analyze_error_folder_check_not_found']
+        error_msg = loc['analyze_failed_no_files'].format(path=relative_folder_path, check=check_result)
+        print(error_msg)
+        
+        # Inform Gemini about the internal error so it can generate a polite response
+        content_parts.append(f"[INTERNAL_ERROR_FILE_UPLOAD]: {error_msg}. Please inform the user that no files could be found/uploaded and ask them to verify the path or file types.")
+    
+    else:
+        # With a server-side cache the files are not part of the message (or the history) at all
+        if session is not None or options['map_reduce'] or not (options['cache'] and create_context_cache(client, uploaded_files, folder_path)):
+            content_parts.extend(uploaded_files)
+        content_parts.append(prompt)
+    return content_parts
+
+def is_analyze_command(text):
+    """True if the text is an /analyze (or /analyse) command."""
+    return text.strip().lower().startswith(("/analyze ", "/analyse "))
+
+def parse_analyze_command(text):
+    """Splits /analyze <folder> "prompt" [--options] into (folder, prompt, options), or None if malformed."""
+    # Regex to extract path, quoted prompt and trailing --options, supporting anal[yi]ze
+    match = re.match(r"/\s*anal[yi]ze\s+(\S+)\s+\"(.+)\"((?:\s+--\S+)*)\s*$", text.strip(), re.IGNORECASE)
+    if not match:
+        return None
+    options = parse_analyze_options(match.group(3))
+    if options is None:
+        return None
+    return match.group(1).strip(), match.group(2).strip(), options
+
 def interactive_chat_mode(client, chat):
     """Runs an infinite loop for user dialogue, handling the /analyze command."""
     global CURRENT_HISTORY_FILE
@@ -728,18 +4151,15 @@ def interactive_chat_mode(client, chat):
     print("   " + loc['command_1'])
     print("   " + loc['command_2'])
     print("   " + loc['command_3'])
+    print("   " + loc['command_4'])
+    print("   " + loc['command_5'])
     print("-------------------------------------------------------------")
 
-    terminal_history = get_terminal_history()
-    system_info = get_system_info()
-    
-    # Context data for the very first prompt
-    context_data = (
-        f"[CONTEXT: SYSTEM]: {system_info}\n"
-        f"[CONTEXT: HISTORY (last {HISTORY_LIMIT} commands)]: {', '.join(terminal_history)}"
-    )
+    # Context data for the very first prompt is gathered in the background (see get_context_data)
+    start_context_prefetch()
 
     while True:
+        metrics = None
         try:
             user_input = input(">> You: ")
             
@@ -749,64 +4169,67 @@ def interactive_chat_mode(client, chat):
             if not user_input.strip():
                 continue
 
+            # --- FULL-TEXT SEARCH OVER PAST CONVERSATIONS ---
+            if user_input.strip().lower().split()[0] == '/search':
+                print_search_results(user_input.strip()[len('/search'):].strip())
+                continue
+
+            # --- RESPONSE TIME AND TOKEN STATISTICS ---
+            if user_input.strip().lower() in ('/stats', '/stats all'):
+                if user_input.strip().lower().endswith('all'):
+                    print_stats(load_metrics_records(), loc['stats_scope_all'])
+                else:
+                    print_stats(SESSION_METRICS, loc['stats_scope_session'])
+                    print_api_stats()
+                continue
+
             # --- CHECK FOR FOLDER ANALYSIS COMMAND ---
-            if user_input.strip().lower().startswith("/analyze ") or user_input.strip().lower().startswith("/analyse "):
+            if is_analyze_command(user_input):
                 
-                # Regex to extract path and quoted prompt, supporting anal[yi]ze
-                match = re.match(r"/\s*anal[yi]ze\s+(\S+)\s+\"(.+)\"", user_input, re.IGNORECASE)
+                command = parse_analyze_command(user_input)
                 
-                if not match:
+                if command is None:
                     print(loc['analyze_usage_error'])
                     print(loc['analyze_usage_note'])
                     continue
                     
-                relative_folder_path = match.group(1).strip()
-                prompt = match.group(2).strip()
-                
-                folder_path = os.path.abspath(relative_folder_path)
-                
-                print(loc['analyze_start'] + folder_path)
-                
-                uploaded_files = upload_folder_contents(client, folder_path)
-                
-                content_parts = []
-                if len(chat.get_history()) == 0:
-                    content_parts.append(context_data)
-
-                # Process upload result
-                if not uploaded_files:
-                    check_result = loc['analyze_error_folder_check_exists'] if os.path.isdir(folder_path) else loc['analyze_error_folder_check_not_found']
-                    error_msg = loc['analyze_failed_no_files'].format(path=relative_folder_path, check=check_result)
-                    print(error_msg)
-                    
-                    # Inform Gemini about the internal error so it can generate a polite response
-                    content_parts.append(f"[INTERNAL_ERROR_FILE_UPLOAD]: {error_msg}. Please inform the user that no files could be found/uploaded and ask them to verify the path or file types.")
-                
-                else:
-                    content_parts.extend(uploaded_files)
-                    content_parts.append(prompt)
+                metrics = new_turn_metrics('text', 'analyze')
+                context = get_context_data() if len(chat.get_history()) == 0 else None
+                content_parts = build_analyze_message(client, command, context, metrics=metrics)
 
                 try:
-                    response = chat.send_message(content_parts)
-                    print(f"✨ Gemini: {response.text}")
+                    reply = send_with_context_cache(client, chat, content_parts, metrics)
+                    record_chat_turn(content_parts, reply, metrics)
+                    chat = compact_chat_if_needed(client, chat)
+                    finish_turn_metrics(metrics)
                 except APIError as e:
+                    finish_turn_metrics(metrics, ok=False)
+                    forget_failed_uploads(e, content_parts, chat)
                     print(f"🛑 {loc['error_api']}{e.args[0]}")
+                    print(loc['error_api_continue'])
                 except Exception as e:
+                    finish_turn_metrics(metrics, ok=False)
                     print(f"🛑 {loc['error_unexpected']}{e}")
                 
             # --- REGULAR CHAT MESSAGE ---
             else:
                 if len(chat.get_history()) == 0:
-                    full_prompt = f"{context_data}\n\n[USER QUESTION]: {user_input}"
+                    full_prompt = f"{get_context_data()}\n\n[USER QUESTION]: {user_input}"
                 else:
                     full_prompt = user_input 
 
-                response = chat.send_message(full_prompt)
-                print(f"✨ Gemini: {response.text}")
+                metrics = new_turn_metrics('text')
+                reply = send_with_context_cache(client, chat, full_prompt, metrics)
+                record_chat_turn(full_prompt, reply, metrics)
+                chat = compact_chat_if_needed(client, chat)
+                finish_turn_metrics(metrics)
 
         except APIError as e:
+            # Transient errors were already retried (ApiGuard); the session stays usable
+            finish_turn_metrics(metrics, ok=False)
+            forget_failed_uploads(e, chat=chat)
             print(f"🛑 {loc['error_api']}{e.args[0]}")
-            break
+            print(loc['error_api_continue'])
         except KeyboardInterrupt:
             break
         except Exception as e:
@@ -815,17 +4238,535 @@ def interactive_chat_mode(client, chat):
 
     print("-" * 35)
     print(loc['saving_history'])
-    save_chat_history(chat, CURRENT_HISTORY_FILE) 
+    close_chat_history() 
+    release_context_cache(client)
     cleanup_uploaded_files(client) 
+    print_api_stats()
+
+# --- BATCH MODE (--batch) ---
+# Every line of the job file is an independent one-shot request (no shared chat history):
+# a prompt, an /analyze command, or a JSON object {"id": ..., "prompt": ...} holding either.
+# Results are written as JSON lines in completion order; progress goes to stderr.
+
+def read_batch_jobs(path):
+    """Reads batch jobs from a file ('-' for stdin); blank lines and '#' comments are skipped."""
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    handle = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8')
+    jobs = []
+    try:
+        for line_number, line in enumerate(handle, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            job = {'id': line_number, 'prompt': line}
+            if line.startswith('{'):
+                try:
+                    data = json.loads(line)
+                    job = {'id': data.get('id', line_number), 'prompt': str(data['prompt'])}
+                except (ValueError, KeyError, AttributeError) as e:
+                    job['error'] = loc['batch_invalid_job'].format(error=e)
+            jobs.append(job)
+    finally:
+        if handle is not sys.stdin:
+            handle.close()
+    return jobs
+
+async def get_batch_corpus(client, folder_path, bundle_threshold, corpora, upload_lock, metrics=None):
+    """
+    Uploads a folder for /analyze jobs once per (folder, bundle threshold) and shares the parts.
+    Folders are prepared one at a time (each upload is parallel already) so the upload cache
+    manifest is never written concurrently. The upload is counted in the metrics of the job that ran it.
+    """
+    import asyncio
+    key = (folder_path, bundle_threshold)
+    async with upload_lock:
+        if key not in corpora:
+            corpora[key] = await asyncio.to_thread(upload_folder_contents, client, folder_path, bundle_threshold, None, metrics)
+    return corpora[key]
+
+async def run_batch_job(client, job, config, semaphore, corpora, upload_lock):
+    """Runs one batch job and returns its result record (errors are recorded, not raised)."""
+    import asyncio
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    started_at = time.monotonic()
+    result = {'id': job['id'], 'prompt': job['prompt']}
+    metrics = new_turn_metrics('batch', 'analyze' if is_analyze_command(job['prompt']) else 'chat')
+    contents = [job['prompt']]
+    try:
+        if 'error' in job:
+            raise ValueError(job['error'])
+        
+        if is_analyze_command(job['prompt']):
+            command = parse_analyze_command(job['prompt'])
+            if command is None:
+                raise ValueError(loc['analyze_usage_error'])
+            relative_folder_path, prompt, options = command
+            folder_path = os.path.abspath(relative_folder_path)
+            if options['map_reduce']:
+                loop = asyncio.get_running_loop()
+                
+                async def generate_in_slot(**kwargs):
+                    async with semaphore:
+                        return await client.aio.models.generate_content(**kwargs)
+                
+                def generate(**kwargs):
+                    # Map/merge calls take the same --parallel slots as every other model call of the run
+                    return asyncio.run_coroutine_threadsafe(generate_in_slot(**kwargs), loop).result()
+                
+                findings = await asyncio.to_thread(map_reduce_folder, client, folder_path, prompt, options['shard_bytes'], None, metrics, generate)
+                corpus = [findings] if findings else []
+            else:
+                corpus = await get_batch_corpus(client, folder_path, options['bundle_threshold'], corpora, upload_lock, metrics)
+            if not corpus:
+                check_result = loc['analyze_error_folder_check_exists'] if os.path.isdir(folder_path) else loc['analyze_error_folder_check_not_found']
+                raise ValueError(loc['analyze_failed_no_files'].format(path=relative_folder_path, check=check_result))
+            contents = list(corpus) + [prompt]
+            result['folder'] = folder_path
+            result['files'] = len(corpus)
+        
+        async with semaphore:
+            model_started_at = time.monotonic()
+            response = await client.aio.models.generate_content(model=MODEL_NAME, contents=contents, config=config)
+            metrics['ttft_s'] = metrics['response_s'] = time.monotonic() - model_started_at
+        record_usage(metrics, getattr(response, 'usage_metadata', None))
+        result['ok'] = True
+        result['reply'] = response.text
+    except Exception as e:
+        result['ok'] = False
+        result['error'] = str(e)
+        forget_failed_uploads(e, contents)
+    result['elapsed'] = round(time.monotonic() - started_at, 3)
+    finish_turn_metrics(metrics, result['ok'])
+    return result
+
+async def run_batch(client, jobs, output, parallel):
+    """Runs all jobs on the async client with at most `parallel` model calls in flight. Returns the failure count."""
+    import asyncio
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    config = types.GenerateContentConfig(system_instruction=loc['system_instruction'])
+    semaphore = asyncio.Semaphore(max(1, parallel))
+    upload_lock = asyncio.Lock()
+    corpora = {}
+    
+    tasks = [asyncio.create_task(run_batch_job(client, job, config, semaphore, corpora, upload_lock)) for job in jobs]
+    failed = 0
+    for done, task in enumerate(asyncio.as_completed(tasks), 1):
+        result = await task
+        if not result['ok']:
+            failed += 1
+        output.write(json.dumps(result, ensure_ascii=False) + "\n")
+        output.flush()
+        print(loc['batch_progress'].format(done=done, total=len(jobs), failed=failed))
+    return failed
+
+def batch_mode(jobs_path, output_path='-', parallel=BATCH_PARALLELISM, language=None):
+    """Runs a batch job file non-interactively and returns the process exit code (1 if any job failed)."""
+    import asyncio
+    select_language(language or 'en')
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    
+    api_key = get_api_key()
+    if not api_key:
+        print(loc['error_api_key'], file=sys.stderr)
+        return 1
+    
+    jobs = read_batch_jobs(jobs_path)
+    if not jobs:
+        print(loc['batch_no_jobs'].format(path=jobs_path), file=sys.stderr)
+        return 0
+    
+    output = sys.stdout if output_path == '-' else open(output_path, 'w', encoding='utf-8')
+    started_at = time.monotonic()
+    try:
+        # Everything printed along the way (scan/upload reports, progress) goes to stderr,
+        # so the JSONL results can be piped from stdout
+        with redirect_stdout(sys.stderr):
+            try:
+                client = get_client(api_key)
+            except Exception as e:
+                print(loc['error_init'] + str(e))
+                return 1
+            start_orphan_sweep(client)
+            print(loc['batch_start'].format(jobs=len(jobs), parallel=max(1, parallel), model=MODEL_NAME))
+            failed = asyncio.run(run_batch(client, jobs, output, parallel))
+            print(loc['batch_summary'].format(ok=len(jobs) - failed, failed=failed, elapsed=time.monotonic() - started_at))
+            print_api_stats()
+            cleanup_uploaded_files(client)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 1 if failed else 0
+
+# --- SESSION MANAGER (MANY CONVERSATIONS IN ONE PROCESS) ---
+# A ChatSession owns what the single-user modes keep in module globals (language, history journal,
+# chat, temporary uploads), so one process can serve many users at once, e.g. a team chat bridge:
+#
+#     manager = SessionManager(client)
+#     reply = await manager.ask("alice", "Why does the build fail?", language='en')
+#     ...
+#     await manager.close_all()
+
+def get_session_tag(session_id):
+    """Short file-name-safe tag for a session id."""
+    return hashlib.sha1(str(session_id).encode('utf-8')).hexdigest()[:12]
+
+class ChatSession:
+    """State of one conversation served by SessionManager."""
+
+    def __init__(self, session_id, history_file, language):
+        import asyncio
+        self.session_id = session_id
+        self.history_file = history_file
+        self.language = language
+        self.journal = None
+        self.chat = None  # client.aio chat, created by the first turn
+        self.temp_files = []  # Temporary uploads, deleted when the session closes
+        self.ledger_file = get_session_ledger_file(session_id)
+        self.last_used = time.time()
+        self.lock = asyncio.Lock()  # Turns of one session run in order
+
+class SessionManager:
+    """
+    Drives many ChatSessions concurrently on client.aio. Blocking work (history loading,
+    folder uploads, cleanup) runs in worker threads, and at most max_concurrent model calls
+    are in flight across all sessions.
+    """
+
+    def __init__(self, client, max_concurrent=SESSION_CONCURRENCY, idle_timeout=SESSION_IDLE_TIMEOUT,
+                 default_language=None, local_context=False, analyze_root=None):
+        import asyncio
+        self.client = client
+        self.idle_timeout = idle_timeout
+        self.default_language = default_language or CURRENT_LANGUAGE
+        # System info and terminal history of this machine are only sent with first prompts
+        # when every session belongs to the local user (the daemon), never to a shared bridge
+        self.local_context = local_context
+        # Likewise, /analyze of a shared bridge may only read folders inside analyze_root (None: disabled)
+        self.analyze_root = os.path.realpath(os.path.expanduser(analyze_root)) if analyze_root else None
+        self.sessions = {}
+        self._model_slots = asyncio.Semaphore(max(1, max_concurrent))
+        self._upload_lock = asyncio.Lock()  # Folders are uploaded one at a time (shared upload cache manifest)
+
+    def get_session(self, session_id, history_file=None, language=None):
+        """Returns the session with this id, creating it if needed (loaded by its first turn)."""
+        session = self.sessions.get(session_id)
+        if session is None:
+            if history_file is None:
+                os.makedirs(SESSION_HISTORY_DIR, exist_ok=True)
+                history_file = os.path.join(SESSION_HISTORY_DIR, f"{get_session_tag(session_id)}.chat_history.txt")
+            if language not in LOCALIZATION_STRINGS:
+                language = self.default_language
+            session = ChatSession(session_id, history_file, language)
+            self.sessions[session_id] = session
+        return session
+
+    async def _load_chat(self, session, corpus=None):
+        """(Re)creates the session's chat from its history within the context budget (keeping the given /analyze corpus)."""
+        import asyncio
+        history = await asyncio.to_thread(build_context_window, self.client, session.history_file, None, corpus, session.language)
+        session.chat = self.client.aio.chats.create(
+            model=MODEL_NAME,
+            history=history,
+            config=get_chat_config(session.language)
+        )
+
+    def _confine_analyze_path(self, command, base_dir, loc):
+        """
+        Resolves an /analyze path of a shared session inside analyze_root (realpath, so neither '..'
+        nor a symlink can leave it). Returns the command and base_dir to analyze, relative to the root.
+        """
+        if self.analyze_root is None:
+            raise ValueError(loc['session_analyze_disabled'])
+        relative_folder_path, prompt, options = command
+        start_dir = os.path.join(self.analyze_root, base_dir) if base_dir else self.analyze_root
+        folder_path = os.path.realpath(os.path.join(start_dir, relative_folder_path))
+        if os.path.commonpath([self.analyze_root, folder_path]) != self.analyze_root:
+            raise ValueError(loc['session_analyze_outside_root'])
+        return (os.path.relpath(folder_path, self.analyze_root), prompt, options), self.analyze_root
+
+    async def _build_message(self, session, prompt, base_dir, metrics=None):
+        """Turns a question or an /analyze command into the message for the model."""
+        import asyncio
+        loc = LOCALIZATION_STRINGS[session.language]
+        context = None
+        if self.local_context and len(session.chat.get_history()) == 0:
+            # Gathered per conversation: a daemon runs for days, while the terminal history keeps changing
+            context = await gather_context_data()
+        
+        if is_analyze_command(prompt):
+            command = parse_analyze_command(prompt)
+            if command is None:
+                raise ValueError(loc['analyze_usage_error'])
+            if not self.local_context:
+                command, base_dir = self._confine_analyze_path(command, base_dir, loc)
+            if command[2]['map_reduce']:
+                # Sent inline without uploads, so its many model calls do not hold up other sessions' /analyze
+                return await asyncio.to_thread(build_analyze_message, self.client, command, context, base_dir, session, metrics)
+            async with self._upload_lock:
+                return await asyncio.to_thread(build_analyze_message, self.client, command, context, base_dir, session, metrics)
+        if context:
+            return f"{context}\n\n[USER QUESTION]: {prompt}"
+        return prompt
+
+    async def ask(self, session_id, prompt, history_file=None, language=None, base_dir=None, on_text=None):
+        """
+        Runs one turn (a question or an /analyze command) and returns the reply text.
+        on_text, if given, is awaited with every text chunk as it streams in.
+        """
+        session = self.get_session(session_id, history_file, language)
+        prompt = prompt.strip()
+        if not prompt:
+            raise ValueError(LOCALIZATION_STRINGS[session.language]['session_empty_prompt'])
+        
+        async with session.lock:
+            metrics = new_turn_metrics('session', 'analyze' if is_analyze_command(prompt) else 'chat')
+            try:
+                reply = await self._run_turn(session, prompt, base_dir, on_text, metrics)
+            except BaseException:
+                finish_turn_metrics(metrics, ok=False)
+                raise
+            finish_turn_metrics(metrics)
+            session.last_used = time.time()
+            return reply
+
+    async def _run_turn(self, session, prompt, base_dir, on_text, metrics):
+        """Sends one message of a session (its lock held), streams the reply and journals the turn."""
+        if session.chat is None:
+            session.journal = ChatJournal(session.history_file)
+            await self._load_chat(session)
+        message = await self._build_message(session, prompt, base_dir, metrics)
+        
+        chunks = []
+        async with self._model_slots:
+            started_at = time.monotonic()
+            stream = await session.chat.send_message_stream(message)
+            try:
+                async for chunk in stream:
+                    record_usage(metrics, getattr(chunk, 'usage_metadata', None))
+                    if not chunk.text:
+                        continue
+                    if not chunks:
+                        metrics['ttft_s'] = time.monotonic() - started_at
+                    chunks.append(chunk.text)
+                    if on_text is not None:
+                        await on_text(chunk.text)
+            except Exception as e:
+                forget_failed_uploads(e, message, session.chat, session.language)
+                raise
+            finally:
+                # Frees the API slot right away if the reader went away (e.g. a daemon client disconnected)
+                await stream.aclose()
+            metrics['response_s'] = time.monotonic() - started_at
+        reply = "".join(chunks)
+        
+        saving_started_at = time.monotonic()
+        try:
+            session.journal.append('user', message_to_text(message))
+            session.journal.append('model', reply)
+        except Exception as e:
+            # NOTE: This string is not localized because it's only an error fallback
+            print(f"Error saving history: {e}")
+        metrics['history_save_s'] = time.monotonic() - saving_started_at
+        if needs_compaction(session.chat, session.history_file):
+            session.journal.sync()
+            await self._load_chat(session, get_latest_corpus(session.chat))
+        return reply
+
+    async def close_session(self, session_id):
+        """Saves the session's history and deletes its temporary uploads."""
+        import asyncio
+        session = self.sessions.pop(session_id, None)
+        if session is None:
+            return
+        async with session.lock:
+            if session.journal is not None:
+                session.journal.close()
+            await asyncio.to_thread(cleanup_uploaded_files, self.client, session)
+
+    async def close_idle_sessions(self):
+        """Closes sessions that were not used for idle_timeout seconds."""
+        now = time.time()
+        for session_id, session in list(self.sessions.items()):
+            if not session.lock.locked() and now - session.last_used > self.idle_timeout:
+                await self.close_session(session_id)
+
+    async def close_all(self):
+        """Closes every session (end of the process)."""
+        import asyncio
+        await asyncio.gather(*(self.close_session(session_id) for session_id in list(self.sessions)))
+
+# --- LOCAL DAEMON (--serve) ---
+# Keeps the client and the chat sessions (keyed by history file) warm between one-off questions.
+# Protocol: one JSON request line {"prompt", "history", "language", "cwd"} per connection,
+# answered with JSON lines {"text": chunk}..., then {"done": true, "ttft", "total"} or {"error"}.
+# Questions about different histories are answered concurrently (SessionManager).
+
+def get_daemon_history_file(request):
+    """History file of a daemon request (relative names are resolved against the caller's directory)."""
+    name = request.get('history')
+    if not name:
+        return DAEMON_DEFAULT_HISTORY
+    return resolve_history_file(os.path.join(request.get('cwd') or os.getcwd(), os.path.expanduser(name)))
+
+async def handle_daemon_connection(manager, reader, writer):
+    """Answers one ai_ask.py request, streaming the reply back."""
+    async def send(message):
+        writer.write((json.dumps(message, ensure_ascii=False) + "\n").encode('utf-8'))
+        await writer.drain()
+    
+    started_at = time.monotonic()
+    first_token_at = None
+    
+    async def send_text(text):
+        nonlocal first_token_at
+        if first_token_at is None:
+            first_token_at = time.monotonic()
+        await send({'text': text})
+    
+    try:
+        line = await reader.readline()
+        if not line:
+            return  # Liveness probe of another daemon (see run_daemon)
+        try:
+            request = json.loads(line.decode('utf-8'))
+            history_file = get_daemon_history_file(request)
+            await manager.ask(
+                history_file, request.get('prompt', ''),
+                history_file=history_file,
+                language=request.get('language'),
+                base_dir=request.get('cwd'),
+                on_text=send_text
+            )
+        except Exception as e:
+            await send({'error': str(e)})
+            return
+        finished_at = time.monotonic()
+        await send({'done': True, 'ttft': round((first_token_at or finished_at) - started_at, 3), 'total': round(finished_at - started_at, 3)})
+    except OSError:
+        pass  # The client went away; an interrupted turn is not recorded
+    finally:
+        writer.close()
+
+async def serve_daemon(client, socket_path, language):
+    """Runs the daemon's event loop until SIGINT/SIGTERM, then closes every session."""
+    import asyncio
+    import signal
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    manager = SessionManager(client, idle_timeout=DAEMON_SESSION_IDLE, default_language=language, local_context=True)
+    
+    server = await asyncio.start_unix_server(
+        lambda reader, writer: handle_daemon_connection(manager, reader, writer),
+        path=socket_path
+    )
+    os.chmod(socket_path, 0o600)  # Only this user may talk to the daemon
+    
+    # Stop cleanly on kill/systemctl stop as well as on Ctrl+C
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    
+    print(loc['daemon_listening'].format(path=socket_path, model=MODEL_NAME))
+    try:
+        async with server:
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(stop.wait(), timeout=60)
+                except asyncio.TimeoutError:
+                    await manager.close_idle_sessions()
+    finally:
+        print(loc['daemon_stopping'])
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        await manager.close_all()
+
+def run_daemon(socket_path=None, language=None):
+    """Serves questions from ai_ask.py over a Unix domain socket until stopped. Returns the exit code."""
+    import asyncio
+    import socket
+    
+    # Absolute, so a bare name like 'd.sock' still has a directory to create
+    socket_path = os.path.abspath(os.path.expanduser(socket_path or DAEMON_SOCKET))
+    select_language(language or 'en')
+    loc = LOCALIZATION_STRINGS[CURRENT_LANGUAGE]
+    
+    if not hasattr(socket, 'AF_UNIX'):
+        print(loc['daemon_unsupported'])
+        return 1
+    api_key = get_api_key()
+    if not api_key:
+        print(loc['error_api_key'])
+        return 1
+    
+    # A socket file that nobody answers on is left over from a daemon that was killed
+    if os.path.exists(socket_path):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socket_path)
+            print(loc['daemon_already_running'].format(path=socket_path))
+            return 1
+        except OSError:
+            os.remove(socket_path)
+        finally:
+            probe.close()
+    
+    try:
+        client = get_client(api_key)
+    except Exception as e:
+        print(loc['error_init'] + str(e))
+        return 1
+    start_orphan_sweep(client)
+    
+    os.makedirs(os.path.dirname(socket_path), mode=0o700, exist_ok=True)
+    asyncio.run(serve_daemon(client, socket_path, CURRENT_LANGUAGE))
+    cleanup_uploaded_files(client)
+    print_api_stats()
+    return 0
+
+# --- COMMAND-LINE INTERFACE ---
+
+def parse_arguments(argv=None):
+    """Parses the command line; every option left out is asked for interactively as before."""
+    parser = argparse.ArgumentParser(
+        description="Gemini CLI assistant: text and voice chat, folder analysis (/analyze) and batch jobs."
+    )
+    parser.add_argument('-l', '--language', choices=sorted(LOCALIZATION_STRINGS), help="interface and answer language")
+    parser.add_argument('--history', metavar='FILE', help="history file to load or create (the .chat_history.txt suffix is added if missing)")
+    parser.add_argument('-m', '--mode', choices=['text', 'voice'], help="interaction mode")
+    parser.add_argument('--speech', choices=sorted(SPEECH_BACKENDS), help="speech-to-text engine for voice mode")
+    parser.add_argument('--model', default=MODEL_NAME, help=f"Gemini model (default: {MODEL_NAME})")
+    parser.add_argument('--batch', metavar='FILE', help="run the prompts and /analyze commands in FILE ('-' for stdin), one per line, and exit")
+    parser.add_argument('-o', '--output', metavar='FILE', default='-', help="batch results as JSON lines (default: stdout)")
+    parser.add_argument('-j', '--parallel', type=int, default=BATCH_PARALLELISM, help=f"batch model calls in flight at once (default: {BATCH_PARALLELISM})")
+    parser.add_argument('--serve', action='store_true', help="run as a background daemon answering ai_ask.py (keeps the client and chats warm)")
+    parser.add_argument('--socket', metavar='PATH', default=DAEMON_SOCKET, help=f"daemon socket (default: {DAEMON_SOCKET})")
+    parser.add_argument('--compress-histories', metavar='DIR', help="convert every history in DIR into a compressed container and exit")
+    parser.add_argument('--expand-histories', metavar='DIR', help="convert compressed histories in DIR back to plain JSON lines and exit")
+    return parser.parse_args(argv)
 
 # --- MAIN EXECUTION BLOCK ---
 
 if __name__ == "__main__":
+    args = parse_arguments()
+    MODEL_NAME = args.model
+    SPEECH_BACKEND = args.speech or SPEECH_BACKEND
+    
+    if args.batch:
+        start_client_warmup(get_api_key())
+        sys.exit(batch_mode(args.batch, args.output, args.parallel, args.language))
+    
+    if args.compress_histories or args.expand_histories:
+        sys.exit(convert_histories(args.compress_histories or args.expand_histories, bool(args.compress_histories), args.language))
+    
+    if args.serve:
+        start_client_warmup(get_api_key())
+        sys.exit(run_daemon(args.socket, args.language))
+    
     # 1. Initialize client and select history/language
-    client, chat = initialize_client_and_chat()
+    client, chat = initialize_client_and_chat(args.language, args.history)
     
     # 2. Select mode
-    selected_mode = select_mode()
+    selected_mode = select_mode(args.mode)
     
     # 3. Start selected mode
     if selected_mode == 'text':
@@ -0,0 +1,315 @@
+"""
+Offline benchmark suite for the hot paths of ai_assistant.py (no API key or network needed).
+
+Runs against fake_genai.FakeClient behind the real ApiGuard, with configurable latency and
+failure injection, in a throw-away HOME so real histories and caches are never touched:
+  - history:           write_history_journal, ChatJournal.append, load_chat_history and
+                       build_context_window on a synthetic history of --history-turns turns,
+                       as JSON lines and as a compressed container
+  - upload:            upload_folder_contents on a generated tree (cold: empty upload cache,
+                       warm: every file reused from the cache)
+  - terminal_history:  get_terminal_history on bash/zsh/fish histories of --shell-history-mb
+  - turns:             end-to-end chat and /analyze turns (message, streamed reply, journal)
+
+Usage: python benchmarks/bench_offline.py [--runs N] [--latency S] [--failure-rate P] [--output FILE]
+                                          [--baseline FILE [--tolerance 0.25]]
+Prints one JSON object with min/median/max per metric (also written to --output). With --baseline,
+medians more than --tolerance slower than in an earlier result file are listed under 'regressions'
+and the exit code is 1. The google-genai package must be installed (only the client is faked).
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+from contextlib import redirect_stdout
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# Imported in main() once HOME points at the scratch directory (ai_assistant derives its cache paths from it)
+ai_assistant = None
+fake_genai = None
+
+SHELL_HISTORY_FILES = {
+    'bash': ".bash_history",
+    'zsh': ".zsh_history",
+    'fish': os.path.join(".local", "share", "fish", "fish_history"),
+}
+
+def timed(function, *args, **kwargs):
+    """Runs function with its console output suppressed; returns (seconds, result)."""
+    with redirect_stdout(io.StringIO()):
+        started = time.perf_counter()
+        result = function(*args, **kwargs)
+        return time.perf_counter() - started, result
+
+def summarize(samples):
+    """min/median/max of a list of seconds."""
+    return {
+        'min': round(min(samples), 6),
+        'median': round(statistics.median(samples), 6),
+        'max': round(max(samples), 6),
+    }
+
+def make_client(latency, failure_rate, seed):
+    """A fake client wrapped exactly like the real one (rate limit, concurrency cap, retries)."""
+    client = fake_genai.FakeClient(latency=latency, failure_rate=failure_rate, seed=seed)
+    return ai_assistant.GuardedClient(client, ai_assistant.ApiGuard())
+
+def synthetic_records(turns, text_chars, rng):
+    """History records alternating user and model messages of about text_chars characters."""
+    words = ["build", "error", "deploy", "config", "python", "docker", "branch", "commit", "cache", "network"]
+    records = []
+    for i in range(turns):
+        for role in ('user', 'model'):
+            text = " ".join(rng.choice(words) for _ in range(text_chars // 7))
+            records.append({'role': role, 'text': f"[{i}] {text}", 'ts': 1700000000 + i})
+    return records
+
+def bench_history(work_dir, client, turns, text_chars, runs, rng):
+    """Full journal writes, per-turn appends, loading and context-window building."""
+    history_file = os.path.join(work_dir, "bench.chat_history.txt")
+    records = synthetic_records(turns, text_chars, rng)
+
+    write_s = [timed(ai_assistant.write_history_journal, history_file, records)[0] for _ in range(runs)]
+    load_s = [timed(ai_assistant.load_chat_history, history_file)[0] for _ in range(runs)]
+
+    append_s = []
+    for run in range(runs):
+        journal = ai_assistant.ChatJournal(os.path.join(work_dir, f"append_{run}.chat_history.txt"))
+        seconds, _ = timed(lambda: [journal.append(record['role'], record['text']) for record in records])
+        journal.close()
+        append_s.append(seconds / len(records))
+
+    # Cold: the rolling summary is recomputed (one model call); warm: it is read back from disk
+    cold_s, warm_s = [], []
+    for _ in range(runs):
+        summary_file = ai_assistant.get_summary_file(history_file)
+        if os.path.exists(summary_file):
+            os.remove(summary_file)
+        cold_s.append(timed(ai_assistant.build_context_window, client, history_file)[0])
+        warm_s.append(timed(ai_assistant.build_context_window, client, history_file)[0])
+
+    # The same history as a compressed container (the rolling summary file is reused)
+    compressed_file = os.path.join(work_dir, "compressed.chat_history.txt")
+    shutil.copyfile(history_file, compressed_file)
+    shutil.copyfile(ai_assistant.get_summary_file(history_file), ai_assistant.get_summary_file(compressed_file))
+    compress_s, (_, compressed_bytes) = timed(ai_assistant.compress_history_file, compressed_file)
+    compressed_load_s = [timed(ai_assistant.load_chat_history, compressed_file)[0] for _ in range(runs)]
+    compressed_warm_s = [timed(ai_assistant.build_context_window, client, compressed_file)[0] for _ in range(runs)]
+
+    return {
+        'turns': turns,
+        'file_bytes': os.path.getsize(history_file),
+        'write_s': summarize(write_s),
+        'append_per_message_s': summarize(append_s),
+        'load_s': summarize(load_s),
+        'context_window_cold_s': summarize(cold_s),
+        'context_window_warm_s': summarize(warm_s),
+        'compressed_bytes': compressed_bytes,
+        'compress_s': round(compress_s, 6),
+        'compressed_load_s': summarize(compressed_load_s),
+        'compressed_context_window_warm_s': summarize(compressed_warm_s),
+    }
+
+def generate_tree(root, files, file_kb, rng):
+    """Writes a project tree: small source files (bundled), larger logs and PNG-named binary blobs."""
+    total = 0
+    for i in range(files):
+        folder = os.path.join(root, f"pkg{i % 8}")
+        os.makedirs(folder, exist_ok=True)
+        kind = i % 4
+        if kind == 3:
+            path, data = os.path.join(folder, f"image_{i}.png"), rng.randbytes(file_kb * 1024)
+        elif kind == 2:
+            path, data = os.path.join(folder, f"service_{i}.log"), ("".join(f"{n} INFO worker {i} handled a request in {n % 97}ms\n" for n in range(file_kb * 24))).encode()
+        else:
+            path, data = os.path.join(folder, f"module_{i}.py"), (f"def handler_{i}(value):\n    return value * {i}\n" * 20).encode()
+        with open(path, "wb") as f:
+            f.write(data)
+        total += len(data)
+    return total
+
+def bench_upload(work_dir, client, files, file_kb, runs, rng):
+    """upload_folder_contents on a cold and on a warm upload cache."""
+    tree = os.path.join(work_dir, "tree")
+    tree_bytes = generate_tree(tree, files, file_kb, rng)
+
+    cold, warm = [], []
+    for _ in range(runs):
+        if os.path.exists(ai_assistant.UPLOAD_CACHE_FILE):
+            os.remove(ai_assistant.UPLOAD_CACHE_FILE)
+        metrics = {}
+        seconds, _ = timed(ai_assistant.upload_folder_contents, client, tree, None, None, metrics)
+        cold.append((seconds, metrics))
+        metrics = {}
+        seconds, _ = timed(ai_assistant.upload_folder_contents, client, tree, None, None, metrics)
+        warm.append((seconds, metrics))
+        timed(ai_assistant.cleanup_uploaded_files, client)
+
+    return {
+        'files': files,
+        'tree_bytes': tree_bytes,
+        'files_uploaded': cold[-1][1].get('files_uploaded', 0),
+        'files_bundled': cold[-1][1].get('files_bundled', 0),
+        'cold_s': summarize([seconds for seconds, _ in cold]),
+        'cold_scan_s': summarize([metrics.get('scan_s', 0.0) for _, metrics in cold]),
+        'cold_upload_s': summarize([metrics.get('upload_s', 0.0) for _, metrics in cold]),
+        'warm_s': summarize([seconds for seconds, _ in warm]),
+        'files_reused_warm': warm[-1][1].get('files_reused', 0),
+    }
+
+def bench_terminal_history(home_dir, size_mb, runs):
+    """get_terminal_history (shell detection + tail read) on large histories of every shell."""
+    from bench_terminal_history import generate_history
+    results = {}
+    shell_before = os.environ.get("SHELL")
+    for shell, relative_path in SHELL_HISTORY_FILES.items():
+        history_file = os.path.join(home_dir, relative_path)
+        os.makedirs(os.path.dirname(history_file), exist_ok=True)
+        generate_history(history_file, shell, int(size_mb * 1024 * 1024))
+        os.environ["SHELL"] = f"/bin/{shell}"
+        samples = [timed(ai_assistant.get_terminal_history) for _ in range(runs)]
+        results[shell] = {'commands': len(samples[-1][1]), 'seconds': summarize([seconds for seconds, _ in samples])}
+        os.remove(history_file)
+    if shell_before is None:
+        os.environ.pop("SHELL", None)
+    else:
+        os.environ["SHELL"] = shell_before
+    return {'size_mb': size_mb, 'platform_supported': platform.system() == 'Linux', 'shells': results}
+
+def bench_turns(work_dir, client, turns, runs):
+    """End-to-end turns as in text mode: chat turns, then /analyze turns on the generated tree."""
+    history_file = os.path.join(work_dir, "turns.chat_history.txt")
+    command = ai_assistant.parse_analyze_command(f'/analyze {os.path.join(work_dir, "tree")} "What does this service do?"')
+    samples = {'chat': [], 'analyze': []}
+    failed = 0
+
+    for run in range(runs):
+        if os.path.exists(history_file):
+            os.remove(history_file)
+        ai_assistant.CURRENT_HISTORY_FILE = history_file
+        ai_assistant.CURRENT_JOURNAL = ai_assistant.ChatJournal(history_file)
+        chat = ai_assistant.create_chat(client, [])
+        for i in range(turns):
+            kind = 'analyze' if i % 4 == 3 else 'chat'
+            metrics = ai_assistant.new_turn_metrics('bench', kind)
+            try:
+                with redirect_stdout(io.StringIO()):
+                    message = ai_assistant.build_analyze_message(client, command, metrics=metrics) if kind == 'analyze' else f"Question {i}: why does the build fail?"
+                    reply = ai_assistant.send_with_context_cache(client, chat, message, metrics)
+                    ai_assistant.record_chat_turn(message, reply, metrics)
+                    chat = ai_assistant.compact_chat_if_needed(client, chat)
+                ai_assistant.finish_turn_metrics(metrics)
+                samples[kind].append(metrics)
+            except Exception:
+                ai_assistant.finish_turn_metrics(metrics, ok=False)
+                failed += 1
+        ai_assistant.close_chat_history()
+        timed(ai_assistant.cleanup_uploaded_files, client)
+
+    result = {'turns_per_run': turns, 'failed': failed}
+    for kind, records in samples.items():
+        for field in ('total_s', 'ttft_s', 'response_s', 'history_save_s'):
+            values = [record[field] for record in records if field in record]
+            if values:
+                result[f"{kind}_{field}"] = summarize(values)
+    return result
+
+def iter_medians(results, prefix=""):
+    """Yields (dotted name, median) for every summarized metric in a result object."""
+    for key, value in results.items():
+        if isinstance(value, dict) and 'median' in value:
+            yield prefix + key, value['median']
+        elif isinstance(value, dict):
+            yield from iter_medians(value, f"{prefix}{key}.")
+
+def find_regressions(results, baseline, tolerance):
+    """Metrics whose median grew by more than tolerance (relative) compared with the baseline."""
+    previous = dict(iter_medians(baseline.get('results', {})))
+    regressions = []
+    for name, median in iter_medians(results):
+        before = previous.get(name)
+        # Sub-millisecond medians are dominated by timer noise
+        if before and median > before * (1 + tolerance) and median - before > 0.001:
+            regressions.append({'metric': name, 'baseline': before, 'current': median, 'ratio': round(median / before, 2)})
+    return regressions
+
+def main():
+    global ai_assistant, fake_genai
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for ai_assistant.py")
+    parser.add_argument("--runs", type=int, default=3, help="Repetitions per measurement")
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds added to every fake API call")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of fake API calls failing with 503 (retried by ApiGuard)")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for generated data and failure injection")
+    parser.add_argument("--history-turns", type=int, default=5000)
+    parser.add_argument("--message-chars", type=int, default=400)
+    parser.add_argument("--upload-files", type=int, default=200)
+    parser.add_argument("--upload-file-kb", type=int, default=64)
+    parser.add_argument("--shell-history-mb", type=float, default=50)
+    parser.add_argument("--turns", type=int, default=12, help="End-to-end turns per run")
+    parser.add_argument("--output", metavar="FILE", help="Also write the JSON result to this file")
+    parser.add_argument("--baseline", metavar="FILE", help="Earlier result file to compare medians against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown against the baseline")
+    args = parser.parse_args()
+
+    scratch_dir = tempfile.mkdtemp(prefix="ai_assistant_bench_")
+    home_before = os.environ.get("HOME")
+    os.environ["HOME"] = scratch_dir
+    try:
+        import ai_assistant as ai_assistant_module
+        import fake_genai as fake_genai_module
+        ai_assistant, fake_genai = ai_assistant_module, fake_genai_module
+        ai_assistant.load_genai()
+        ai_assistant.METRICS_ENABLED = False
+
+        rng = random.Random(args.seed)
+        client = make_client(args.latency, args.failure_rate, args.seed)
+        work_dir = os.path.join(scratch_dir, "work")
+        os.makedirs(work_dir)
+
+        results = {
+            'history': bench_history(work_dir, client, args.history_turns, args.message_chars, args.runs, rng),
+            'upload': bench_upload(work_dir, client, args.upload_files, args.upload_file_kb, args.runs, rng),
+            'terminal_history': bench_terminal_history(scratch_dir, args.shell_history_mb, args.runs),
+            'turns': bench_turns(work_dir, client, args.turns, args.runs),
+        }
+        api = {key: round(value, 4) if isinstance(value, float) else value for key, value in ai_assistant.API_STATS.items()}
+    finally:
+        if home_before is None:
+            os.environ.pop("HOME", None)
+        else:
+            os.environ["HOME"] = home_before
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    report = {
+        'benchmark': 'offline',
+        'timestamp': round(time.time()),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+        'api': api,
+        'results': results,
+    }
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            report['regressions'] = find_regressions(results, json.load(f), args.tolerance)
+        exit_code = 1 if report['regressions'] else 0
+
+    output = json.dumps(report)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
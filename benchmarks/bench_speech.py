@@ -0,0 +1,114 @@
+"""
+Speech-to-text backend benchmark.
+
+Replays recorded WAV fixtures through each speech backend of ai_assistant.py and
+reports per-phrase latency and word error rate (WER) against a reference transcript.
+
+Fixture layout (not shipped, record your own): <fixtures dir>/<name>.wav with the
+expected transcript in <name>.txt next to it.
+
+Usage: python benchmarks/bench_speech.py --fixtures DIR [--backends google vosk whisper] [--lang en]
+Prints one JSON object.
+"""
+import os
+import re
+import sys
+import glob
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ai_assistant
+
+DEFAULT_FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "speech")
+
+def normalize_words(text):
+    """Lowercases and strips punctuation before comparing transcripts."""
+    return re.sub(r"[^\w\s']", " ", text.lower()).split()
+
+def word_error_rate(reference, hypothesis):
+    """Word-level Levenshtein distance divided by the reference length."""
+    ref = normalize_words(reference)
+    hyp = normalize_words(hypothesis)
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word),
+            )
+        previous = current
+    return previous[-1] / max(len(ref), 1)
+
+def load_fixtures(fixtures_dir):
+    """Returns [(name, AudioData, reference transcript)] for every WAV with a matching .txt."""
+    sr = ai_assistant.sr
+    fixtures = []
+    for wav_path in sorted(glob.glob(os.path.join(fixtures_dir, "*.wav"))):
+        transcript_path = os.path.splitext(wav_path)[0] + ".txt"
+        if not os.path.exists(transcript_path):
+            continue
+        with sr.AudioFile(wav_path) as source:
+            audio = ai_assistant.r.record(source)
+        with open(transcript_path, "r", encoding="utf-8") as f:
+            reference = f.read().strip()
+        fixtures.append((os.path.basename(wav_path), audio, reference))
+    return fixtures
+
+def run_backend(name, lang_code, fixtures):
+    """Replays all fixtures through one backend."""
+    try:
+        started = time.perf_counter()
+        backend = ai_assistant.SPEECH_BACKENDS[name](lang_code)
+        load_s = time.perf_counter() - started
+    except Exception as e:
+        return {'backend': name, 'error': f"load failed: {e}"}
+
+    phrases = []
+    for fixture_name, audio, reference in fixtures:
+        phrase = {'fixture': fixture_name}
+        started = time.perf_counter()
+        try:
+            hypothesis = backend.recognize(audio)
+        except Exception as e:
+            # Unrecognized audio counts as an empty transcript (WER 1.0)
+            hypothesis = ""
+            phrase['error'] = repr(e)
+        phrase.update({
+            'latency_s': round(time.perf_counter() - started, 4),
+            'wer': round(word_error_rate(reference, hypothesis), 4),
+            'hypothesis': hypothesis,
+        })
+        phrases.append(phrase)
+
+    latencies = [phrase['latency_s'] for phrase in phrases]
+    return {
+        'backend': name,
+        'load_s': round(load_s, 4),
+        'latency_median_s': round(statistics.median(latencies), 4) if latencies else None,
+        'latency_max_s': max(latencies) if latencies else None,
+        'wer_mean': round(statistics.mean(phrase['wer'] for phrase in phrases), 4) if phrases else None,
+        'phrases': phrases,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Speech-to-text backend benchmark")
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR, help="Directory with <name>.wav + <name>.txt pairs")
+    parser.add_argument("--backends", nargs="+", default=list(ai_assistant.SPEECH_BACKENDS))
+    parser.add_argument("--lang", default="en", help="Language code passed to the backends")
+    args = parser.parse_args()
+
+    ai_assistant.load_speech_recognition()
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        sys.exit(f"No WAV fixtures with transcripts found in {args.fixtures}")
+
+    results = [run_backend(name, args.lang, fixtures) for name in args.backends]
+    print(json.dumps({'benchmark': 'speech', 'fixtures': len(fixtures), 'lang': args.lang, 'results': results}, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
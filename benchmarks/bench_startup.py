@@ -0,0 +1,90 @@
+"""
+Startup benchmark for ai_assistant.py.
+
+Measures, in fresh interpreters:
+  - import_s:        time to import the ai_assistant module
+  - first_prompt_s:  time from process start until the language prompt is printed
+
+Usage: python benchmarks/bench_startup.py [--runs N]
+Prints one JSON object with min/median/max per metric.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT_PATH = os.path.join(REPO_DIR, "ai_assistant.py")
+FIRST_PROMPT_MARKER = b"Your choice"
+
+IMPORT_SNIPPET = (
+    "import time; started = time.perf_counter(); "
+    "import ai_assistant; "
+    "print(time.perf_counter() - started)"
+)
+
+def benchmark_env():
+    """Environment for child processes: a dummy key so the background client warm-up runs as in real use."""
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "benchmark-dummy-key")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+def measure_import():
+    """Returns the module import time measured inside a fresh interpreter."""
+    output = subprocess.check_output([sys.executable, "-c", IMPORT_SNIPPET], cwd=REPO_DIR, env=benchmark_env())
+    return float(output.decode().strip().splitlines()[-1])
+
+def measure_first_prompt(timeout=30.0):
+    """Returns the wall time from spawning the script until the first input prompt appears."""
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-u", SCRIPT_PATH],
+        cwd=REPO_DIR,
+        env=benchmark_env(),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+    buffer = b""
+    try:
+        while FIRST_PROMPT_MARKER not in buffer:
+            chunk = process.stdout.read1(4096)
+            if not chunk:
+                raise RuntimeError("Process exited before the first prompt:\n" + buffer.decode(errors="replace"))
+            buffer += chunk
+            if time.perf_counter() - started > timeout:
+                raise RuntimeError("Timed out waiting for the first prompt")
+        return time.perf_counter() - started
+    finally:
+        process.kill()
+        process.wait()
+
+def summarize(samples):
+    """min/median/max of a list of seconds."""
+    return {
+        'min': round(min(samples), 4),
+        'median': round(statistics.median(samples), 4),
+        'max': round(max(samples), 4),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark for ai_assistant.py")
+    parser.add_argument("--runs", type=int, default=5, help="Number of cold starts per metric")
+    args = parser.parse_args()
+
+    import_samples = [measure_import() for _ in range(args.runs)]
+    prompt_samples = [measure_first_prompt() for _ in range(args.runs)]
+
+    print(json.dumps({
+        'benchmark': 'startup',
+        'runs': args.runs,
+        'import_s': summarize(import_samples),
+        'first_prompt_s': summarize(prompt_samples),
+    }))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmark for reading the tail of large shell history files.
+
+Generates synthetic bash, zsh (extended history) and fish histories of the given
+sizes and compares ai_assistant.read_shell_history_tail with the previous
+readlines()-based approach (time and peak Python memory).
+
+Usage: python benchmarks/bench_terminal_history.py [--sizes-mb 1 10 50] [--runs N]
+Prints one JSON object.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ai_assistant
+
+ENTRY_TEMPLATES = {
+    'bash': "#{ts}\ngit commit -m 'change number {i}' && make test TARGET=build_{i}\n",
+    'zsh': ": {ts}:0;git commit -m 'change number {i}' && make test TARGET=build_{i}\n",
+    'fish': "- cmd: git commit -m 'change number {i}' && make test TARGET=build_{i}\n  when: {ts}\n  paths:\n    - build_{i}\n",
+}
+
+def generate_history(path, shell, size_bytes):
+    """Writes a synthetic history file of roughly size_bytes."""
+    template = ENTRY_TEMPLATES[shell]
+    written = 0
+    i = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < size_bytes:
+            chunk = "".join(template.format(ts=1700000000 + n, i=n) for n in range(i, i + 1000))
+            f.write(chunk)
+            written += len(chunk)
+            i += 1000
+
+def baseline_readlines(history_file, shell, limit):
+    """The previous implementation: read the whole file and keep the last entries."""
+    with open(history_file, "r") as file:
+        history = file.readlines()
+        if shell == 'fish':
+            commands = [line.strip()[6:] for line in history if line.startswith('- cmd: ')]
+        else:
+            commands = [line.strip() for line in history if line.strip() and not line.strip().startswith('#')]
+    return commands[-limit:]
+
+def measure(function, history_file, shell, runs):
+    """Returns (best seconds, peak traced bytes) for a reader."""
+    best = float("inf")
+    for _ in range(runs):
+        started = time.perf_counter()
+        function(history_file, shell, ai_assistant.HISTORY_LIMIT)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    function(history_file, shell, ai_assistant.HISTORY_LIMIT)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Shell history tail benchmark")
+    parser.add_argument("--sizes-mb", type=float, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for shell in ('bash', 'zsh', 'fish'):
+            for size_mb in args.sizes_mb:
+                history_file = os.path.join(tmp_dir, f"{shell}_{size_mb}.history")
+                generate_history(history_file, shell, int(size_mb * 1024 * 1024))
+                tail_s, tail_peak = measure(ai_assistant.read_shell_history_tail, history_file, shell, args.runs)
+                base_s, base_peak = measure(baseline_readlines, history_file, shell, args.runs)
+                results.append({
+                    'shell': shell,
+                    'size_mb': size_mb,
+                    'tail_s': round(tail_s, 6),
+                    'tail_peak_bytes': tail_peak,
+                    'readlines_s': round(base_s, 6),
+                    'readlines_peak_bytes': base_peak,
+                })
+                os.remove(history_file)
+
+    print(json.dumps({'benchmark': 'terminal_history', 'limit': ai_assistant.HISTORY_LIMIT, 'results': results}))
+
+if __name__ == "__main__":
+    main()
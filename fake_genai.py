@@ -0,0 +1,298 @@
+"""
+In-process stand-in for google.genai.Client, used to run the assistant without network access.
+
+Start the assistant with AI_ASSISTANT_FAKE_CLIENT=1 (no API key needed) to exercise uploads,
+history handling and /analyze --cache offline. Only the calls made by ai_assistant.py are
+implemented. Replies describe what the model received instead of answering, e.g.
+
+    [fake gemini-2.5-flash-lite] 3 part(s), 12 history turn(s), 1840 chars; cached: cachedContents/1 (4 parts)
+
+so it is easy to see which turns carry the files and which ones use the cache.
+Calls to a missing file or cache fail with a 404 NOT_FOUND error like the real API, and
+FakeClient(failure_rate=...) makes remote calls fail at random with 503 UNAVAILABLE.
+"""
+
+import asyncio
+import itertools
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+
+class FakeNotFoundError(Exception):
+    """Raised for unknown files and caches (str() contains 404 NOT_FOUND like an APIError)."""
+
+    def __init__(self, name):
+        super().__init__(f"404 NOT_FOUND. {{'error': {{'code': 404, 'message': '{name} not found', 'status': 'NOT_FOUND'}}}}")
+
+
+class FakeServerError(Exception):
+    """Injected transient failure; carries .code like google.genai.errors.ServerError."""
+
+    def __init__(self):
+        self.code = 503
+        super().__init__("503 UNAVAILABLE. {'error': {'code': 503, 'message': 'The model is overloaded (injected).', 'status': 'UNAVAILABLE'}}")
+
+
+def _parse_ttl(ttl):
+    """Seconds from an SDK duration string such as '600s'."""
+    return float(str(ttl).rstrip('s'))
+
+
+def _part_text(part):
+    """Text of a message item or Part, for size accounting."""
+    if isinstance(part, str):
+        return part
+    return getattr(part, 'text', None) or ""
+
+
+def _as_parts(message):
+    """Normalizes the message argument of send_message into a list."""
+    return list(message) if isinstance(message, (list, tuple)) else [message]
+
+
+def _usage(message, reply, cached_parts=()):
+    """usage_metadata of a reply, counting about four characters per token like the real tokenizer."""
+    cached = sum(len(_part_text(part)) for part in cached_parts) // 4
+    return SimpleNamespace(
+        prompt_token_count=sum(len(_part_text(part)) for part in _as_parts(message)) // 4 + cached,
+        candidates_token_count=len(reply) // 4,
+        cached_content_token_count=cached or None,
+    )
+
+
+class FakeFiles:
+    """client.files: upload, get, delete."""
+
+    def __init__(self, client):
+        self._client = client
+        self._counter = itertools.count(1)
+        self._files = {}
+
+    def upload(self, file, mime_type=None, config=None):
+        self._client._delay()
+        name = f"files/fake-{next(self._counter)}"
+        with open(file, 'rb') as f:
+            size = len(f.read())
+        uploaded = SimpleNamespace(
+            name=name,
+            uri=f"https://fake.invalid/v1beta/{name}",
+            mime_type=mime_type or "application/octet-stream",
+            size_bytes=size,
+            expiration_time=datetime.now(timezone.utc) + timedelta(hours=48),
+        )
+        with self._client._lock:
+            self._files[name] = uploaded
+        return uploaded
+
+    def get(self, name):
+        with self._client._lock:
+            if name not in self._files:
+                raise FakeNotFoundError(name)
+            return self._files[name]
+
+    def delete(self, name):
+        self._client._delay()
+        with self._client._lock:
+            if self._files.pop(name, None) is None:
+                raise FakeNotFoundError(name)
+
+
+class FakeCaches:
+    """client.caches: create, get, update, delete with server-side expiry."""
+
+    def __init__(self, client):
+        self._client = client
+        self._counter = itertools.count(1)
+        self._caches = {}
+
+    def create(self, model, config):
+        self._client._delay()
+        name = f"cachedContents/{next(self._counter)}"
+        parts = [part for content in config.contents for part in content.parts]
+        cache = SimpleNamespace(
+            name=name,
+            model=model,
+            display_name=getattr(config, 'display_name', None),
+            parts=parts,
+            expires_at=time.time() + _parse_ttl(config.ttl),
+        )
+        with self._client._lock:
+            self._caches[name] = cache
+        return cache
+
+    def get(self, name):
+        with self._client._lock:
+            cache = self._caches.get(name)
+            if cache is None or cache.expires_at <= time.time():
+                self._caches.pop(name, None)
+                raise FakeNotFoundError(name)
+            return cache
+
+    def update(self, name, config):
+        self._client._delay()
+        cache = self.get(name)
+        cache.expires_at = time.time() + _parse_ttl(config.ttl)
+        return cache
+
+    def delete(self, name):
+        self._client._delay()
+        self.get(name)
+        with self._client._lock:
+            self._caches.pop(name, None)
+
+
+class FakeChat:
+    """A chat session: keeps the history and answers with a description of the request."""
+
+    def __init__(self, client, model, history, config):
+        self._client = client
+        self._model = model
+        self._history = list(history or [])
+        self._config = config
+
+    def get_history(self):
+        return list(self._history)
+
+    def _reply(self, message, config):
+        """Returns the reply text and its usage_metadata."""
+        config = config or self._config
+        parts = _as_parts(message)
+        chars = sum(len(_part_text(part)) for part in parts)
+        cached = ""
+        cached_parts = ()
+        cache_name = getattr(config, 'cached_content', None)
+        if cache_name:
+            cache = self._client.caches.get(cache_name)
+            if getattr(config, 'system_instruction', None):
+                raise ValueError("400 INVALID_ARGUMENT. CachedContent can not be used with system_instruction")
+            cached = f"; cached: {cache_name} ({len(cache.parts)} parts)"
+            cached_parts = cache.parts
+        reply = (f"[fake {self._model}] {len(parts)} part(s), {len(self._history)} history turn(s), "
+                 f"{chars} chars{cached}")
+        return reply, _usage(message, reply, cached_parts)
+
+    @staticmethod
+    def _chunks(reply, usage):
+        """Splits a reply into stream chunks; the last one carries the usage totals."""
+        starts = range(0, len(reply), 16)
+        return [SimpleNamespace(text=reply[start:start + 16], usage_metadata=usage if start == starts[-1] else None) for start in starts]
+
+    def _record(self, message, reply):
+        user_parts = [SimpleNamespace(text=part) if isinstance(part, str) else part for part in _as_parts(message)]
+        self._history.append(SimpleNamespace(role='user', parts=user_parts))
+        self._history.append(SimpleNamespace(role='model', parts=[SimpleNamespace(text=reply)]))
+
+    def send_message(self, message, config=None):
+        reply, usage = self._reply(message, config)
+        self._client._delay()
+        self._record(message, reply)
+        return SimpleNamespace(text=reply, usage_metadata=usage)
+
+    def send_message_stream(self, message, config=None):
+        reply, usage = self._reply(message, config)
+        self._client._delay()
+        yield from self._chunks(reply, usage)
+        self._record(message, reply)
+
+
+class FakeAsyncChat(FakeChat):
+    """client.aio chat session: the same replies, awaited."""
+
+    async def send_message(self, message, config=None):
+        reply, usage = self._reply(message, config)
+        await self._client._async_delay()
+        self._record(message, reply)
+        return SimpleNamespace(text=reply, usage_metadata=usage)
+
+    async def send_message_stream(self, message, config=None):
+        reply, usage = self._reply(message, config)
+        await self._client._async_delay()
+
+        async def chunks():
+            for chunk in self._chunks(reply, usage):
+                yield chunk
+            self._record(message, reply)
+        return chunks()
+
+
+class FakeChats:
+    """client.chats: create."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, history=None, config=None):
+        return FakeChat(self._client, model, history, config)
+
+
+class FakeAsyncChats:
+    """client.aio.chats: create."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, model, history=None, config=None):
+        return FakeAsyncChat(self._client, model, history, config)
+
+
+class FakeModels:
+    """client.models: generate_content (used for history summaries)."""
+
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, model, contents, config=None):
+        self._client._delay()
+        chars = sum(len(_part_text(part)) for part in _as_parts(contents))
+        return SimpleNamespace(text=f"[fake {model} summary of {chars} chars]")
+
+
+class FakeAsyncModels:
+    """client.aio.models: generate_content."""
+
+    def __init__(self, client):
+        self._client = client
+
+    async def generate_content(self, model, contents, config=None):
+        await self._client._async_delay()
+        parts = _as_parts(contents)
+        chars = sum(len(_part_text(part)) for part in parts)
+        reply = f"[fake {model}] {len(parts)} part(s), {chars} chars"
+        return SimpleNamespace(text=reply, usage_metadata=_usage(contents, reply))
+
+
+class FakeClient:
+    """
+    Drop-in replacement for genai.Client (including client.aio). Every remote call takes `latency`
+    seconds and fails with FakeServerError with probability `failure_rate`.
+    """
+
+    def __init__(self, api_key=None, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.files = FakeFiles(self)
+        self.caches = FakeCaches(self)
+        self.chats = FakeChats(self)
+        self.models = FakeModels(self)
+        self.aio = SimpleNamespace(models=FakeAsyncModels(self), chats=FakeAsyncChats(self))
+
+    def _should_fail(self):
+        with self._lock:
+            return self.failure_rate > 0 and self._random.random() < self.failure_rate
+
+    def _delay(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self._should_fail():
+            raise FakeServerError()
+
+    async def _async_delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self._should_fail():
+            raise FakeServerError()